@@ -3,16 +3,23 @@
 This module uses the aiohttp library in order to create a web server which will
 expose the service to run experiments and states. The asyncio  is also used to 
 achieved asynchronous services and the negotiation between the client and the 
-server is done via JSON messages.
+server is done via JSON messages. The states can also be streamed over a
+WebSocket, each message is acknowledged once it is applied or replaced by a
+newer one. The animations are played from their keyframes at the frame rate
+the serial link sustains. The experiments are queued, they can be listed,
+inspected and canceled. A state or an experiment can be previewed: it is
+compiled and its transmission predicted without sending anything.
 """
-from aiohttp import web
+from aiohttp import web, WSMsgType
 import asyncio
 import json
 import time
 import argparse
+from functools import partial
 
 import experiment.experimentctrl as ec
 import experiment.utils.logger as my_logger
+import experiment.utils.metrics as metrics
 
 logger = my_logger.get_logger('apiserver')
 
@@ -22,16 +29,104 @@ async def runExperiment(request):
         runExperiment service is a HTTP POST request.
         ----------
         request : JSON
-            Set of states and time for the corresponding experiment.
+            Set of states and time for the corresponding experiment, with
+            its optional priority and preempt in the queue.
         Returns
         -------
-        JSON to confirm the reception of the experiment.
+        JSON with the experiment id, the predicted bytes, instructions and
+        transmit time in seconds and the seconds until it starts, or the
+        error.
     """
     logger.info("Experiment received")
+    metrics.inc('moca_requests_total', kind='experiment')
     try:
-        data = await request.json()
-        asyncio.ensure_future(ec.runExperiment(data))
-        response_obj = {'status': 'received'}
+        with metrics.span('request'):
+            data = await request.json()
+        with metrics.span('parse'):
+            exp = ec.parseExperiment(data)
+            priority, preempt = ec.parseJob(data)
+        compiled = ec.compileExperiment(exp)
+        ec.runExperiment(compiled, priority, preempt)
+        response_obj = dict(ec.jobs.inspect(compiled.id), status='received')
+        return web.Response(text=json.dumps(response_obj))
+    except ValueError as e:
+        logger.error(e)
+        response_obj = {'error': str(e)}
+        return web.Response(text=json.dumps(response_obj))
+
+
+async def previewRequest(request):
+    """ 
+        previewRequest service is a HTTP POST request, nothing is sent to
+        the arena.
+        ----------
+        request : JSON
+            State or experiment to preview, as for runState and
+            runExperiment.
+        Returns
+        -------
+        JSON with the compiled frames in base64 RGB and the predicted
+        instructions, bytes and transmit time of each state, or the error.
+    """
+    metrics.inc('moca_requests_total', kind='preview')
+    try:
+        with metrics.span('request'):
+            data = await request.json()
+        response_obj = ec.preview(data)
+        return web.Response(text=json.dumps(response_obj))
+    except ValueError as e:
+        logger.error(e)
+        response_obj = {'error': str(e)}
+        return web.Response(text=json.dumps(response_obj))
+
+
+async def listExperiments(request):
+    """ 
+        listExperiments service is a HTTP GET request.
+        ----------
+        request : None
+        Returns
+        -------
+        JSON with the running experiment and the queued ones in the order
+        they run, each one with the seconds until it starts.
+    """
+    response_obj = {'experiments': ec.jobs.summary()}
+    return web.Response(text=json.dumps(response_obj))
+
+
+async def inspectExperiment(request):
+    """ 
+        inspectExperiment service is a HTTP GET request.
+        ----------
+        request : URL
+            The id of the experiment.
+        Returns
+        -------
+        JSON with the status of the experiment and the seconds until it
+        starts, or the error.
+    """
+    try:
+        response_obj = ec.jobs.inspect(request.match_info['id'])
+        return web.Response(text=json.dumps(response_obj))
+    except ValueError as e:
+        logger.error(e)
+        response_obj = {'error': str(e)}
+        return web.Response(text=json.dumps(response_obj))
+
+
+async def cancelExperiment(request):
+    """ 
+        cancelExperiment service is a HTTP DELETE request.
+        ----------
+        request : URL
+            The id of the experiment, queued or running.
+        Returns
+        -------
+        JSON to confirm the cancelation, or the error.
+    """
+    try:
+        job = ec.jobs.cancel(request.match_info['id'])
+        response_obj = {'status': job.status, 'id': job.compiled.id}
         return web.Response(text=json.dumps(response_obj))
     except ValueError as e:
         logger.error(e)
@@ -51,8 +146,13 @@ async def runState(request):
     """
     try:
         logger.info("State received")
-        data = await request.json()
-        asyncio.ensure_future(ec.runState(data))
+        metrics.inc('moca_requests_total', kind='state')
+        with metrics.span('request'):
+            data = await request.json()
+        with metrics.span('parse'):
+            arena = ec.parseState(data)
+        state = ec.compileState(arena)
+        asyncio.ensure_future(ec.runState(state))
         response_obj = {'status': 'received'}
         return web.Response(text=json.dumps(response_obj))
     except ValueError as e:
@@ -60,6 +160,151 @@ async def runState(request):
         response_obj = {'error': str(e)}
         return web.Response(text=json.dumps(response_obj))
 
+
+async def runAnimation(request):
+    """ 
+        runAnimation service is a HTTP POST request.
+        ----------
+        request : JSON
+            Animation with its frame rate, repetitions and keyframes, each
+            keyframe with its time, easing and arena.
+        Returns
+        -------
+        JSON with the frames expected and the duration in seconds of the
+        animation, or the error.
+    """
+    logger.info("Animation received")
+    metrics.inc('moca_requests_total', kind='animation')
+    try:
+        with metrics.span('request'):
+            data = await request.json()
+        with metrics.span('parse'):
+            animation = ec.parseAnimation(data)
+        frames = ec.compileAnimation(animation)
+        asyncio.ensure_future(ec.runAnimation(animation, frames))
+        response_obj = {
+            'status': 'received',
+            'frames': animation.frameCount(),
+            'duration': animation.duration() * animation.repetitions
+        }
+        return web.Response(text=json.dumps(response_obj))
+    except ValueError as e:
+        logger.error(e)
+        response_obj = {'error': str(e)}
+        return web.Response(text=json.dumps(response_obj))
+
+
+async def getAnimation(request):
+    """ 
+        getAnimation service is a HTTP GET request.
+        ----------
+        request : None
+        Returns
+        -------
+        JSON with the status of the last animation, its target and achieved
+        frame rate and the frames applied and dropped.
+    """
+    return web.Response(text=json.dumps(ec.animator.stats))
+
+
+async def streamStates(request):
+    """ 
+        streamStates service is a WebSocket. When the serial link cannot
+        keep up only the newest message waiting is sent, the others are
+        dropped.
+        ----------
+        request : JSON messages
+            Each one with an `id` chosen by the client and either an `arena`,
+            as a state, or a raw `frame` with the geometry of the arena, its
+            `brightness` and `rgb`, the base64 of three bytes per LED.
+        Returns
+        -------
+        One JSON message per message received with its `id` and the
+        `status` applied or dropped, or the error.
+    """
+    ws = web.WebSocketResponse()
+    await ws.prepare(request)
+    logger.info("Stream opened")
+    counts = {'applied': 0, 'dropped': 0, 'error': 0}
+    async for message in ws:
+        if message.type != WSMsgType.TEXT:
+            continue
+        metrics.inc('moca_requests_total', kind='stream')
+        ident = None
+        try:
+            with metrics.span('parse'):
+                data = json.loads(message.data)
+            if isinstance(data, dict):
+                ident = data.get('id')
+            state = ec.parseStreamed(data)
+        except ValueError as e:
+            counts['error'] += 1
+            await ws.send_json({'id': ident, 'error': str(e)})
+            continue
+        ec.postState(state).add_done_callback(
+            partial(acknowledge, ws, ident, counts)
+        )
+    logger.info("Stream closed: %s" % (counts))
+    return ws
+
+
+def acknowledge(ws, ident, counts, future):
+    """ Sends the status of a streamed message once it is settled. """
+    applied = not future.cancelled() and future.result()
+    status = 'applied' if applied else 'dropped'
+    counts[status] += 1
+    if not ws.closed:
+        asyncio.ensure_future(ws.send_json({'id': ident, 'status': status}))
+
+
+async def setTrace(request):
+    """ 
+        setTrace service is a HTTP POST request.
+        ----------
+        request : JSON
+            Object with `every`, 0 disables the per element messages and n
+            logs one of every n.
+        Returns
+        -------
+        JSON to confirm the new sampling.
+    """
+    try:
+        data = await request.json()
+        if not isinstance(data, dict) or 'every' not in data:
+            raise ValueError("missing 'every'")
+        my_logger.set_trace(data['every'])
+        response_obj = {'status': 'trace', 'every': data['every']}
+        return web.Response(text=json.dumps(response_obj))
+    except ValueError as e:
+        logger.error(e)
+        response_obj = {'error': str(e)}
+        return web.Response(text=json.dumps(response_obj))
+
+
+async def getMetrics(request):
+    """ 
+        getMetrics service is a HTTP GET request.
+        ----------
+        request : None
+        Returns
+        -------
+        The metrics in the Prometheus text format: latency of every stage,
+        bytes and instructions per state, start delay of the scheduled
+        states and the serial counters.
+    """
+    return web.Response(text=metrics.render(), content_type='text/plain')
+
+
+async def startSession(app):
+    """ Opens the shared serial session when the server starts. """
+    ec.openSession()
+
+
+async def closeSession(app):
+    """ Closes the shared serial session when the server stops. """
+    ec.closeSession()
+
+
 def main():
 
     parser = argparse.ArgumentParser(description='ArenaHandler API Server')
@@ -72,7 +317,24 @@ def main():
     args = parser.parse_args()
     app = web.Application()
     app.router.add_post('/arena-handler/api/v1.0/experiment', runExperiment)
+    app.router.add_get(
+        '/arena-handler/api/v1.0/experiments', listExperiments
+    )
+    app.router.add_get(
+        '/arena-handler/api/v1.0/experiments/{id}', inspectExperiment
+    )
+    app.router.add_delete(
+        '/arena-handler/api/v1.0/experiments/{id}', cancelExperiment
+    )
     app.router.add_post('/arena-handler/api/v1.0/state', runState)
+    app.router.add_post('/arena-handler/api/v1.0/preview', previewRequest)
+    app.router.add_post('/arena-handler/api/v1.0/animation', runAnimation)
+    app.router.add_get('/arena-handler/api/v1.0/animation', getAnimation)
+    app.router.add_post('/arena-handler/api/v1.0/trace', setTrace)
+    app.router.add_get('/arena-handler/api/v1.0/stream', streamStates)
+    app.router.add_get('/metrics', getMetrics)
+    app.on_startup.append(startSession)
+    app.on_cleanup.append(closeSession)
     web.run_app(app, host=args.host, port=args.port)
 
 if __name__ == '__main__':
@@ -0,0 +1,411 @@
+#!/usr/bin/python
+"""
+This module benchmarks the compile and transmit path of the states and
+experiments against the virtual Arduino, no hardware is needed. The demos,
+the samples and synthetic arenas of 960 LEDs are replayed and for each one
+the instructions, bytes and shows of the strip per state, the compile time,
+the time until the whole state is visible and the jitter of the state
+boundaries, when the states are sent ahead by their lead time, are reported.
+Each case is measured ROUNDS times and its timings are the median of the
+rounds, so a round slowed down by the host is not taken for a regression.
+The results are compared with the baseline stored for the same protocol and
+commit mode to catch regressions. The range index resolver is first timed
+against the scalar functions on the synthetic arenas, it is checked against
+them by tests/test_indexresolver.py.
+The synthetic arenas are also split between two virtual Arduinos to compare
+the time until they are visible with a single one.
+
+Go to the arenahandler directory and execute:
+
+    python benchmark.py [--save] [--tolerance] [--protocol] [--progressive]
+                        [--verbose]
+"""
+import argparse
+import asyncio
+import glob
+import itertools
+import json
+import logging
+import os
+import statistics
+import sys
+import time
+
+import experiment.experimentctrl as ec
+from experiment.arduinointf.ArduinoInstruction import ArduinoInstruction
+from experiment.arduinointf.VirtualArduino import PtyEmulator
+from experiment.component.Arena import Arena
+from experiment.component.Experiment import Experiment
+from experiment.component.Frame import Frame
+from experiment.framecompiler import compileArena
+from experiment.indexresolver import absolute, fromNegToPosEq
+from experiment.scheduler import Scheduler
+from experiment.serialwriter import SerialWriter
+from experiment.topology import Shard
+
+BASELINE = 'benchmark.baseline.json'
+DEMO_DIR = os.path.join('..', 'demo')
+COMPILE_ROUNDS = 20
+MAX_EVENTS = 12
+ROUNDS = 3
+# Metrics of a case taken as the median of its rounds
+TIMINGS = ('compile_ms', 'visible_ms', 'jitter_ms', 'coalesced')
+TIME_SCALE = 0.05
+# Metrics where a bigger value is a regression, with the absolute slack
+METRICS = {
+    'instructions': 0,
+    'bytes': 0,
+    'compile_ms': 0.5,
+    'visible_ms': 10,
+    'jitter_ms': 20
+}
+COLORS = ['red', 'green', 'blue', 'yellow', 'white', 'cyan', 'magenta']
+
+
+def syntheticArenas():
+    """ Arenas of 960 LEDs with ranges and negative indexes. """
+    ranges = {
+        'edges': 8, 'blocks': 10, 'leds': 12, 'brightness': 50,
+        'color': 'none',
+        'edge': [{
+            'index': [1, 8, 2], 'color': 'red',
+            'block': [{'index': [-1, -3, -1], 'color': 'blue'}],
+            'led': [{'index': [-2, 5], 'color': 'white'}]
+        }],
+        'block': [{
+            'index': [-1, -80, -3], 'color': 'green',
+            'led': [{'index': [1, 12, 2], 'color': 'yellow'}]
+        }],
+        'led': [
+            {'index': [1, 960, 7], 'color': 'white'},
+            {'index': [-1, -960, -11], 'color': 'cyan'}
+        ]
+    }
+    leds = {
+        'edges': 8, 'blocks': 10, 'leds': 12, 'brightness': 50,
+        'color': 'omit',
+        'led': [
+            {'index': [k, 960, len(COLORS)], 'color': color}
+            for k, color in enumerate(COLORS, 1)
+        ]
+    }
+    return {'synthetic-ranges': ranges, 'synthetic-leds': leds}
+
+
+def loadScenarios():
+    """
+    The scenarios to replay, each one is a tuple with the list of (offset,
+    arena) events and the experiment, None for a single state. The events
+    are limited to the first MAX_EVENTS.
+    """
+    scenarios = {}
+    files = sorted(glob.glob(os.path.join(DEMO_DIR, '*.json')))
+    files += ['arena.sample.json', 'experiment.sample.json']
+    for path in files:
+        name = os.path.splitext(os.path.basename(path))[0]
+        with open(path) as f:
+            data = json.load(f)
+        if 'experiment' in data:
+            exp = Experiment.fromDict(data['experiment'])
+            events = []
+            for event in exp.timeline():
+                if len(events) == MAX_EVENTS:
+                    break
+                events.append(event)
+            scenarios[name] = events, exp
+        else:
+            scenarios[name] = [(0, Arena.fromDict(data['arena']))], None
+    for name, arena in syntheticArenas().items():
+        scenarios[name] = [(0, Arena.fromDict(arena))], None
+    return scenarios
+
+
+def measureResolver(arenas):
+    """
+    Resolves and paints the LED indexes of the arenas with the ranges and
+    element by element, returns both times in milliseconds.
+    """
+    def byRanges(frame, index, space, color):
+        for positions in absolute(index, space):
+            frame.fill(
+                range(positions.start - 1, positions.stop - 1, positions.step),
+                color
+            )
+
+    def byElement(frame, index, space, color):
+        for i in index:
+            position = (fromNegToPosEq(space, i) if i < 0 else i) - 1
+            if 0 <= position < space:
+                frame.pixels[position] = color
+
+    times = []
+    for paint in (byRanges, byElement):
+        rounds = []
+        for i in range(COMPILE_ROUNDS):
+            start = time.perf_counter()
+            for arena in arenas:
+                frame = Frame(
+                    arena.edges, arena.blocks, arena.leds, arena.brightness
+                )
+                for led in arena.led:
+                    paint(frame, led.index, len(frame.pixels), led.color)
+            rounds.append(time.perf_counter() - start)
+        times.append(statistics.median(rounds) * 1000)
+    return times
+
+
+def connect(emulator, protocol, commit):
+    """ A session on the virtual Arduino, a pty does not reset it. """
+    aIns = ArduinoInstruction(
+        emulator.port, emulator.baud, protocol=protocol, commit=commit
+    )
+    aIns.START_WAIT_TIME = 0
+    aIns.ensure_connection()
+    return aIns
+
+
+def whole(aIns):
+    """ The controllers of a single session driving the whole arena. """
+    return [(Shard(aIns.port, aIns.baud, 'blocks', 1, None, Shard.LEDS), aIns)]
+
+
+def measureStates(events, protocol, commit):
+    """
+    Compiles and sends every state in order, one after the other. A state
+    is consistent if the strip shows all of it once it is sent.
+    """
+    emulator = PtyEmulator().start()
+    aIns = connect(emulator, protocol, commit)
+    compileTimes, visibleTimes, instructions, sent = [], [], [], []
+    shows = []
+    consistent = True
+    try:
+        for offset, arena in events:
+            rounds = []
+            for i in range(COMPILE_ROUNDS):
+                start = time.perf_counter()
+                frame = compileArena(arena)
+                rounds.append(time.perf_counter() - start)
+            compileTimes.append(statistics.median(rounds))
+            sentBefore = aIns.stats.bytes
+            showsBefore = emulator.arduino.shows
+            start = time.perf_counter()
+            instructions.append(ec.sendFrame(frame, aIns))
+            visibleTimes.append(time.perf_counter() - start)
+            sent.append(aIns.stats.bytes - sentBefore)
+            shows.append(emulator.arduino.shows - showsBefore)
+            consistent = consistent and all(
+                pixel is None or emulator.arduino.visible[i] == pixel
+                for i, pixel in enumerate(frame.pixels)
+            )
+    finally:
+        aIns.close_connection()
+        emulator.stop()
+    return {
+        'states': len(events),
+        'instructions': statistics.mean(instructions),
+        'bytes': statistics.mean(sent),
+        'shows': statistics.mean(shows),
+        'compile_ms': statistics.mean(compileTimes) * 1000,
+        'visible_ms': max(visibleTimes) * 1000,
+        'consistent': consistent
+    }
+
+
+def measureScenario(events, exp, protocol, commit):
+    """
+    Measures the states and the jitter of a scenario ROUNDS times. The
+    TIMINGS are the median of the rounds, the scenario is consistent if
+    every round is.
+    """
+    rounds = []
+    for i in range(ROUNDS):
+        metrics = measureStates(events, protocol, commit)
+        metrics['jitter_ms'], metrics['coalesced'] = \
+            measureJitter(exp, protocol, commit) \
+            if len(events) > 1 else (0, 0)
+        rounds.append(metrics)
+    metrics = dict(rounds[0])
+    for metric in TIMINGS:
+        metrics[metric] = statistics.median(m[metric] for m in rounds)
+    metrics['consistent'] = all(m['consistent'] for m in rounds)
+    return metrics
+
+
+def measureJitter(exp, protocol, commit):
+    """
+    Runs the first MAX_EVENTS states of the compiled experiment on the
+    scheduler and the serial writer with the offsets scaled by TIME_SCALE,
+    each state ahead of its boundary by its lead time. The jitter is the
+    worst error between a boundary and the moment the state was visible.
+    Returns the jitter and the coalesced states.
+    """
+    emulator = PtyEmulator().start()
+    aIns = connect(emulator, protocol, commit)
+    scheduler = Scheduler()
+
+    def send(state):
+        return ec.sendShards(state, drivers)
+
+    def post(state):
+        posted.append(writer.post(state))
+        return posted[-1]
+
+    def lead(state):
+        return ec.leadTime(state, drivers)
+
+    async def run(scaled):
+        await scheduler.start(scaled, post, lead)
+        await posted[-1]
+        writer.stop()
+
+    drivers = whole(aIns)
+    compiled = ec.compileExperiment(exp, drivers)
+    scaled = [
+        (offset * TIME_SCALE, state)
+        for offset, state in itertools.islice(compiled.timeline(), MAX_EVENTS)
+    ]
+    posted = []
+    writer = SerialWriter(send)
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        loop.run_until_complete(run(scaled))
+    finally:
+        loop.close()
+        aIns.close_connection()
+        emulator.stop()
+    errors = [abs(error) for offset, error in scheduler.boundaries]
+    return max(errors, default=0) * 1000, writer.coalesced
+
+
+def measureShards(arenas, protocol, commit, count=2):
+    """
+    Sends each arena to a single virtual Arduino and then split by edges
+    between `count` of them in parallel. Returns the worst time until the
+    arenas are visible with one and with several controllers and whether
+    every controller shows its part.
+    """
+    times, consistent = [], True
+    for shards in (1, count):
+        emulators = [PtyEmulator().start() for i in range(shards)]
+        sessions = [connect(e, protocol, commit) for e in emulators]
+        worst = 0
+        try:
+            for arena in arenas:
+                size = -(-arena.edges // shards)
+                drivers = [
+                    (Shard(aIns.port, aIns.baud, 'edges', i * size + 1,
+                           (i + 1) * size, Shard.LEDS), aIns)
+                    for i, aIns in enumerate(sessions)
+                ]
+                state = ec.compileState(arena)
+                start = time.perf_counter()
+                consistent = ec.sendShards(state, drivers) and consistent
+                worst = max(worst, time.perf_counter() - start)
+                parts = ec.shardFrames(arena, state.frame, drivers)
+                consistent = consistent and all(
+                    pixel is None or emulator.arduino.visible[i] == pixel
+                    for emulator, part in zip(emulators, parts)
+                    for i, pixel in enumerate(part.pixels)
+                )
+        finally:
+            for aIns, emulator in zip(sessions, emulators):
+                aIns.close_connection()
+                emulator.stop()
+        times.append(worst * 1000)
+    return times[0], times[1], consistent
+
+
+def compare(results, baseline, tolerance):
+    """ The metrics that got worse than the baseline. """
+    regressions = []
+    for name, metrics in results.items():
+        for metric, slack in METRICS.items():
+            if name not in baseline or metric not in baseline[name]:
+                continue
+            old, new = baseline[name][metric], metrics[metric]
+            if new > old * (1 + tolerance) + slack:
+                regressions.append((name, metric, old, new))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='ArenaHandler benchmark')
+    parser.add_argument(
+        '--save', action='store_true', help='store the results as baseline'
+    )
+    parser.add_argument(
+        '--tolerance', type=float, default=0.25,
+        help='relative slack before a regression, default: 0.25'
+    )
+    parser.add_argument(
+        '--protocol', default=ArduinoInstruction.PROTOCOL,
+        help='json, binary or auto, default: auto'
+    )
+    parser.add_argument(
+        '--progressive', action='store_true',
+        help='show every instruction instead of committing each state once'
+    )
+    parser.add_argument(
+        '--verbose', action='store_true', help='keep the INFO logs'
+    )
+    args = parser.parse_args()
+    if not args.verbose:
+        logging.disable(logging.INFO)
+
+    synthetic = [Arena.fromDict(a) for a in syntheticArenas().values()]
+    ranges, elementwise = measureResolver(synthetic)
+    print(
+        "%-20s ranges %7.3f ms  element by element %7.3f ms"
+        % ('index-resolver', ranges, elementwise)
+    )
+
+    commit = not args.progressive
+    single, sharded, shardsConsistent = \
+        measureShards(synthetic, args.protocol, commit)
+    print(
+        "%-20s controllers 1 %8.2f ms  controllers 2 %8.2f ms  %s"
+        % ('sharding', single, sharded,
+           'ok' if shardsConsistent else 'INCONSISTENT')
+    )
+
+    results = {}
+    for name, (events, exp) in loadScenarios().items():
+        metrics = measureScenario(events, exp, args.protocol, commit)
+        results[name] = metrics
+        print(
+            "%-20s states %3d  ins/state %6.1f  bytes/state %7.1f  "
+            "shows/state %5.1f  compile %7.3f ms  visible %8.2f ms  "
+            "jitter %6.2f ms  coalesced %4.1f  %s"
+            % (name, metrics['states'], metrics['instructions'],
+               metrics['bytes'], metrics['shows'], metrics['compile_ms'],
+               metrics['visible_ms'], metrics['jitter_ms'],
+               metrics['coalesced'],
+               'ok' if metrics['consistent'] else 'INCONSISTENT')
+        )
+
+    key = args.protocol if commit else args.protocol + '-progressive'
+    baselines = {}
+    if os.path.exists(BASELINE):
+        with open(BASELINE) as f:
+            baselines = json.load(f)
+    if args.save:
+        baselines[key] = results
+        with open(BASELINE, 'w') as f:
+            json.dump(baselines, f, sort_keys=True, indent=4)
+        print("Baseline saved to %s" % (BASELINE))
+        return
+    if key not in baselines:
+        print("No baseline, run with --save to create it")
+        return
+    regressions = compare(results, baselines[key], args.tolerance)
+    for name, metric, old, new in regressions:
+        print("REGRESSION %s %s: %.3f -> %.3f" % (name, metric, old, new))
+    inconsistent = [n for n, m in results.items() if not m['consistent']]
+    if regressions or inconsistent or not shardsConsistent:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,172 @@
+"""
+This module plays the animations on the asyncio event loop. The frames are
+rendered from the keyframes when they are due, so an animation keeps its
+duration whatever the serial link carries: a frame is only rendered once the
+previous one is applied and the ticks that passed meanwhile are dropped, the
+achieved frame rate follows the measured throughput. Each frame is rendered
+for the moment it is expected to be visible, the time the previous frame
+took to be applied. The frames go through the frame buffer and delta path,
+only the LEDs that change are sent.
+"""
+import asyncio
+import bisect
+import math
+
+import experiment.utils.logger as my_logger
+import experiment.utils.metrics as metrics
+
+logger = my_logger.get_logger('animator')
+
+
+def ease(easing, weight):
+    """
+    This function shapes the progress between two keyframes.
+    ----------
+    easing : string
+        One of Keyframe.EASINGS.
+
+    weight : float
+        Linear progress from 0 to 1.
+
+    Returns
+    -------
+    The eased progress from 0 to 1.
+
+    """
+    if easing == 'ease-in':
+        return weight * weight
+    if easing == 'ease-out':
+        return 1 - (1 - weight) * (1 - weight)
+    if easing == 'ease-in-out':
+        return weight * weight * (3 - 2 * weight)
+    if easing == 'step':
+        return 1.0 if weight >= 1 else 0.0
+    return weight
+
+
+def render(animation, frames, t):
+    """
+    This function renders the frame of an animation at a given time.
+    ----------
+    animation : Object
+        The Animation to render.
+
+    frames : tuple
+        The compiled frame of each keyframe.
+
+    t : float
+        Seconds from the start of the animation, the last keyframe is kept
+        after the end.
+
+    Returns
+    -------
+    The frame buffer at that time.
+
+    """
+    duration = animation.duration()
+    if duration <= 0 or t >= duration * animation.repetitions:
+        return frames[-1]
+    local = t % duration
+    times = [keyframe.time for keyframe in animation.keyframes]
+    i = bisect.bisect_right(times, local)
+    if i == 0:
+        return frames[0]
+    if i == len(times):
+        return frames[-1]
+    start, end = animation.keyframes[i - 1], animation.keyframes[i]
+    weight = ease(end.easing, (local - start.time) / (end.time - start.time))
+    return frames[i - 1].blend(frames[i], weight)
+
+
+class Animator(object):
+    """
+    Plays one animation at a time, starting a new one cancels the previous
+    one. `stats` holds the target and achieved frame rate and the frames
+    applied and dropped of the last animation.
+    """
+
+    def __init__(self):
+        """
+        Returns
+        -------
+        new Animator Object
+        """
+        self.task = None
+        self.stats = {}
+
+    def empty(self):
+        """ True if there is no animation playing. """
+        return self.task is None or self.task.done()
+
+    def cancel(self):
+        """ Cancels the animation playing, if any. """
+        if not self.empty():
+            self.task.cancel()
+
+    def start(self, animation, frames, post):
+        """
+        Cancels the animation playing and starts a new one.
+        ----------
+        animation : Object
+            The Animation to play.
+        frames : tuple
+            The compiled frame of each keyframe.
+        post : function
+            Non-blocking function called on the event loop with each frame,
+            it returns a Future resolved with True once the frame is applied.
+        Returns
+        -------
+        The asyncio Task playing the animation.
+        """
+        self.cancel()
+        self.stats = {
+            'status': 'playing',
+            'fps': animation.fps,
+            'achievedFps': 0.0,
+            'frames': 0,
+            'applied': 0,
+            'dropped': 0
+        }
+        self.task = asyncio.ensure_future(self._run(animation, frames, post))
+        return self.task
+
+    async def _run(self, animation, frames, post):
+        loop = asyncio.get_event_loop()
+        fps = animation.fps
+        end = animation.duration() * animation.repetitions
+        t0 = loop.time()
+        tick, lag = 0, 0.0
+        try:
+            while True:
+                target = min(tick / fps + lag, end)
+                frame = render(animation, frames, target)
+                posted = loop.time()
+                applied = await post(frame)
+                lag = loop.time() - posted
+                self._count('applied' if applied else 'dropped')
+                if target >= end:
+                    break
+                elapsed = loop.time() - t0
+                # The ticks that passed while the frame was sent are dropped
+                following = max(tick + 1, math.floor(elapsed * fps) + 1)
+                for skipped in range(following - tick - 1):
+                    self._count('dropped', rendered=False)
+                tick = following
+                await asyncio.sleep(
+                    max(0.0, min(tick / fps, end - lag) - elapsed)
+                )
+            self.stats['status'] = 'done'
+        except asyncio.CancelledError:
+            self.stats['status'] = 'canceled'
+            raise
+        finally:
+            elapsed = loop.time() - t0
+            if elapsed > 0:
+                self.stats['achievedFps'] = self.stats['applied'] / elapsed
+            metrics.set_gauge('moca_animation_fps', self.stats['achievedFps'])
+            logger.info("Animation %s" % (self.stats))
+
+    def _count(self, outcome, rendered=True):
+        self.stats['frames'] += rendered
+        self.stats[outcome] += 1
+        metrics.inc('moca_animation_frames_total', outcome=outcome)
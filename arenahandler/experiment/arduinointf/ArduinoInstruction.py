@@ -2,11 +2,26 @@
 This module is going to be used as an Interface bewtween the Arduino and
 the top layer application which is in charge of manage the LED strip.
 The serial module is used to make the serial connection and the sleep
-from the time module to enhace it.
+from the time module to enhace it. The connection is meant to be long-lived:
+it is opened once and reopened automatically if the port drops.
+Instead of sleeping after every message, a bounded window of instructions is
+kept in flight and the firmware replies are used as flow control. The block
+instructions are sent as JSON or, when the firmware supports it, with the
+binary protocol of the BinaryCodec module. With the binary protocol a state
+can be committed at once: its instructions are staged and a single show
+makes the whole state visible. Every byte written and every answer can be
+recorded in an instruction log, see the InstructionLog module.
 """
 import serial
-from time import sleep
+import threading
+from collections import deque
+from time import sleep, monotonic
 import experiment.utils.logger as my_logger
+import experiment.utils.metrics as metrics
+from .BinaryCodec import BinaryCodec
+from .InstructionLog import InstructionLog
+from .TransportStats import TransportStats
+from ..component.BlockInstruction import BlockInstruction
 
 logger = my_logger.get_logger('arudinocomm')
 
@@ -18,13 +33,34 @@ class ArduinoInstruction:
     the Arduino is connected, also the baud rate has to be set.
     By default there is a timeout, to finish the communication if there
     is any problem and wait time that allows to wait until the 
-    connection is ready.
+    connection is ready. Opening the port resets the Arduino, so a single
+    instance should be kept open and shared, the lock serializes the
+    writers. Every instruction is answered by one line of the firmware,
+    either ACK_MESSAGE or one of ERROR_MESSAGES, at most `window`
+    instructions are written before waiting for those answers.
+    The protocol is 'json', 'binary' or 'auto' to negotiate it on connection.
+    With `commit` the firmware is probed for the SHOW frame on connection,
+    `staged` tells if the states can be committed at once.
+    With `record` the instructions, the handshake and the answers are
+    appended to a log in that directory, from the first connection until
+    close_connection.
     """
     TIMEOUT = 5
     START_WAIT_TIME = 2
-    MESSAGE_WAIT_TIME = 0.0625
+    HELLO_WAIT_TIME = 0.5
+    SEND_RETRIES = 1
+    # The firmware stops reading while the LEDs are shown and the AVR only
+    # buffers 64 bytes, a second instruction in flight would overflow it
+    WINDOW = 1
+    PROTOCOL = 'auto'
+    COMMIT = True
+    # 8N1: a start and a stop bit around every byte
+    BITS_PER_BYTE = 10
+    ACK_MESSAGE = "Instruction executed successfully!"
+    ERROR_MESSAGES = ("parseObject() failed", "Binary frame failed")
 
-    def __init__(self, port, baud):
+    def __init__(self, port, baud, window=WINDOW, protocol=PROTOCOL,
+                 commit=COMMIT, record=None):
         """ 
         This is where the port and baud rate are set.
         ----------
@@ -32,39 +68,328 @@ class ArduinoInstruction:
             The serial port where the Arduino is connected.
         baud : int
             The baud rate used to transmit information.
+        window : int
+            Maximum number of instructions waiting for an answer.
+        protocol : string
+            Wire protocol of the block instructions.
+        commit : bool
+            Commit the states at once when the firmware supports it.
+        record : string
+            Directory of the instruction log, None to not record.
         Returns
         -------
         new ArduinoInstruction Object
         """
         self.port = port
         self.baud = baud
+        self.window = max(1, window)
+        self.protocol = protocol
+        self.binary = protocol == 'binary'
+        self.commit = commit
+        self.staged = False
+        self.codec = BinaryCodec()
+        self.arduino = None
+        self.connections = 0
+        self.lock = threading.RLock()
+        self.inflight = deque()
+        self.stats = TransportStats(self.window)
+        self.record = record
+        self.recorder = None
+        self.forget_shown()
+
+    def forget_shown(self):
+        """ 
+        Forgets what the strip is showing, the next state is sent in full.
+        `shown` holds the color of each LED in strip order, None if unknown.
+        """
+        self.shown = []
+        self.shown_brightness = None
+
+    def failures(self):
+        """ Number of instructions rejected or never answered. """
+        return self.stats.errors + self.stats.timeouts
+
+    def is_connected(self):
+        """ True if the serial port is currently open. """
+        return self.arduino is not None and self.arduino.is_open
 
     def start_connection(self):
         """Starts the serial connection with the Arduino."""
+        self.inflight.clear()
+        # Opening the port resets the Arduino, its LED array is lost
+        self.forget_shown()
         try:
+            if self.record and self.recorder is None:
+                self.recorder = InstructionLog.forPort(self.record, self.port)
             self.arduino = serial.Serial(
                 self.port, self.baud, timeout=self.TIMEOUT
             )
             sleep(self.START_WAIT_TIME)  # This is important
+            self.connections += 1
+            if self.protocol == 'auto':
+                self.binary = self._negotiate()
+            self.staged = self.binary and self.commit and self._probe_show()
+            if self.recorder is not None:
+                self.recorder.opened(
+                    self.port, 'binary' if self.binary else 'json',
+                    self.staged
+                )
             logger.info(
-                "Connection started: %s, rate: %d" % (self.port, self.baud)
+                "Connection started: %s, rate: %d, protocol: %s, commit: %s"
+                % (self.port, self.baud, 'binary' if self.binary else 'json',
+                   'staged' if self.staged else 'per instruction')
             )
         except Exception as e:
+            self.arduino = None
             logger.error(e)
 
+    def _negotiate(self):
+        """ 
+        Sends the binary HELLO frame, True if the firmware answers it. An
+        older firmware answers parse errors that are discarded.
+        """
+        self.arduino.timeout = self.HELLO_WAIT_TIME
+        try:
+            line = self._handshake(self.codec.hello())
+            sleep(self.HELLO_WAIT_TIME)
+            self.arduino.reset_input_buffer()
+        finally:
+            self.arduino.timeout = self.TIMEOUT
+        return line == BinaryCodec.HELLO_MESSAGE
+
+    def _probe_show(self):
+        """ 
+        Sends a SHOW frame, True if the firmware acknowledges it. An older
+        firmware rejects the opcode, the strip is still dark after the reset
+        so showing it is harmless.
+        """
+        self.arduino.timeout = self.HELLO_WAIT_TIME
+        try:
+            line = self._handshake(self.codec.show(0))
+        finally:
+            self.arduino.timeout = self.TIMEOUT
+        return line == self.ACK_MESSAGE
+
+    def _handshake(self, frame):
+        """ Writes a frame of the handshake, returns the line answered. """
+        self.arduino.write(frame)
+        line = self.arduino.readline().decode(errors='replace').strip()
+        if self.recorder is not None:
+            self.recorder.handshake(frame)
+            self.recorder.answer(line)
+        return line
+
+    def ensure_connection(self):
+        """ Opens the connection only if it is not already open. """
+        with self.lock:
+            if not self.is_connected():
+                self.start_connection()
+            return self.is_connected()
+
+    def reconnect(self):
+        """ Drops the current connection and opens a new one. """
+        with self.lock:
+            logger.warning("Reconnecting to %s" % (self.port))
+            # The instruction log goes on across the reconnection
+            self._close_port()
+            return self.ensure_connection()
+
+    def buffer_limit(self):
+        """ 
+        Bytes of the firmware JSON buffer an instruction may use, None with
+        the binary protocol which splits the instructions itself.
+        """
+        return None if self.binary else BlockInstruction.JSON_BUFFER_SIZE
+
+    def encode(self, bIns, staged=False):
+        """ 
+        The messages of a block instruction with the protocol in use.
+        ----------
+        bIns : Object
+            The BlockInstruction to encode.
+        staged : bool
+            True to stage the LEDs until show(), only with `staged`.
+        Returns
+        -------
+        List of JSON strings or binary frames.
+        """
+        if self.binary:
+            return self.codec.encode(bIns, staged)
+        return [str(bIns.toJSON())]
+
+    def encoded_size(self, bIns):
+        """ Bytes written to send a block instruction. """
+        return sum(
+            len(m.encode() if isinstance(m, str) else m)
+            for m in self.encode(bIns)
+        )
+
+    def needs_commit(self, instructions):
+        """ 
+        True if the instructions of a state are staged and then shown, a
+        state sent in a single message is already shown at once.
+        """
+        return self.staged and bool(instructions) and (
+            len(instructions) > 1 or
+            len(instructions[0].led) > BinaryCodec.MAX_LEDS
+        )
+
+    def commit_size(self, instructions):
+        """ Bytes written to commit the instructions of a state. """
+        if self.needs_commit(instructions):
+            return len(self.codec.show(0))
+        return 0
+
+    def transmit_time(self, nbytes):
+        """ Seconds the serial link takes to carry `nbytes`. """
+        return nbytes * self.BITS_PER_BYTE / self.baud
+
+    def send_block(self, bIns, staged=False):
+        """ 
+        This sends a block instruction with the protocol in use.
+        ----------
+        bIns : Object
+            The BlockInstruction to send.
+        staged : bool
+            True to keep the LEDs hidden until show().
+        Returns
+        -------
+        The firmware answers read while sending.
+        """
+        with self.lock:
+            self.ensure_connection()
+            self.stats.onBlock(len(bIns.led))
+            with metrics.span('serialize'):
+                frames = self.encode(bIns, staged)
+            if not staged:
+                self.stats.onShow(len(frames))
+            response = ''
+            for frame in frames:
+                response += self.send_instrunction(frame)
+            return response
+
+    def show(self, brightness):
+        """ 
+        Commits the staged LEDs, the whole state becomes visible at once.
+        ----------
+        brightness : int
+            Brightness of the whole strip.
+        Returns
+        -------
+        The firmware answers read while sending.
+        """
+        with self.lock:
+            self.stats.onShow()
+            return self.send_instrunction(self.codec.show(brightness))
+
     def send_instrunction(self, instruction):
-        """ This sends the instruction to the Arduino. """
-        logger.debug(instruction)
-        self.arduino.write(instruction.encode())
-        sleep(self.MESSAGE_WAIT_TIME)
+        """ 
+        This sends the instruction to the Arduino. If the window is full it
+        waits for the oldest answer first. If the port dropped the connection
+        is reopened and the instruction sent again.
+        ----------
+        instruction : string or bytes
+            The instruction to send.
+        Returns
+        -------
+        The firmware answers read while sending.
+        """
+        my_logger.trace(logger, "%s", instruction)
+        with self.lock:
+            for attempt in range(self.SEND_RETRIES + 1):
+                if not self.ensure_connection():
+                    raise serial.SerialException(
+                        "Port %s is not available" % (self.port)
+                    )
+                try:
+                    return self._write(instruction)
+                except (serial.SerialException, OSError) as e:
+                    logger.error(e)
+                    if attempt == self.SEND_RETRIES:
+                        raise
+                    self.reconnect()
+
+    def flush(self):
+        """ 
+        Waits until every instruction in flight has been answered.
+        Returns
+        -------
+        The firmware answers read while waiting.
+        """
         response = ''
-        while self.arduino.in_waiting:
-            response += self.arduino.readline().decode()
+        with self.lock:
+            try:
+                while self.inflight:
+                    response += self._read_reply()
+            except (serial.SerialException, OSError) as e:
+                logger.error(e)
+                self.inflight.clear()
+            if self.recorder is not None:
+                self.recorder.flush()
         return response
 
+    def _write(self, instruction):
+        response = ''
+        while len(self.inflight) >= self.window:
+            response += self._read_reply()
+        data = instruction.encode() \
+            if isinstance(instruction, str) else instruction
+        with metrics.span('write'):
+            self.arduino.write(data)
+        if self.recorder is not None:
+            self.recorder.write(data)
+        self.inflight.append(monotonic())
+        self.stats.onSent(len(data), len(self.inflight))
+        while self.inflight and self.arduino.in_waiting:
+            response += self._read_reply()
+        return response
+
+    def _read_reply(self):
+        """ Reads one line and settles the oldest instruction in flight. """
+        line = self.arduino.readline().decode(errors='replace')
+        message = line.strip()
+        if not line:
+            # Nothing came back within TIMEOUT, give up on that instruction
+            self.inflight.popleft()
+            self.stats.onTimeout()
+            if self.recorder is not None:
+                self.recorder.timeout()
+            logger.warning("No answer from %s" % (self.port))
+        elif message == self.ACK_MESSAGE:
+            latency = monotonic() - self.inflight.popleft()
+            self.stats.onAck(latency)
+            if self.recorder is not None:
+                self.recorder.ack()
+            metrics.observe('moca_stage_seconds', latency, stage='ack')
+        elif message in self.ERROR_MESSAGES:
+            self.stats.onError(monotonic() - self.inflight.popleft())
+            if self.recorder is not None:
+                self.recorder.error(message)
+            logger.error("Arduino: %s" % (message))
+        else:
+            logger.debug("Arduino: %s" % (message))
+        return line
+
     def close_connection(self):
-        """ This closes the serial connection."""
-        self.arduino.close()
+        """ 
+        This closes the serial connection and the instruction log, the
+        next connection starts a new log.
+        """
+        with self.lock:
+            self._close_port()
+            if self.recorder is not None:
+                self.recorder.close()
+                self.recorder = None
+
+    def _close_port(self):
+        if self.arduino is not None:
+            try:
+                self.arduino.close()
+            except (serial.SerialException, OSError) as e:
+                logger.error(e)
+        self.arduino = None
+        if self.recorder is not None:
+            self.recorder.flush()
 
 
 if __name__ == "__main__":
@@ -80,4 +405,6 @@ if __name__ == "__main__":
         }
         """)
         logger.info("From Arduino: %s" % (res))
+    logger.info("From Arduino: %s" % (inst.flush()))
+    logger.info(inst.stats.toDict())
     inst.close_connection()
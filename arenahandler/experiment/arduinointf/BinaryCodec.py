@@ -0,0 +1,167 @@
+"""
+This module implements the binary wire protocol between the host and the
+Arduino, a compact alternative to the JSON block instructions. Every frame
+has the following layout, multi-byte fields are big endian:
+
+    SYNC(1) VERSION(1) OPCODE(1) BRIGHTNESS(1) BLOCK(2) SIZE(2) COUNT(1)
+    [RGB(3) if OPCODE is FILL] COUNT x (LED(2) RGB(3)) CHECKSUM(1)
+
+The checksum is the sum modulo 256 of every byte between SYNC and CHECKSUM.
+A FILL or LEDS opcode with the STAGED bit only writes the LED array, the
+SHOW frame (COUNT 0) then sets the brightness and shows the whole state.
+The host sends a HELLO frame after connecting, a firmware which understands
+the protocol answers HELLO_MESSAGE, otherwise the host keeps using JSON.
+The decoder is the byte-level reference of the firmware parser.
+"""
+
+
+class BinaryCodec(object):
+    """
+    Encodes BlockInstruction objects into binary frames and decodes a byte
+    stream back into instructions.
+    """
+    SYNC = 0xA5
+    VERSION = 1
+    OP_FILL = 0x01
+    OP_LEDS = 0x02
+    OP_SHOW = 0x03
+    STAGED = 0x40
+    OP_HELLO = 0x10
+    HEADER_SIZE = 9
+    LED_SIZE = 5
+    # Keeps every frame under 256 bytes, the firmware frame buffer
+    MAX_LEDS = 48
+    HELLO_MESSAGE = "MoCA binary 1"
+
+    def __init__(self):
+        """
+        Returns
+        -------
+        new BinaryCodec Object
+        """
+        self.buffer = bytearray()
+
+    def hello(self):
+        """ The frame used to negotiate the protocol. """
+        return self.frame(self.OP_HELLO, 0, 0, 0, None, [])
+
+    def show(self, brightness):
+        """ The frame that shows the staged LEDs with a brightness. """
+        return self.frame(self.OP_SHOW, brightness, 0, 0, None, [])
+
+    def encode(self, bIns, staged=False):
+        """
+        Encodes a block instruction, the LEDs are split in several frames
+        when there are more than MAX_LEDS.
+        ----------
+        bIns : Object
+            The BlockInstruction to encode.
+        staged : bool
+            True to only write the LEDs, they are shown by a SHOW frame.
+        Returns
+        -------
+        List of frames as bytes.
+        """
+        fields = [int(f) for f in bIns.block.split(',')]
+        blockIndex, blockSize, color = fields[0], fields[1], tuple(fields[2:])
+        fill = color if color[0] >= 0 else None
+        leds = []
+        for led in bIns.led:
+            fields = [int(f) for f in led.split(',')]
+            leds.append((fields[0], tuple(fields[1:])))
+        frames = []
+        flag = self.STAGED if staged else 0
+        opcode = self.OP_LEDS if fill is None else self.OP_FILL
+        for i in range(0, max(len(leds), 1), self.MAX_LEDS):
+            chunk = leds[i:i + self.MAX_LEDS]
+            if opcode == self.OP_LEDS and not chunk:
+                break
+            frames.append(self.frame(
+                opcode | flag, bIns.brightness, blockIndex, blockSize, fill,
+                chunk
+            ))
+            opcode, fill = self.OP_LEDS, None
+        return frames
+
+    def frame(self, opcode, brightness, blockIndex, blockSize, fill, leds):
+        """ Builds one frame, see the module documentation. """
+        body = bytearray([
+            self.VERSION, opcode, max(0, min(brightness, 255)),
+            (blockIndex >> 8) & 0xFF, blockIndex & 0xFF,
+            (blockSize >> 8) & 0xFF, blockSize & 0xFF,
+            len(leds)
+        ])
+        if opcode & ~self.STAGED == self.OP_FILL:
+            body.extend(fill)
+        for index, rgb in leds:
+            body.extend([(index >> 8) & 0xFF, index & 0xFF])
+            body.extend(rgb)
+        return bytes([self.SYNC]) + bytes(body) + bytes([sum(body) & 0xFF])
+
+    def feed(self, data):
+        """
+        Decodes a chunk of the byte stream, incomplete frames are kept
+        until the rest arrives.
+        ----------
+        data : bytes
+            Bytes received.
+        Returns
+        -------
+        List of decoded frames as dictionaries with the keys opcode,
+        staged, brightness, block, size, fill and leds, or with the key
+        error.
+        """
+        self.buffer.extend(data)
+        decoded = []
+        while True:
+            start = self.buffer.find(bytes([self.SYNC]))
+            if start < 0:
+                self.buffer.clear()
+                return decoded
+            del self.buffer[:start]
+            if len(self.buffer) < self.HEADER_SIZE:
+                return decoded
+            length = self.length(self.buffer)
+            if self.buffer[1] != self.VERSION:
+                decoded.append({'error': 'version %d' % (self.buffer[1])})
+                del self.buffer[:1]
+                continue
+            if len(self.buffer) < length:
+                return decoded
+            frame = bytes(self.buffer[:length])
+            if sum(frame[1:-1]) & 0xFF != frame[-1]:
+                decoded.append({'error': 'checksum'})
+                del self.buffer[:1]
+                continue
+            del self.buffer[:length]
+            decoded.append(self.decode(frame))
+
+    def length(self, header):
+        """ Bytes of the frame starting with the given header. """
+        length = self.HEADER_SIZE + header[8] * self.LED_SIZE + 1
+        if header[2] & ~self.STAGED == self.OP_FILL:
+            length += 3
+        return length
+
+    def decode(self, frame):
+        """ Decodes one complete and valid frame. """
+        opcode, count = frame[2] & ~self.STAGED, frame[8]
+        offset = self.HEADER_SIZE
+        fill = None
+        if opcode == self.OP_FILL:
+            fill = tuple(frame[offset:offset + 3])
+            offset += 3
+        leds = []
+        for i in range(count):
+            led = frame[offset:offset + self.LED_SIZE]
+            leds.append(((led[0] << 8) | led[1], tuple(led[2:])))
+            offset += self.LED_SIZE
+        return {
+            'opcode': opcode,
+            'staged': bool(frame[2] & self.STAGED),
+            'brightness': frame[3],
+            'block': (frame[4] << 8) | frame[5],
+            'size': (frame[6] << 8) | frame[7],
+            'fill': fill,
+            'leds': leds
+        }
@@ -0,0 +1,453 @@
+"""
+This module records the instruction stream written to an Arduino so what
+was actually sent to the arena can be reconstructed and replayed. The log is
+an append-only binary file: a header with the wall clock time of its origin
+followed by records of the bytes written, the answers of the firmware and
+the connections with their handshake, each with the monotonic nanoseconds
+since the origin. Every
+write is also appended to an index file of fixed size entries, the reader
+maps both files in memory so any frame of a log of hours is reached without
+reading what comes before it. A log can be streamed back to a serial port or
+to the virtual Arduino, at the recorded pace or as fast as the firmware
+answers.
+
+Run it from the arenahandler directory:
+
+    python -m experiment.arduinointf.InstructionLog LOG [--port] [--baud]
+                                                    [--fast] [--dump]
+"""
+import argparse
+import mmap
+import os
+import struct
+import time
+from typing import NamedTuple
+
+import experiment.utils.logger as my_logger
+
+logger = my_logger.get_logger('instructionlog')
+
+
+class LogRecord(NamedTuple):
+    """
+    A record of the log, `time` is in seconds since the origin of the log
+    and `kind` one of the kinds of InstructionLog.
+    """
+    time: float
+    kind: int
+    payload: bytes
+
+
+class InstructionLog(object):
+    """
+    Appends the records of one serial session to a log and its index. The
+    session calls it under its own lock. The records are buffered, flush()
+    is called once per state so a crash loses at most the state being sent.
+    """
+    MAGIC = b'MOCALOG1'
+    # Magic and wall clock time of the origin
+    HEADER = struct.Struct('<8sd')
+    # Kind, nanoseconds since the origin and payload length
+    RECORD = struct.Struct('<BQI')
+    # Offset of a write record in the log and its nanoseconds
+    ENTRY = struct.Struct('<QQ')
+    OPEN = 0x01
+    WRITE = 0x02
+    ACK = 0x03
+    ERROR = 0x04
+    TIMEOUT = 0x05
+    # The handshake is not replayed, the replaying session negotiates
+    HANDSHAKE = 0x06
+    ANSWER = 0x07
+    KINDS = {
+        OPEN: 'open', WRITE: 'write', ACK: 'ack', ERROR: 'error',
+        TIMEOUT: 'timeout', HANDSHAKE: 'handshake', ANSWER: 'answer'
+    }
+    EXTENSION = '.mocalog'
+
+    def __init__(self, path):
+        """
+        ----------
+        path : string
+            The log to create, its index is the same path with '.idx'.
+        Returns
+        -------
+        new InstructionLog Object
+        """
+        self.path = path
+        self.origin = time.monotonic()
+        self.log = open(path, 'wb')
+        self.index = open(indexPath(path), 'wb')
+        self.log.write(self.HEADER.pack(self.MAGIC, time.time()))
+        self.offset = self.HEADER.size
+
+    @classmethod
+    def forPort(cls, directory, port):
+        """
+        Creates the log of a serial port in a directory, named after the
+        port and the time it is created.
+        """
+        os.makedirs(directory, exist_ok=True)
+        name = '%s-%s%s' % (
+            os.path.basename(port), time.strftime('%Y%m%d-%H%M%S'),
+            cls.EXTENSION
+        )
+        return cls(os.path.join(directory, name))
+
+    def opened(self, port, protocol, staged):
+        """ Records a connection and the protocol negotiated. """
+        self._append(self.OPEN, (
+            '%s %s %s' % (port, protocol, 'staged' if staged else 'shown')
+        ).encode())
+
+    def write(self, data):
+        """ Records the bytes of an instruction written to the port. """
+        self.index.write(self.ENTRY.pack(self.offset, self._now()))
+        self._append(self.WRITE, data)
+
+    def handshake(self, data):
+        """ Records the bytes of a handshake frame written to the port. """
+        self._append(self.HANDSHAKE, data)
+
+    def answer(self, line):
+        """ Records the line answered to a handshake frame. """
+        self._append(self.ANSWER, line.encode())
+
+    def ack(self):
+        """ Records an instruction acknowledged by the firmware. """
+        self._append(self.ACK, b'')
+
+    def error(self, message):
+        """ Records an instruction rejected by the firmware. """
+        self._append(self.ERROR, message.encode())
+
+    def timeout(self):
+        """ Records an instruction never answered. """
+        self._append(self.TIMEOUT, b'')
+
+    def flush(self):
+        """ Writes the buffered records to the files. """
+        self.index.flush()
+        self.log.flush()
+
+    def close(self):
+        """ Flushes and closes the files. """
+        self.index.close()
+        self.log.close()
+
+    def _now(self):
+        return int((time.monotonic() - self.origin) * 1e9)
+
+    def _append(self, kind, payload):
+        self.log.write(self.RECORD.pack(kind, self._now(), len(payload)))
+        self.log.write(payload)
+        self.offset += self.RECORD.size + len(payload)
+
+
+def indexPath(path):
+    """ The index file of a log. """
+    return path + '.idx'
+
+
+class LogReader(object):
+    """
+    Steps through a log mapped in memory. The writes are numbered in order,
+    `len()` counts them and `reader[i]` is the i-th one. The index is
+    rebuilt when it is missing, and a record cut by a crash at the end of
+    the log is ignored.
+    """
+
+    def __init__(self, path):
+        """
+        ----------
+        path : string
+            The log to read.
+        Returns
+        -------
+        new LogReader Object
+        """
+        self.path = path
+        self.file = open(path, 'rb')
+        self.data = self._map(self.file)
+        header = InstructionLog.HEADER
+        if self.data is None or len(self.data) < header.size or \
+                header.unpack_from(self.data)[0] != InstructionLog.MAGIC:
+            self.close()
+            raise ValueError("%s is not an instruction log" % (path))
+        self.wallclock = header.unpack_from(self.data)[1]
+        if not self._indexed():
+            rebuildIndex(path)
+        self.indexFile = open(indexPath(path), 'rb')
+        self.index = self._map(self.indexFile)
+        self.count = self._entries()
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, i):
+        if not -self.count <= i < self.count:
+            raise IndexError("write %d out of %d" % (i, self.count))
+        offset, ns = self._entry(i % self.count)
+        return self._record(offset)[0]
+
+    def time(self, i):
+        """ Seconds since the origin of the i-th write. """
+        return self._entry(i)[1] / 1e9
+
+    def seek(self, seconds):
+        """ Number of the first write at or after `seconds`. """
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            if self.time(middle) < seconds:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def records(self, start=0):
+        """
+        Generates every record from the `start`-th write on, the answers
+        and connections included, without reading the log ahead.
+        """
+        if start and start >= self.count:
+            return
+        offset = self._entry(start)[0] if start > 0 \
+            else InstructionLog.HEADER.size
+        while True:
+            record, offset = self._record(offset)
+            if record is None:
+                return
+            yield record
+
+    def connection(self):
+        """ The payload of the first connection recorded, None if none. """
+        for record in self.records():
+            if record.kind == InstructionLog.OPEN:
+                return record.payload.decode(errors='replace')
+            if record.kind == InstructionLog.WRITE:
+                return None
+        return None
+
+    def close(self):
+        """ Unmaps and closes the files. """
+        for name in ('index', 'data'):
+            if getattr(self, name, None) is not None:
+                getattr(self, name).close()
+        for name in ('indexFile', 'file'):
+            if getattr(self, name, None) is not None:
+                getattr(self, name).close()
+
+    @staticmethod
+    def _map(file):
+        # An empty file cannot be mapped
+        if os.fstat(file.fileno()).st_size == 0:
+            return None
+        return mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def _indexed(self):
+        path = indexPath(self.path)
+        if not os.path.exists(path):
+            return False
+        size = os.path.getsize(path)
+        return size % InstructionLog.ENTRY.size == 0
+
+    def _entries(self):
+        """ Index entries pointing to a write complete in the log. """
+        size = InstructionLog.ENTRY.size
+        count = 0 if self.index is None else len(self.index) // size
+        while count and self._record(self._entry(count - 1)[0])[0] is None:
+            count -= 1
+        return count
+
+    def _entry(self, i):
+        return InstructionLog.ENTRY.unpack_from(
+            self.index, i * InstructionLog.ENTRY.size
+        )
+
+    def _record(self, offset):
+        """ The record at `offset` and the offset of the next one. """
+        head = InstructionLog.RECORD
+        end = offset + head.size
+        if end > len(self.data):
+            return None, offset
+        kind, ns, length = head.unpack_from(self.data, offset)
+        if end + length > len(self.data):
+            return None, offset
+        return LogRecord(ns / 1e9, kind, self.data[end:end + length]), \
+            end + length
+
+
+def rebuildIndex(path):
+    """
+    This function writes the index of a log again by scanning it, for the
+    logs whose index was lost or cut.
+    ----------
+    path : string
+        The log to index.
+
+    Returns
+    -------
+    The number of writes indexed.
+
+    """
+    head = InstructionLog.RECORD
+    count = 0
+    with open(path, 'rb') as log, open(indexPath(path), 'wb') as index:
+        data = mmap.mmap(log.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            offset = InstructionLog.HEADER.size
+            while offset + head.size <= len(data):
+                kind, ns, length = head.unpack_from(data, offset)
+                if offset + head.size + length > len(data):
+                    break
+                if kind == InstructionLog.WRITE:
+                    index.write(InstructionLog.ENTRY.pack(offset, ns))
+                    count += 1
+                offset += head.size + length
+        finally:
+            data.close()
+    logger.info("Index of %s rebuilt: %d writes" % (path, count))
+    return count
+
+
+def replay(reader, aIns, realtime=True, start=0, stop=None):
+    """
+    This function streams the writes of a log to an Arduino again.
+    ----------
+    reader : Object
+        The LogReader of the log.
+
+    aIns : Object
+        The ArduinoInstruction session to send the writes through, with the
+        protocol of the log.
+
+    realtime : bool
+        True to keep the recorded pace, False to send as fast as the
+        firmware answers.
+
+    start : int
+        Number of the first write to send.
+
+    stop : int
+        Number of the write to stop before, None up to the end.
+
+    Returns
+    -------
+    Dictionary with the writes and bytes sent, the seconds taken and the
+    answers recorded and received for them.
+
+    """
+    stop = len(reader) if stop is None else min(stop, len(reader))
+    recorded = {'acks': 0, 'errors': 0, 'timeouts': 0}
+    before = (aIns.stats.acked, aIns.stats.errors, aIns.stats.timeouts)
+    writes, nbytes = 0, 0
+    began = time.monotonic()
+    origin = None
+    for record in reader.records(start):
+        if record.kind == InstructionLog.ACK:
+            recorded['acks'] += 1
+        elif record.kind == InstructionLog.ERROR:
+            recorded['errors'] += 1
+        elif record.kind == InstructionLog.TIMEOUT:
+            recorded['timeouts'] += 1
+        elif record.kind == InstructionLog.WRITE:
+            if start + writes >= stop:
+                break
+            if origin is None:
+                origin = record.time
+            delay = began + record.time - origin - time.monotonic()
+            if realtime and delay > 0:
+                time.sleep(delay)
+            aIns.send_instrunction(record.payload)
+            writes += 1
+            nbytes += len(record.payload)
+    aIns.flush()
+    after = (aIns.stats.acked, aIns.stats.errors, aIns.stats.timeouts)
+    return {
+        'writes': writes,
+        'bytes': nbytes,
+        'seconds': time.monotonic() - began,
+        'recorded': recorded,
+        'replayed': dict(zip(('acks', 'errors', 'timeouts'), (
+            a - b for a, b in zip(after, before)
+        )))
+    }
+
+
+def dump(reader, start, count):
+    """ Prints the records of `count` writes from the `start`-th one. """
+    writes = start
+    for record in reader.records(start):
+        if record.kind == InstructionLog.WRITE:
+            if writes >= start + count:
+                break
+            writes += 1
+        print("%12.6f %-9s %4d %s" % (
+            record.time, InstructionLog.KINDS.get(record.kind, '?'),
+            len(record.payload), record.payload[:24].hex()
+        ))
+
+
+def main():
+    from .ArduinoInstruction import ArduinoInstruction
+    from .VirtualArduino import PtyEmulator
+
+    parser = argparse.ArgumentParser(description='MoCA instruction log')
+    parser.add_argument('log', help='instruction log to read')
+    parser.add_argument(
+        '--port', help='serial port to replay to, default: the emulator'
+    )
+    parser.add_argument(
+        '--baud', type=int, default=57600,
+        help='baud rate of the port, default: 57600'
+    )
+    parser.add_argument(
+        '--fast', action='store_true',
+        help='replay as fast as the firmware answers'
+    )
+    parser.add_argument(
+        '--start', type=float, default=0,
+        help='seconds of the log to start the replay or the dump at'
+    )
+    parser.add_argument(
+        '--dump', type=int, metavar='WRITES',
+        help='print the records of WRITES writes instead of replaying'
+    )
+    args = parser.parse_args()
+    reader = LogReader(args.log)
+    start = reader.seek(args.start)
+    print("%s: %d writes, recorded %s, connection: %s" % (
+        args.log, len(reader), time.ctime(reader.wallclock),
+        reader.connection()
+    ))
+    if args.dump is not None:
+        dump(reader, start, args.dump)
+        reader.close()
+        return
+    connection = (reader.connection() or '').split()
+    protocol = connection[1] if len(connection) > 1 else 'auto'
+    emulator = None
+    if args.port is None:
+        emulator = PtyEmulator(args.baud).start()
+    aIns = ArduinoInstruction(
+        args.port or emulator.port, args.baud, protocol=protocol,
+        commit=False
+    )
+    try:
+        print(replay(reader, aIns, not args.fast, start))
+        if emulator is not None:
+            arduino = emulator.arduino
+            print("shows: %d, errors: %d, lit: %d" % (
+                arduino.shows, arduino.errors,
+                sum(1 for led in arduino.visible if led != (0, 0, 0))
+            ))
+    finally:
+        aIns.close_connection()
+        reader.close()
+        if emulator is not None:
+            emulator.stop()
+
+
+if __name__ == '__main__':
+    main()
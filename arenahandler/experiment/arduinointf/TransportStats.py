@@ -0,0 +1,141 @@
+"""
+This module keeps the counters of the serial transport so the flow control
+can be tuned: per-message latency between the write and the firmware reply,
+occupancy of the in-flight window, the number of errors and how many LEDs
+are packed in each block instruction and how many times the strip was shown.
+The time taken to send whole states is fitted to predict how long the next
+one takes.
+"""
+from collections import deque
+
+
+class TransportStats(object):
+    """
+    Counters and latency samples of the serial transport. Only the last
+    SAMPLES latencies are kept so the memory stays bounded. The send time of
+    a state is fitted as a fixed overhead plus a time per byte, the older
+    states weigh DECAY less at every new one.
+    """
+    SAMPLES = 1024
+    DECAY = 0.9
+    QUANTILES = (0.5, 0.95, 0.99)
+
+    def __init__(self, window):
+        """
+        ----------
+        window : int
+            Maximum number of instructions in flight.
+        Returns
+        -------
+        new TransportStats Object
+        """
+        self.window = window
+        self.sent = 0
+        self.acked = 0
+        self.errors = 0
+        self.timeouts = 0
+        self.bytes = 0
+        self.blocks = 0
+        self.leds = 0
+        self.shows = 0
+        self.latencies = deque(maxlen=self.SAMPLES)
+        self.occupancy = [0] * (window + 1)
+        # Decayed sums of 1, bytes, seconds, bytes^2 and bytes*seconds
+        self.fit = [0.0] * 5
+
+    def onSent(self, nbytes, inflight):
+        """ Records a written instruction and the window occupancy. """
+        self.sent += 1
+        self.bytes += nbytes
+        self.occupancy[min(inflight, self.window)] += 1
+
+    def onBlock(self, leds):
+        """ Records a block instruction carrying `leds` LEDs. """
+        self.blocks += 1
+        self.leds += leds
+
+    def onShow(self, count=1):
+        """ Records messages that show the strip when they are executed. """
+        self.shows += count
+
+    def onAck(self, latency):
+        """ Records an acknowledged instruction. """
+        self.acked += 1
+        self.latencies.append(latency)
+
+    def onError(self, latency):
+        """ Records an instruction rejected by the firmware. """
+        self.errors += 1
+        self.latencies.append(latency)
+
+    def onTimeout(self):
+        """ Records an instruction never answered by the firmware. """
+        self.timeouts += 1
+
+    def onState(self, nbytes, seconds):
+        """ Records the time taken to send the `nbytes` of a state. """
+        sample = (1, nbytes, seconds, nbytes * nbytes, nbytes * seconds)
+        self.fit = [
+            self.DECAY * total + value
+            for total, value in zip(self.fit, sample)
+        ]
+
+    def sendTime(self, nbytes, perByte):
+        """
+        Predicts the seconds taken to send a state.
+        ----------
+        nbytes : int
+            Bytes of the state.
+        perByte : float
+            Seconds per byte of the link, the fastest possible, used alone
+            until a state has been measured.
+        Returns
+        -------
+        Predicted seconds until the state is acknowledged.
+        """
+        n, sx, sy, sxx, sxy = self.fit
+        if n == 0:
+            return nbytes * perByte
+        mx, my = sx / n, sy / n
+        variance = sxx / n - mx * mx
+        slope = perByte
+        if variance > 1:
+            slope = max(perByte, (sxy / n - mx * my) / variance)
+        overhead = max(0.0, my - slope * mx)
+        return overhead + slope * nbytes
+
+    def quantiles(self):
+        """
+        The QUANTILES of the latencies kept, in seconds, empty before the
+        first answer.
+        """
+        lat = sorted(self.latencies)
+        if not lat:
+            return {}
+        return {q: lat[int(q * (len(lat) - 1))] for q in self.QUANTILES}
+
+    def toDict(self):
+        """ Summary of the counters, latencies are in seconds. """
+        lat = sorted(self.latencies)
+        summary = {
+            'window': self.window,
+            'sent': self.sent,
+            'acked': self.acked,
+            'errors': self.errors,
+            'timeouts': self.timeouts,
+            'bytes': self.bytes,
+            'blocks': self.blocks,
+            'leds': self.leds,
+            'shows': self.shows,
+            'packing': self.leds / self.blocks if self.blocks else None,
+            'occupancy': list(self.occupancy),
+            'latency': None
+        }
+        if lat:
+            summary['latency'] = {
+                'min': lat[0],
+                'mean': sum(lat) / len(lat),
+                'p95': lat[int(0.95 * (len(lat) - 1))],
+                'max': lat[-1]
+            }
+        return summary
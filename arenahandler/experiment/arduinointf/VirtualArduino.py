@@ -0,0 +1,446 @@
+"""
+This module emulates the Arduino running firmwarearduino/ledstriphandler.ino
+so the whole stack can be exercised without the arena. The emulator opens a
+pseudo-terminal which is used as the serial port in config.json, it accepts
+exactly what the firmware accepts, including the size of its JSON buffer and
+of its LED array, it simulates the time taken by the serial link and by the
+LED strip and it answers the same lines as the firmware. The firmware does
+not read the serial port while it shows the strip: the bytes arriving
+meanwhile wait in the 64 bytes of the AVR receive buffer and those that do
+not fit are lost, as on the Arduino. The LED array
+written by the instructions and the colors visible on the strip, which only
+change when the firmware shows, are kept apart.
+
+Run it from the arenahandler directory:
+
+    python -m experiment.arduinointf.VirtualArduino [--baud] [--link]
+"""
+import argparse
+import json
+import os
+import select
+import threading
+import time
+import tty
+from collections import deque
+
+from .BinaryCodec import BinaryCodec
+import experiment.utils.logger as my_logger
+
+logger = my_logger.get_logger('virtualarduino')
+
+
+class VirtualArduino(object):
+    """
+    Model of the firmware: it consumes the bytes received from the host,
+    updates its LED array and returns the lines the firmware would print.
+    `visible` holds what the strip shows since the last FastLED.show().
+    `busy` is the time the running show ends, `rx` the bytes waiting in the
+    receive buffer meanwhile and `dropped` the bytes lost because it was
+    full.
+    """
+    NUM_LEDS = 960
+    DEFAULT_BRIGHTNESS = 25
+    # FastLED.show() clocks 32 bits per APA102 LED out at about 8 MHz
+    SHOW_TIME = NUM_LEDS * 32 / 8e6
+    ACK_MESSAGE = "Instruction executed successfully!"
+    ERROR_MESSAGE = "parseObject() failed"
+    BINARY_ERROR_MESSAGE = "Binary frame failed"
+    FRAME_SIZE = 256
+    # SERIAL_RX_BUFFER_SIZE of the AVR core
+    RX_BUFFER = 64
+    # StaticJsonBuffer<300> of the firmware and the sizes of ArduinoJson 5
+    # on the 8-bit AVR, the strings are copied as they come from a Stream
+    JSON_BUFFER_SIZE = 300
+    JSON_LIST_SIZE = 4
+    JSON_ARRAY_NODE_SIZE = 7
+    JSON_OBJECT_NODE_SIZE = 9
+
+    def __init__(self):
+        """
+        Returns
+        -------
+        new VirtualArduino Object
+        """
+        self.leds = [(0, 0, 0)] * self.NUM_LEDS
+        self.visible = list(self.leds)
+        self.brightness = self.DEFAULT_BRIGHTNESS
+        self.buffer = bytearray()
+        self.codec = BinaryCodec()
+        self.shows = 0
+        self.errors = 0
+        self.overflows = 0
+        self.busy = 0.0
+        self.rx = bytearray()
+        self.dropped = 0
+
+    def receive(self, data):
+        """
+        Processes the bytes received through the serial port.
+        ----------
+        data : bytes
+            Bytes received from the host.
+        Returns
+        -------
+        List of the lines printed by the firmware.
+        """
+        return [line for line, shown in self.exchange(data)]
+
+    def exchange(self, data):
+        """
+        Same as receive, each line comes in a tuple (line, shown) where
+        shown is True if the strip was shown before the line was printed.
+        """
+        self.buffer.extend(data)
+        lines = []
+        while self.buffer:
+            shows = self.shows
+            if self.buffer[0] == BinaryCodec.SYNC:
+                line = self._readFrame()
+            else:
+                line = self._readJSON()
+            if line is None:
+                break
+            lines.append((line, self.shows > shows))
+        return lines
+
+    def transmit(self, data, start, byteTime):
+        """
+        Same as exchange with the timing of the serial link and of the
+        strip: byte i of data arrives at start + (i + 1) * byteTime and
+        each show keeps the firmware from reading for SHOW_TIME.
+        ----------
+        data : bytes
+            Bytes received from the host, empty to read the receive buffer
+            once the show ended.
+        start : float
+            Time the link starts carrying data, at least the time it
+            finished carrying the previous bytes.
+        byteTime : float
+            Seconds the link takes to carry a byte.
+        Returns
+        -------
+        List of tuples (line, shown, time), the time the line is printed.
+        """
+        lines = []
+        i = 0
+        while True:
+            arrival = start + min(i + 1, len(data)) * byteTime
+            if self.rx and self.busy <= arrival:
+                # The show ended, the receive buffer is read at once
+                waiting = bytes(self.rx)
+                self.rx.clear()
+                read = self._consume(waiting, self.busy, 0, lines)
+                self.rx.extend(waiting[read:])
+                continue
+            if i == len(data):
+                return lines
+            if arrival < self.busy:
+                end = i
+                while end < len(data) and \
+                        start + (end + 1) * byteTime < self.busy:
+                    end += 1
+                room = max(0, self.RX_BUFFER - len(self.rx))
+                self.rx.extend(data[i:min(end, i + room)])
+                self.dropped += max(0, end - i - room)
+                i = end
+                continue
+            i += self._consume(data[i:], start + i * byteTime, byteTime, lines)
+
+    def _consume(self, data, start, byteTime, lines):
+        """
+        Reads the bytes arriving from start until a show begins, the lines
+        printed are appended to lines. Returns the number of bytes read,
+        the bytes after a show arrive while it runs.
+        """
+        self.buffer.extend(data)
+        while self.buffer:
+            shows = self.shows
+            if self.buffer[0] == BinaryCodec.SYNC:
+                line = self._readFrame()
+            else:
+                line = self._readJSON()
+            if line is None:
+                break
+            read = max(0, len(data) - len(self.buffer))
+            at = start + read * byteTime
+            if self.shows > shows:
+                self.busy = at + self.SHOW_TIME
+                lines.append((line, True, self.busy))
+                del self.buffer[:]
+                return read
+            lines.append((line, False, at))
+        return len(data)
+
+    def _readJSON(self):
+        """
+        Mirrors parseObject(Serial): leading spaces are skipped, anything
+        else than an object is a failure, an object waits until it is
+        complete.
+        """
+        start = 0
+        while start < len(self.buffer) and chr(self.buffer[start]).isspace():
+            start += 1
+        if start == len(self.buffer):
+            del self.buffer[:start]
+            return None
+        if self.buffer[start] != ord('{'):
+            del self.buffer[:start + 1]
+            self.errors += 1
+            return self.ERROR_MESSAGE
+        end = self._objectEnd(start)
+        if end is None:
+            return None
+        text = bytes(self.buffer[start:end]).decode(errors='replace')
+        del self.buffer[:end]
+        try:
+            root = json.loads(text)
+        except ValueError:
+            root = None
+        if not isinstance(root, dict) or \
+                self._jsonSize(root) > self.JSON_BUFFER_SIZE:
+            self.errors += 1
+            return self.ERROR_MESSAGE
+        self._execute(root)
+        return self.ACK_MESSAGE
+
+    def _jsonSize(self, value):
+        """ Bytes of the JSON buffer taken by a parsed value. """
+        if isinstance(value, dict):
+            return self.JSON_LIST_SIZE + sum(
+                self.JSON_OBJECT_NODE_SIZE + len(k.encode()) + 1 +
+                self._jsonSize(v) for k, v in value.items()
+            )
+        if isinstance(value, list):
+            return self.JSON_LIST_SIZE + sum(
+                self.JSON_ARRAY_NODE_SIZE + self._jsonSize(v) for v in value
+            )
+        if isinstance(value, str):
+            return len(value.encode()) + 1
+        return 0
+
+    def _objectEnd(self, start):
+        """ Index after the object starting at start, None if incomplete. """
+        depth, inString, escape = 0, False, False
+        for i in range(start, len(self.buffer)):
+            c = chr(self.buffer[i])
+            if inString:
+                if escape:
+                    escape = False
+                elif c == '\\':
+                    escape = True
+                elif c == '"':
+                    inString = False
+            elif c == '"':
+                inString = True
+            elif c in '{[':
+                depth += 1
+            elif c in '}]':
+                depth -= 1
+                if depth == 0:
+                    return i + 1
+        return None
+
+    def _execute(self, root):
+        """ Applies a parsed JSON instruction as the firmware does. """
+        block = self._fields(root.get("block"), 5)
+        blockIndex, blockSize = block[0], block[1]
+        start = blockIndex * blockSize
+        if block[2] >= 0:
+            for i in range(start, start + blockSize):
+                self._set(i, tuple(block[2:]))
+        for led in root.get("led") or []:
+            fields = self._fields(led, 4)
+            self._set(start + fields[0], tuple(fields[1:]))
+        self._show(self._toInt(root.get("brightness")))
+
+    def _readFrame(self):
+        """ Mirrors readFrame() of the firmware. """
+        header = BinaryCodec.HEADER_SIZE
+        if len(self.buffer) < header:
+            return None
+        opcode = self.buffer[2] & ~BinaryCodec.STAGED
+        length = self.codec.length(self.buffer)
+        if self.buffer[1] != BinaryCodec.VERSION or length > self.FRAME_SIZE:
+            del self.buffer[:header]
+            self.errors += 1
+            return self.BINARY_ERROR_MESSAGE
+        if len(self.buffer) < length:
+            return None
+        frame = bytes(self.buffer[:length])
+        del self.buffer[:length]
+        if sum(frame[1:-1]) & 0xFF != frame[-1] or opcode not in (
+                BinaryCodec.OP_FILL, BinaryCodec.OP_LEDS,
+                BinaryCodec.OP_SHOW, BinaryCodec.OP_HELLO):
+            self.errors += 1
+            return self.BINARY_ERROR_MESSAGE
+        if opcode == BinaryCodec.OP_HELLO:
+            return BinaryCodec.HELLO_MESSAGE
+        decoded = self.codec.decode(frame)
+        if opcode == BinaryCodec.OP_SHOW:
+            self._show(decoded['brightness'])
+            return self.ACK_MESSAGE
+        start = decoded['block'] * decoded['size']
+        if decoded['fill'] is not None:
+            for i in range(start, start + decoded['size']):
+                self._set(i, decoded['fill'])
+        for index, rgb in decoded['leds']:
+            self._set(start + index, rgb)
+        if not decoded['staged']:
+            self._show(decoded['brightness'])
+        return self.ACK_MESSAGE
+
+    def _set(self, index, rgb):
+        if 0 <= index < self.NUM_LEDS:
+            # setRGB() keeps the low byte of each value
+            self.leds[index] = tuple(c & 0xFF for c in rgb)
+        else:
+            self.overflows += 1
+
+    def _show(self, brightness):
+        self.brightness = brightness & 0xFF
+        self.visible = list(self.leds)
+        self.shows += 1
+
+    def _fields(self, text, count):
+        """ Splits a comma separated string like the firmware loops. """
+        fields = [self._toInt(f) for f in str(text or '').split(',')]
+        return (fields + [0] * count)[:count]
+
+    @staticmethod
+    def _toInt(text):
+        """ Mirrors String.toInt(), the leading integer or 0. """
+        text = str(text if text is not None else '').strip()
+        digits = ''
+        for i, c in enumerate(text):
+            if c.isdigit() or (i == 0 and c in '+-'):
+                digits += c
+            else:
+                break
+        try:
+            return int(digits)
+        except ValueError:
+            return 0
+
+
+class PtyEmulator(object):
+    """
+    Serves a VirtualArduino on a pseudo-terminal. The bytes are processed
+    only once the simulated link at `baud` would have delivered them, each
+    show of the strip takes the time of FastLED.show() and the answers are
+    written when the firmware would print them. The host is read meanwhile,
+    so the bytes it sends during a show go through the receive buffer.
+    """
+    BITS_PER_BYTE = 10
+
+    def __init__(self, baud=57600, link=True):
+        """
+        ----------
+        baud : int
+            Simulated baud rate of the serial link.
+        link : bool
+            False to process the bytes as fast as they come.
+        Returns
+        -------
+        new PtyEmulator Object
+        """
+        self.baud = baud
+        self.link = link
+        self.arduino = VirtualArduino()
+        self.master, self.slave = os.openpty()
+        tty.setraw(self.slave)
+        self.port = os.ttyname(self.slave)
+        self.received = 0
+        self.running = False
+        self.thread = None
+
+    def start(self):
+        """ Serves the pseudo-terminal in a background thread. """
+        self.running = True
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        """ Stops serving and closes the pseudo-terminal. """
+        self.running = False
+        if self.thread is not None:
+            self.thread.join()
+        os.close(self.master)
+        os.close(self.slave)
+
+    def run(self):
+        """ Reads the host bytes and writes the firmware answers. """
+        arduino = self.arduino
+        byteTime = self.BITS_PER_BYTE / self.baud
+        lineFree = time.monotonic()
+        # Tuples (time, line) of the answers not printed yet
+        answers = deque()
+        while self.running:
+            now = time.monotonic()
+            while answers and answers[0][0] <= now:
+                self._answer(answers.popleft()[1])
+            timeout = 0.1
+            if answers:
+                timeout = min(timeout, answers[0][0] - now)
+            if arduino.rx:
+                timeout = min(timeout, arduino.busy - now)
+            ready, _, _ = select.select(
+                [self.master], [], [], max(0, timeout)
+            )
+            if not ready:
+                if arduino.rx:
+                    answers.extend(
+                        (at, line) for line, shown, at in
+                        arduino.transmit(b'', time.monotonic(), byteTime)
+                    )
+                continue
+            try:
+                data = os.read(self.master, 4096)
+            except OSError:
+                break
+            self.received += len(data)
+            if not self.link:
+                for line in arduino.receive(data):
+                    self._answer(line)
+                continue
+            start = max(lineFree, time.monotonic())
+            lineFree = start + len(data) * byteTime
+            answers.extend(
+                (at, line) for line, shown, at in
+                arduino.transmit(data, start, byteTime)
+            )
+
+    def _answer(self, line):
+        os.write(self.master, (line + "\r\n").encode())
+
+
+def main():
+    parser = argparse.ArgumentParser(description='MoCA virtual Arduino')
+    parser.add_argument(
+        '--baud', type=int, default=57600,
+        help='simulated baud rate, default: 57600'
+    )
+    parser.add_argument(
+        '--link', type=int, default=1,
+        help='simulate the link and strip timing, default: 1'
+    )
+    args = parser.parse_args()
+    emulator = PtyEmulator(args.baud, bool(args.link)).start()
+    print("Virtual Arduino on %s" % (emulator.port))
+    try:
+        while True:
+            time.sleep(5)
+            arduino = emulator.arduino
+            logger.info(
+                "bytes: %d, dropped: %d, shows: %d, errors: %d, lit: %d"
+                % (emulator.received, arduino.dropped, arduino.shows,
+                   arduino.errors,
+                   sum(1 for led in arduino.leds if led != (0, 0, 0)))
+            )
+    except KeyboardInterrupt:
+        emulator.stop()
+
+
+if __name__ == '__main__':
+    main()
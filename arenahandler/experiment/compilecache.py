@@ -0,0 +1,97 @@
+"""
+This module caches the work done before a state is transmitted. The parsed
+states and experiments are keyed by a digest of their canonical JSON, which
+includes the geometry of the arena, and the compiled frames and instruction
+streams are keyed by the parsed arena itself, an immutable value equal for
+equal content. The cache is a bounded LRU shared by the event loop and the
+executor.
+"""
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+
+
+def digest(data):
+    """
+    This function computes the content address of a JSON value, the same
+    for any order of the keys and any spacing.
+    ----------
+    data : Object
+        The JSON value as python objects.
+
+    Returns
+    -------
+    The hexadecimal SHA-256 of the canonical JSON.
+
+    """
+    canonical = json.dumps(data, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+class CompileCache(object):
+    """
+    Bounded LRU cache with hit, miss and eviction counters.
+    """
+    SIZE = 256
+
+    def __init__(self, size=SIZE):
+        """
+        ----------
+        size : int
+            Maximum number of entries, 0 disables the cache.
+        Returns
+        -------
+        new CompileCache Object
+        """
+        self.size = max(0, size)
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, build):
+        """
+        Returns the value of the key, built and stored on a miss.
+        ----------
+        key : Object
+            Hashable key of the value.
+        build : function
+            Called without arguments to build the value on a miss, the
+            exceptions are not cached.
+        Returns
+        -------
+        The cached or built value.
+        """
+        with self.lock:
+            if key in self.entries:
+                self.hits += 1
+                self.entries.move_to_end(key)
+                return self.entries[key]
+            self.misses += 1
+        value = build()
+        with self.lock:
+            if self.size:
+                self.entries[key] = value
+                self.entries.move_to_end(key)
+                while len(self.entries) > self.size:
+                    self.entries.popitem(last=False)
+                    self.evictions += 1
+        return value
+
+    def clear(self):
+        """ Removes every entry, the counters are kept. """
+        with self.lock:
+            self.entries.clear()
+
+    def toDict(self):
+        """ Summary of the counters. """
+        with self.lock:
+            return {
+                'size': self.size,
+                'entries': len(self.entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions
+            }
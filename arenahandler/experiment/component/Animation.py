@@ -0,0 +1,52 @@
+from typing import NamedTuple, Tuple
+
+from .Keyframe import Keyframe
+from .parsing import parseInt, parseList, parseNumber
+
+
+class Animation(NamedTuple):
+    """ 
+    Keyframes in time order rendered into frames at `fps` frames per second
+    between them, played `repetitions` times.
+    """
+    fps: float
+    repetitions: int
+    keyframes: Tuple[Keyframe, ...]
+
+    FPS = 30
+
+    @classmethod
+    def fromDict(cls, data, where='animation'):
+        """ 
+        Parses and validates the JSON object of the animation, every
+        keyframe must have the geometry of the first one.
+        """
+        fps = parseNumber(data, 'fps', where, cls.FPS)
+        if fps <= 0:
+            raise ValueError("%s: 'fps' must be positive" % (where))
+        repetitions = parseInt(data, 'repetitions', where, 1, 1)
+        keyframes = parseList(data, 'keyframes', where, Keyframe.fromDict)
+        if not keyframes:
+            raise ValueError("%s: 'keyframes' cannot be empty" % (where))
+        first = keyframes[0].arena
+        for i, keyframe in enumerate(keyframes):
+            arena = keyframe.arena
+            if i and keyframe.time < keyframes[i - 1].time:
+                raise ValueError(
+                    "%s.keyframes[%d]: 'time' cannot go back" % (where, i)
+                )
+            if (arena.edges, arena.blocks, arena.leds) != \
+                    (first.edges, first.blocks, first.leds):
+                raise ValueError(
+                    "%s.keyframes[%d].arena: the geometry must be the one "
+                    "of the first keyframe" % (where, i)
+                )
+        return cls(fps, repetitions, keyframes)
+
+    def duration(self):
+        """ Seconds of one repetition. """
+        return self.keyframes[-1].time
+
+    def frameCount(self):
+        """ Frames rendered when the link keeps up with `fps`. """
+        return int(self.duration() * self.repetitions * self.fps) + 1
@@ -1,19 +1,40 @@
-import json
+from typing import NamedTuple, Optional, Tuple
 
+from .Block import Block
+from .Edge import Edge
+from .Led import Led
+from .parsing import parseColor, parseGeometry, parseInt, parseList
+from ..topology import capacity, parseTopology
+from ..utils.readconfig import config
 
-class Arena(object):
+
+class Arena(NamedTuple):
     """ 
+    The geometry of the arena, its brightness and color and the edges,
+    blocks and LEDs colored individually. An arena cannot have more LEDs
+    than MAX_LEDS, the LEDs the configured controllers hold together.
     """
+    edges: int
+    blocks: int
+    leds: int
+    brightness: int
+    color: Optional[Tuple[int, int, int]]
+    edge: Tuple[Edge, ...]
+    block: Tuple[Block, ...]
+    led: Tuple[Led, ...]
+
+    MAX_LEDS = capacity(parseTopology(config))
 
-    def __init__(self, data):
+    @classmethod
+    def fromDict(cls, data, where='arena'):
         """ 
+        Parses and validates the JSON object of the arena.
         """
-        self.edges = 0
-        self.blocks = 0
-        self.leds = 0
-        self.color = ''
-        self.brightness = 0
-        self.edge = []
-        self.block = []
-        self.led = []
-        self.__dict__ = json.loads(data)
+        return cls(
+            *parseGeometry(data, where, cls.MAX_LEDS),
+            parseInt(data, 'brightness', where, 0),
+            parseColor(data, where),
+            parseList(data, 'edge', where, Edge.fromDict),
+            parseList(data, 'block', where, Block.fromDict),
+            parseList(data, 'led', where, Led.fromDict)
+        )
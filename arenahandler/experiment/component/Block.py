@@ -1,14 +1,25 @@
-import json
+from typing import NamedTuple, Optional, Tuple
 
+from .Led import Led
+from .parsing import parseColor, parseIndex, parseList
 
-class Block(object):
+
+class Block(NamedTuple):
     """ 
+    One or a range of blocks, their color and the LEDs inside them.
     """
+    index: range
+    ranged: bool
+    color: Optional[Tuple[int, int, int]]
+    led: Tuple[Led, ...]
 
-    def __init__(self, data):
+    @classmethod
+    def fromDict(cls, data, where='block'):
         """ 
+        Parses and validates the JSON object of the blocks.
         """
-        self.index = []
-        self.color = ""
-        self.led = []
-        self.__dict__ = json.loads(data)
+        index, ranged = parseIndex(data, where)
+        return cls(
+            index, ranged, parseColor(data, where),
+            parseList(data, 'led', where, Led.fromDict)
+        )
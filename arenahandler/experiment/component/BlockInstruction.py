@@ -2,6 +2,16 @@ import json
 
 
 class BlockInstruction:
+    """ 
+    The firmware parses every instruction into a StaticJsonBuffer of
+    JSON_BUFFER_SIZE bytes. The sizes below are the ones of ArduinoJson 5
+    on the 8-bit AVR of the Arduino MEGA, strings are copied into the buffer
+    because the instruction is parsed from the serial stream.
+    """
+    JSON_BUFFER_SIZE = 300
+    LIST_SIZE = 4
+    ARRAY_NODE_SIZE = 7
+    OBJECT_NODE_SIZE = 9
 
     def __init__(self):
         self.brightness = 0
@@ -12,3 +22,24 @@ class BlockInstruction:
         return json.dumps(
             self, default=lambda o: o.__dict__, sort_keys=True, indent=4
         )
+
+    def bufferSize(self):
+        """ Bytes of the firmware JSON buffer used by this instruction. """
+        return BlockInstruction.jsonBufferSize(self.__dict__)
+
+    @staticmethod
+    def jsonBufferSize(value):
+        """ Bytes of the firmware JSON buffer used by a parsed JSON value. """
+        if isinstance(value, dict):
+            return BlockInstruction.LIST_SIZE + sum(
+                BlockInstruction.OBJECT_NODE_SIZE + len(k.encode()) + 1 +
+                BlockInstruction.jsonBufferSize(v) for k, v in value.items()
+            )
+        if isinstance(value, list):
+            return BlockInstruction.LIST_SIZE + sum(
+                BlockInstruction.ARRAY_NODE_SIZE +
+                BlockInstruction.jsonBufferSize(v) for v in value
+            )
+        if isinstance(value, str):
+            return len(value.encode()) + 1
+        return 0
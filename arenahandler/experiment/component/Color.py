@@ -26,3 +26,9 @@ class Color(Enum):
     ZOMBIE = "27,165,44"
     PUMP = "241,88,2"
     PURPLE = "124,16,173"
+
+    @classmethod
+    def rgb(cls, name):
+        """ The RGB tuple of a color name, None for the omitted color. """
+        rgb = tuple(int(c) for c in cls[name.upper()].value.split(','))
+        return None if rgb[0] < 0 else rgb
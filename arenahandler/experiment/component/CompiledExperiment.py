@@ -0,0 +1,48 @@
+from typing import Dict, NamedTuple, Optional, Tuple
+
+from .Arena import Arena
+from .CompiledState import CompiledState
+from .Experiment import Experiment
+from .Frame import Frame
+
+
+class CompiledExperiment(NamedTuple):
+    """
+    An experiment with the frame of every arena compiled before it starts
+    and the prediction of its transmission: the bytes and instructions sent
+    and the time the slowest serial link takes to carry them. The
+    instructions and bytes sent to each controller for every transition
+    between two arenas are kept in `costs`, the first state comes from None.
+    `duration` is the seconds the experiment takes, see Experiment.duration.
+    """
+    id: str
+    experiment: Experiment
+    frames: Dict[Arena, Frame]
+    events: int
+    bytes: int
+    instructions: int
+    transmitTime: float
+    costs: Dict[Tuple[Optional[Arena], Arena], Tuple[Tuple[int, int], ...]]
+    duration: float
+
+    def timeline(self):
+        """
+        The events of the experiment with their compiled payload, each event
+        is a tuple (offset, CompiledState) with the bytes predicted for it.
+        """
+        previous = None
+        for offset, arena in self.experiment.timeline():
+            nbytes = tuple(b for i, b in self.costs[(previous, arena)])
+            yield offset, CompiledState(arena, self.frames[arena], nbytes)
+            previous = arena
+
+    def toDict(self):
+        """ Summary of the prediction. """
+        return {
+            'id': self.id,
+            'states': self.events,
+            'bytes': self.bytes,
+            'instructions': self.instructions,
+            'transmitTime': self.transmitTime,
+            'duration': self.duration
+        }
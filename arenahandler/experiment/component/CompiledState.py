@@ -0,0 +1,15 @@
+from typing import NamedTuple, Optional, Tuple
+
+from .Arena import Arena
+from .Frame import Frame
+
+
+class CompiledState(NamedTuple):
+    """
+    An arena with its compiled frame, the payload sent by the serial writer,
+    and the bytes predicted to send it to each controller, None when they
+    are not known. The arena is None for a raw frame.
+    """
+    arena: Optional[Arena]
+    frame: Frame
+    bytes: Optional[Tuple[int, ...]] = None
@@ -1,15 +1,28 @@
-import json
+from typing import NamedTuple, Optional, Tuple
 
+from .Block import Block
+from .Led import Led
+from .parsing import parseColor, parseIndex, parseList
 
-class Edge(object):
+
+class Edge(NamedTuple):
     """ 
+    One or a range of edges, their color and the blocks and LEDs inside them.
     """
+    index: range
+    ranged: bool
+    color: Optional[Tuple[int, int, int]]
+    block: Tuple[Block, ...]
+    led: Tuple[Led, ...]
 
-    def __init__(self, data):
+    @classmethod
+    def fromDict(cls, data, where='edge'):
         """ 
+        Parses and validates the JSON object of the edges.
         """
-        self.index = []
-        self.color = ""
-        self.block = []
-        self.led = []
-        self.__dict__ = json.loads(data)
\ No newline at end of file
+        index, ranged = parseIndex(data, where)
+        return cls(
+            index, ranged, parseColor(data, where),
+            parseList(data, 'block', where, Block.fromDict),
+            parseList(data, 'led', where, Led.fromDict)
+        )
@@ -1,39 +1,108 @@
-import json
 import math
-import copy
+from typing import NamedTuple, Tuple
 
-from .State import State
 from .Arena import Arena
+from .Color import Color
+from .State import State
+from .parsing import parseBool, parseList, parseNumber
 
 
-class Experiment(object):
+class Experiment(NamedTuple):
     """ 
+    A sequence of states, repeated until totalTime when repeat is set and
+    followed by the arena turned off when clean is set.
     """
+    totalTime: float
+    repeat: bool
+    clean: bool
+    states: Tuple[State, ...]
+    sumTimeStates: float
+    repeatTimes: int
 
-    def __init__(self, data):
+    @classmethod
+    def fromDict(cls, data, where='experiment'):
         """ 
+        Parses and validates the JSON object of the experiment.
         """
-        self.totalTime = 0
-        self.repeat = False
-        self.clean = True
-        self.states = []
-        self.sumTimeStates = 0
-        self.repeatTimes = 0
-        self.__dict__ = json.loads(data)
-
-    def toJSON(self):
-        return json.dumps(
-            self, default=lambda o: o.__dict__, sort_keys=True, indent=4
+        totalTime = parseNumber(data, 'totalTime', where, 0)
+        repeat = parseBool(data, 'repeat', where, False)
+        clean = parseBool(data, 'clean', where, True)
+        states = parseList(data, 'states', where, State.fromDict)
+        if not states:
+            raise ValueError("%s: 'states' cannot be empty" % (where))
+        sumTimeStates = sum(state.time for state in states)
+        if repeat and sumTimeStates <= 0:
+            raise ValueError(
+                "%s: the states of a repeated experiment need time" % (where)
+            )
+        repeatTimes = math.ceil(totalTime / sumTimeStates) if (repeat) else 1
+        return cls(
+            totalTime, repeat, clean, states, sumTimeStates, repeatTimes
         )
 
-    def parseStates(self):
-        sts = []
-        for state in self.states:
-            s = State(json.dumps(state))
-            a = Arena(json.dumps(s.arena))
-            s.arena = copy.copy(a)
-            sts.append(s)
-        self.states = sts
-        self.sumTimeStates = sum(state.time for state in self.states)
-        self.repeatTimes = math.ceil(
-            self.totalTime / self.sumTimeStates) if (self.repeat) else 1
+    def timeline(self):
+        """ 
+        Generates the events of the experiment lazily, so the memory does
+        not depend on totalTime. Each event is a tuple (offset, arena) where
+        the offset is in seconds from the start of the experiment.
+        """
+        full, tail = self.cycles()
+        for cycle in range(full):
+            yield from self._cycle(cycle, len(self.states))
+        yield from self._cycle(full, tail)
+        if self.clean:
+            yield self._end() + self.states[-1].time, self.cleanArena()
+
+    def cycles(self):
+        """ 
+        The repetitions of the states, without generating the timeline:
+        tuple (full, tail) with the number of cycles through all the states
+        and the number of states of the last cycle, cut once it starts after
+        totalTime, 0 if there is no such cycle.
+        """
+        if not self.repeat:
+            return 1, 0
+        if self.repeatTimes == 0:
+            return 0, 0
+        delay = (self.repeatTimes - 1) * self.sumTimeStates
+        for i, state in enumerate(self.states):
+            if delay > self.totalTime:
+                return self.repeatTimes - 1, i + 1
+            delay += state.time
+        return self.repeatTimes, 0
+
+    def events(self):
+        """ Number of events of the timeline. """
+        full, tail = self.cycles()
+        return full * len(self.states) + tail + (1 if self.clean else 0)
+
+    def duration(self):
+        """ 
+        Seconds from the start of the experiment until it is over: its last
+        event when the arena is cleaned, otherwise the end of its last state.
+        """
+        full, tail = self.cycles()
+        if self.clean or tail or not full:
+            return self._end() + self.states[-1].time
+        return self._end()
+
+    def _cycle(self, cycle, count):
+        delay = cycle * self.sumTimeStates
+        for state in self.states[:count]:
+            yield delay, state.arena
+            delay += state.time
+
+    def _end(self):
+        """ Offset of the last state when the cycle is cut, else its end. """
+        full, tail = self.cycles()
+        if tail:
+            return full * self.sumTimeStates + sum(
+                state.time for state in self.states[:tail - 1]
+            )
+        return full * self.sumTimeStates
+
+    def cleanArena(self):
+        """ The arena of the last state turned off. """
+        return self.states[-1].arena._replace(
+            color=Color.rgb('none'), edge=(), block=(), led=()
+        )
@@ -0,0 +1,133 @@
+from itertools import chain
+
+from ..indexresolver import within
+
+
+class Frame(object):
+    """
+    Frame buffer of a whole arena, one RGB tuple per LED in absolute strip
+    order. A LED set to None is not touched by the state, the hardware keeps
+    whatever it was showing before.
+    """
+
+    def __init__(self, edges, blocks, leds, brightness):
+        """
+        ----------
+        edges : int
+            Number of edges of the arena.
+        blocks : int
+            Number of blocks per edge.
+        leds : int
+            Number of LEDs per block.
+        brightness : int
+            Brightness of the whole strip.
+        Returns
+        -------
+        new Frame Object
+        """
+        self.edges = edges
+        self.blocks = blocks
+        self.leds = leds
+        self.brightness = brightness
+        self.pixels = [None] * (edges * blocks * leds)
+
+    @classmethod
+    def fromRGB(cls, edges, blocks, leds, brightness, data):
+        """
+        A frame with every LED set from raw RGB bytes in absolute strip
+        order, three bytes per LED. The size of the data is checked before
+        the frame is allocated.
+        """
+        if len(data) != 3 * edges * blocks * leds:
+            raise ValueError(
+                "the frame needs %d RGB bytes, got %d"
+                % (3 * edges * blocks * leds, len(data))
+            )
+        frame = cls(edges, blocks, leds, brightness)
+        frame.pixels = list(zip(data[0::3], data[1::3], data[2::3]))
+        return frame
+
+    def toRGB(self):
+        """
+        The raw RGB bytes of the frame in absolute strip order, three bytes
+        per LED, the LEDs untouched are black.
+        """
+        return bytes(chain.from_iterable(
+            pixel or (0, 0, 0) for pixel in self.pixels
+        ))
+
+    def blend(self, other, weight):
+        """
+        The frame between this one and another one of the same geometry.
+        ----------
+        other : Object
+            The frame reached when the weight is 1.
+        weight : float
+            Position between the frames, from 0 to 1.
+        Returns
+        -------
+        new Frame Object, a LED untouched by one of the frames takes the
+        color of the other one.
+        """
+        frame = Frame(
+            self.edges, self.blocks, self.leds,
+            round(self.brightness + (other.brightness - self.brightness) *
+                  weight)
+        )
+        frame.pixels = [
+            a if b is None or a == b else b if a is None else (
+                round(a[0] + (b[0] - a[0]) * weight),
+                round(a[1] + (b[1] - a[1]) * weight),
+                round(a[2] + (b[2] - a[2]) * weight)
+            )
+            for a, b in zip(self.pixels, other.pixels)
+        ]
+        return frame
+
+    def blockCount(self):
+        """ Number of blocks in the whole arena. """
+        return self.edges * self.blocks
+
+    def block(self, index):
+        """ The pixels of the block at the zero based index. """
+        return self.pixels[index * self.leds:(index + 1) * self.leds]
+
+    def delta(self, shown):
+        """
+        The part of the frame that differs from what the strip shows.
+        ----------
+        shown : list
+            Colors shown by the strip in absolute order, None if unknown.
+        Returns
+        -------
+        new Frame Object where the unchanged LEDs are None.
+        """
+        delta = Frame(self.edges, self.blocks, self.leds, self.brightness)
+        for i, pixel in enumerate(self.pixels):
+            if pixel is not None and (i >= len(shown) or shown[i] != pixel):
+                delta.pixels[i] = pixel
+        return delta
+
+    def paint(self, shown):
+        """
+        Updates the colors shown by the strip once the frame is applied.
+        ----------
+        shown : list
+            Colors shown by the strip in absolute order, None if unknown.
+        """
+        if len(shown) < len(self.pixels):
+            shown.extend([None] * (len(self.pixels) - len(shown)))
+        for i, pixel in enumerate(self.pixels):
+            if pixel is not None:
+                shown[i] = pixel
+
+    def fill(self, positions, color):
+        """
+        Sets the LEDs of a range of zero based absolute positions with a
+        single slice assignment. The positions outside the arena and the
+        omitted colors are ignored.
+        """
+        positions = within(positions, 0, len(self.pixels))
+        if color is not None and positions:
+            self.pixels[positions.start:positions.stop:positions.step] = \
+                [color] * len(positions)
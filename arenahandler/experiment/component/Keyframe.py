@@ -0,0 +1,34 @@
+from typing import NamedTuple
+
+from .Arena import Arena
+from .parsing import parseNumber, require
+
+
+class Keyframe(NamedTuple):
+    """ 
+    An arena reached at `time` seconds from the start of the animation, the
+    colors and brightness move towards it following the `easing` curve.
+    """
+    time: float
+    easing: str
+    arena: Arena
+
+    EASINGS = ('linear', 'ease-in', 'ease-out', 'ease-in-out', 'step')
+
+    @classmethod
+    def fromDict(cls, data, where='keyframe'):
+        """ 
+        Parses and validates the JSON object of the keyframe.
+        """
+        easing = data.get('easing', 'linear') if isinstance(data, dict) \
+            else None
+        if easing not in cls.EASINGS:
+            raise ValueError(
+                "%s: 'easing' must be one of %s"
+                % (where, ', '.join(cls.EASINGS))
+            )
+        return cls(
+            parseNumber(data, 'time', where),
+            easing,
+            Arena.fromDict(require(data, 'arena', where), where + '.arena')
+        )
@@ -1,13 +1,20 @@
-import json
+from typing import NamedTuple, Optional, Tuple
 
+from .parsing import parseColor, parseIndex
 
-class Led(object):
+
+class Led(NamedTuple):
     """ 
+    One or a range of LEDs and their color, None when the color is omitted.
     """
+    index: range
+    ranged: bool
+    color: Optional[Tuple[int, int, int]]
 
-    def __init__(self, data):
+    @classmethod
+    def fromDict(cls, data, where='led'):
         """ 
+        Parses and validates the JSON object of the LEDs.
         """
-        self.index = []
-        self.color = ""
-        self.__dict__ = json.loads(data)
+        index, ranged = parseIndex(data, where)
+        return cls(index, ranged, parseColor(data, where))
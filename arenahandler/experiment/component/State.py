@@ -1,13 +1,22 @@
-import json
+from typing import NamedTuple
 
+from .Arena import Arena
+from .parsing import parseNumber, require
 
-class State(object):
+
+class State(NamedTuple):
     """ 
+    An arena and the time in seconds it lasts within an experiment.
     """
+    time: float
+    arena: Arena
 
-    def __init__(self, data):
+    @classmethod
+    def fromDict(cls, data, where='state'):
         """ 
+        Parses and validates the JSON object of the state.
         """
-        self.time = 0
-        self.arena = None
-        self.__dict__ = json.loads(data)
\ No newline at end of file
+        return cls(
+            parseNumber(data, 'time', where),
+            Arena.fromDict(require(data, 'arena', where), where + '.arena')
+        )
@@ -0,0 +1,131 @@
+"""
+This module contains the helpers used by the components to parse and
+validate the JSON of the states and experiments, every problem is reported
+as a ValueError naming the offending field.
+"""
+from .Color import Color
+
+
+def require(data, key, where):
+    """ The value of a mandatory key. """
+    if not isinstance(data, dict):
+        raise ValueError("%s must be an object" % (where))
+    if key not in data:
+        raise ValueError("%s: missing '%s'" % (where, key))
+    return data[key]
+
+
+def parseInt(data, key, where, minimum=None, default=None):
+    """ An integer value, optionally bounded and optional. """
+    value = data.get(key, default) if default is not None \
+        else require(data, key, where)
+    if isinstance(value, bool) or not isinstance(value, int):
+        raise ValueError("%s: '%s' must be an integer" % (where, key))
+    if minimum is not None and value < minimum:
+        raise ValueError(
+            "%s: '%s' must be at least %d" % (where, key, minimum)
+        )
+    return value
+
+
+def parseGeometry(data, where, capacity):
+    """
+    The edges, blocks and LEDs per block of an arena, an arena with more
+    LEDs than `capacity` is rejected before anything is allocated for it.
+    """
+    edges = parseInt(data, 'edges', where, 1)
+    blocks = parseInt(data, 'blocks', where, 1)
+    leds = parseInt(data, 'leds', where, 1)
+    if edges * blocks * leds > capacity:
+        raise ValueError(
+            "%s: the arena has %d LEDs, the controllers hold %d"
+            % (where, edges * blocks * leds, capacity)
+        )
+    return edges, blocks, leds
+
+
+def parseNumber(data, key, where, default=None):
+    """ A non negative number, optional when a default is given. """
+    value = data.get(key, default) if default is not None \
+        else require(data, key, where)
+    if isinstance(value, bool) or not isinstance(value, (int, float)) \
+            or value < 0:
+        raise ValueError(
+            "%s: '%s' must be a non negative number" % (where, key)
+        )
+    return value
+
+
+def parseBool(data, key, where, default):
+    """ An optional boolean value. """
+    value = data.get(key, default)
+    if not isinstance(value, bool):
+        raise ValueError("%s: '%s' must be true or false" % (where, key))
+    return value
+
+
+def parseColor(data, where):
+    """ The RGB tuple of the color name, None for the omitted color. """
+    name = require(data, 'color', where)
+    try:
+        return Color.rgb(name)
+    except (KeyError, AttributeError):
+        raise ValueError("%s: unknown color '%s'" % (where, name))
+
+
+def parseIndex(data, where):
+    """
+    The index of an edge, block or LED: one position or a range given as
+    [start, end] or [start, end, step].
+    Returns
+    -------
+    Tuple (positions, ranged) where positions is a python range, even for
+    a single position, and ranged tells if it was written as a range.
+    """
+    index = require(data, 'index', where)
+    if not isinstance(index, list) or not 1 <= len(index) <= 3 or any(
+            isinstance(i, bool) or not isinstance(i, int) for i in index):
+        raise ValueError(
+            "%s: 'index' must be a list of 1 to 3 integers" % (where)
+        )
+    if len(index) == 3 and index[2] == 0:
+        raise ValueError("%s: the step of 'index' cannot be 0" % (where))
+    if len(index) == 1:
+        return range(index[0], index[0] + 1), False
+    return rangeToList(index), True
+
+
+def parseList(data, key, where, parser):
+    """ The optional list of nested objects, parsed with `parser`. """
+    items = data.get(key, [])
+    if not isinstance(items, list):
+        raise ValueError("%s: '%s' must be a list" % (where, key))
+    return tuple(
+        parser(item, "%s.%s[%d]" % (where, key, i))
+        for i, item in enumerate(items)
+    )
+
+
+def rangeToList(rng):
+    """
+    This function transform a python range to a list of values.
+    ----------
+    range : Object
+        A python range.
+
+    Returns
+    -------
+    List which contains the respective range values.
+
+    """
+    list = []
+    if len(rng) == 3:
+        list = range(rng[0], rng[1] - 1, rng[2]) \
+            if (rng[0] > rng[1]) else range(rng[0], rng[1] + 1, rng[2])
+        return list
+    elif len(rng) == 2:
+        list = range(rng[0], rng[1] - 1)\
+            if (rng[0] > rng[1]) else range(rng[0], rng[1] + 1)
+        return list
+    elif len(rng) == 1:
+        return rng
@@ -1,520 +1,820 @@
 """
 This is the fundamental module which parses and interprets the states and expe-
 riments that are comming from the http requests. This module utilises an sched-
-uler in order schedule the different states within an experiment. If there are
-task scheduled but an simple state execution is received then all the scheduled
-task are canceled. The module contains the implementation for the differente
-level of control offered by the language definiton.
+uler in order schedule the different states within an experiment, it runs on
+the asyncio event loop and the serial work is done in the executor. The
+experiments are queued by the jobqueue module and run one after the other, if
+a simple state execution is received then the queued experiments are
+canceled. The module contains the implementation for the differente level of
+control offered by the language definiton. The serial sessions are
+shared by every state and experiment, they are opened once by the server. The
+requests are parsed into immutable components when they arrive and the
+arenas are compiled into frame buffers by the framecompiler module before
+anything is sent. Every state goes through a single serial writer, the
+states waiting behind it are coalesced and only the newest is sent. The
+parsed requests and the compiled arenas are kept in a bounded LRU cache so
+the states received again go straight to the transmission. The arenas of an
+experiment are all compiled when it is received, so an invalid experiment is
+rejected before anything lights and the timeline only pushes frames. Each
+state of an experiment is handed to the writer ahead of its boundary by the
+time its bytes are predicted to take on the link, so it becomes visible on
+schedule. An arena may be driven by several controllers, each state is split
+by the topology module and the controllers are sent their part in parallel,
+the state is only applied once all of them acknowledged it. The streamed
+states and raw frames go through the same writer as the requests, as do the
+frames of the animations, rendered by the animator module from their keyframes.
 """
-import json
-import copy
-import sched
-import time
 import asyncio
-import threading
-
+import base64
+import itertools
+import logging
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter
+
+from .animator import Animator
 from .arduinointf.ArduinoInstruction import ArduinoInstruction
+from .compilecache import CompileCache, digest
+from .component.Animation import Animation
 from .component.Arena import Arena
-from .component.Edge import Edge
-from .component.Block import Block
-from .component.Led import Led
-from .component.BlockInstruction import BlockInstruction
-from .component.Color import Color
+from .component.CompiledExperiment import CompiledExperiment
+from .component.CompiledState import CompiledState
 from .component.Experiment import Experiment
+from .component.Frame import Frame
+from .component.parsing import parseBool, parseGeometry, parseInt, require
+from .framecompiler import compileArena, frameToInstructions
+from .jobqueue import JobQueue
+from .scheduler import Scheduler
+from .serialwriter import SerialWriter
+from .topology import parseTopology, split
 from .utils.readconfig import config
 import experiment.utils.logger as my_logger
-
-SERIALPORT = config["serialport"]
-BAUDRATE = config["baudrate"]
+import experiment.utils.metrics as metrics
+
+SHARDS = parseTopology(config)
+WINDOW = config.get("window", ArduinoInstruction.WINDOW)
+PROTOCOL = config.get("protocol", ArduinoInstruction.PROTOCOL)
+COMMIT = config.get("commit", ArduinoInstruction.COMMIT)
+CACHE_SIZE = config.get("cachesize", CompileCache.SIZE)
+# Events of an experiment listed by its preview
+PREVIEW_EVENTS = 256
+RECORD = config.get("record")
 logger = my_logger.get_logger('experimentctrl')
-scheduler = sched.scheduler(time.time, time.sleep)
+scheduler = Scheduler()
+animator = Animator()
+cache = CompileCache(CACHE_SIZE)
+# Tuples (shard, session), one serial session per controller
+controllers = [
+    (shard, ArduinoInstruction(shard.port, shard.baud, WINDOW, PROTOCOL,
+                               COMMIT, RECORD))
+    for shard in SHARDS
+]
+# The first controller is sent its part from the calling thread
+pool = ThreadPoolExecutor(max_workers=max(1, len(SHARDS) - 1))
+
+
+def openSession():
+    """
+        Opens the process-wide serial sessions, called once at startup.
+    """
+    for shard, aIns in controllers:
+        aIns.ensure_connection()
 
 
-async def runState(state):
+def closeSession():
     """
-        runState service controller.
+        Closes the process-wide serial sessions, called at shutdown.
+    """
+    writer.stop()
+    for shard, aIns in controllers:
+        aIns.close_connection()
+
+
+def parseState(state):
+    """
+        Parses and validates a state request, the errors are raised as
+        ValueError before anything is scheduled. An arena already received
+        is taken from the cache.
         ----------
         state : Dict
             Dictionary containing the state configuration.
         Returns
         -------
+        Arena object of the state.
     """
-    jsonArena = json.dumps(state['arena'])
-    arena = Arena(jsonArena)
-    if not scheduler.empty():
-        list(map(scheduler.cancel, scheduler.queue))
-    aIns = ArduinoInstruction(SERIALPORT, BAUDRATE)
-    aIns.start_connection()
-    generateArdInsForArena(arena, aIns)
-    aIns.close_connection()
+    data = require(state, 'arena', 'state')
+    return cache.get(('arena', digest(data)), lambda: Arena.fromDict(data))
 
 
-async def runExperiment(experiment):
+def parseExperiment(experiment):
     """
-        runExperiment service controller.
+        Parses and validates an experiment request, the errors are raised as
+        ValueError before anything is scheduled. An experiment already
+        received is taken from the cache.
         ----------
         experiment : Dict
             Dictionary containing the experiment configuration.
         Returns
         -------
+        Experiment object.
     """
-    delay = 0
-    jsonExperiment = json.dumps(experiment['experiment'])
-    exp = Experiment(jsonExperiment)
-    exp.parseStates()
-    aIns = ArduinoInstruction(SERIALPORT, BAUDRATE)
-    aIns.start_connection()
-    if not scheduler.empty():
-        list(map(scheduler.cancel, scheduler.queue))
-    for t in range(exp.repeatTimes):
-        for state in exp.states:
-            scheduler.enter(delay, 1, generateArdInsForArena, (state.arena, aIns, ))
-            if delay > exp.totalTime and exp.repeat:
-                break
-            delay += state.time 
-    if exp.clean:
-        cleanconf = copy.copy(exp.states[-1].arena)
-        cleanconf.color = "none"
-        cleanconf.edge = []
-        cleanconf.block = []
-        cleanconf.led = []
-        scheduler.enter(
-            delay +
-            exp.states[-1].time, 1, generateArdInsForArena, (cleanconf, aIns, )
-        )
-    # Start a thread to run the events
-    t = threading.Thread(target=scheduler.run)
-    t.start()
-    t.join()
-    aIns.close_connection()
+    data = require(experiment, 'experiment', 'request')
+    return cache.get(
+        ('experiment', digest(data)), lambda: Experiment.fromDict(data)
+    )
 
 
-def generateArdInsForArena(arena, aIns):
+def parseAnimation(animation):
     """
-    This function executes the arena configuration and its Edge, Block and lEDs
-    instructions.
-    ----------
-    arena : Object
-        The arena object which contains the color configuration.
+        Parses and validates an animation request, the errors are raised as
+        ValueError before anything is played. An animation already received
+        is taken from the cache.
+        ----------
+        animation : Dict
+            Dictionary containing the animation configuration.
+        Returns
+        -------
+        Animation object.
+    """
+    data = require(animation, 'animation', 'request')
+    return cache.get(
+        ('animation', digest(data)), lambda: Animation.fromDict(data)
+    )
 
-    Returns
-    -------
 
+def parseJob(request):
     """
-    logger.info(
-        "Arena: %d, %d, %d, %s"
-        % (arena.edges, arena.blocks, arena.leds, arena.color)
+        Parses the queueing options of an experiment request.
+        ----------
+        request : Dict
+            Dictionary with the experiment, its optional `priority`, 0 by
+            default, and `preempt`, false by default.
+        Returns
+        -------
+        Tuple (priority, preempt).
+    """
+    return (
+        parseInt(request, 'priority', 'request', None, 0),
+        parseBool(request, 'preempt', 'request', False)
     )
-    #for i in range(0, (arena.blocks * arena.edges)):
-    #    bIns = BlockInstruction()
-    #    bIns.brightness = arena.brightness
-    #    bIns.block = \
-    #        str(i) + "," \
-    #        + str(arena.leds) + "," \
-    #        + Color[arena.color.upper()].value
-    #    logger.info(aIns.send_instrunction(str(bIns.toJSON())))
-    # Edges in arena Individually
-    if hasattr(arena, 'edge'):
-        rangeOrSingleEdge(arena.edge, arena, aIns, True)
-    # Blocks in arena Indvidually
-    if hasattr(arena, 'block'):
-        rangeOrSingleBlock(arena.block, arena, aIns, True)
-    # Leds in arena Indvidually
-    if hasattr(arena, 'led'):
-        rangeOrSingleLed(arena.led, arena, aIns, True)
-
-
-def generateArdInsForEdge(edge, arena, aIns):
-    """
-    This function executes the Edge configration and its Block and lEDs
-    instructions.
-    ----------
-    edge : Object
-        The edge object which contains the color configuration.
 
-    arena : Object
-        The arena object which contains the general configuration.
 
-    aIns : Object
-        The serial connection to send the instructions to Arduino.
+def parseFrame(message):
+    """
+        Parses and validates a raw frame, every LED is given in absolute
+        strip order so nothing is compiled nor cached.
+        ----------
+        message : Dict
+            Dictionary with the frame: the geometry of the arena, its
+            brightness and `rgb`, the base64 of three bytes per LED.
+        Returns
+        -------
+        CompiledState object without arena.
+    """
+    data = require(message, 'frame', 'message')
+    geometry = parseGeometry(data, 'frame', Arena.MAX_LEDS)
+    rgb = require(data, 'rgb', 'frame')
+    if not isinstance(rgb, str):
+        raise ValueError("frame: 'rgb' must be a base64 string")
+    try:
+        pixels = base64.b64decode(rgb, validate=True)
+    except ValueError:
+        raise ValueError("frame: 'rgb' must be a base64 string")
+    frame = Frame.fromRGB(
+        *geometry, parseInt(data, 'brightness', 'frame', 0), pixels
+    )
+    shardFrames(None, frame, controllers)
+    return CompiledState(None, frame)
 
-    Returns
-    -------
 
+def parseStreamed(message):
     """
-    # Converting from negative to equivalent positive
-    edgeIndex = edge.index[0]
-    edgeIndex = \
-        fromNegToPosEq(arena.edges, edgeIndex) \
-        if (edgeIndex < 0) else edgeIndex
-    logger.info("Edge: %s, %d" % (edge.color, edgeIndex))
-    lb = -1 if arena.blocks == 1 else 1 - arena.blocks
-    ub = 0 if arena.blocks == 1 else arena.blocks + (1 - arena.blocks)
-    for i in range(lb, ub):
-        bIns = BlockInstruction()
-        bIns.brightness = arena.brightness
-        ardIdx = str((edgeIndex * arena.blocks + i) - 1) \
-            if arena.blocks > 1 else str(edgeIndex * arena.blocks + i)
-        bIns.block = \
-            ardIdx + "," \
-            + str(arena.leds) + "," \
-            + Color[edge.color.upper()].value
-        aIns.send_instrunction(str(bIns.toJSON()))
-    # If there are some blocks, execute them.
-    if hasattr(edge, 'block'):
-        for jsonBlock in edge.block:
-            space = arena.edges * arena.blocks
-            jsonBlock['index'] = rangeToList(jsonBlock['index'])
-            newBlockRange = []
-            for rBlock in jsonBlock['index']:
-                newBlockRange.append(
-                    fromRelPosToAbsPos(
-                        # -1 means last index
-                        edgeIndex, arena.blocks, rBlock, space
-                    )
-                )
-            jsonBlock['index'] = newBlockRange
-        rangeOrSingleBlock(edge.block, arena, aIns, False)
-    # If there are some leds, execute them.
-    if hasattr(edge, 'led'):
-        for jsonLed in edge.led:
-            ledsPerEdge = arena.blocks * arena.leds
-            space = arena.edges * arena.blocks * arena.leds
-            jsonLed['index'] = rangeToList(jsonLed['index'])
-            newLedRange = []
-            for rled in jsonLed['index']:
-                newLedRange.append(
-                    fromRelPosToAbsPos(edgeIndex, ledsPerEdge, rled, space)
-                )
-            jsonLed['index'] = newLedRange
-        rangeOrSingleLed(edge.led, arena, aIns, False)
+        Parses and compiles a message of the stream, either a state or a
+        raw frame.
+        ----------
+        message : Dict
+            Dictionary with an `arena` or a `frame`, see parseFrame.
+        Returns
+        -------
+        CompiledState object.
+    """
+    if isinstance(message, dict) and 'frame' in message:
+        return parseFrame(message)
+    return compileState(parseState(message))
 
 
-def generateArdInsForBlock(block, arena, aIns):
+def compileState(arena):
     """
-    This function executes the Block configuration and its lEDs instructions.
-    ----------
-    block : Object
-        The block object which contains the color configuration.
+        Compiles the arena of a state, the arenas already compiled are taken
+        from the cache. The state is split between the controllers, an
+        arena they cannot drive is reported as ValueError.
+        ----------
+        arena : Object
+            Arena of the state, see parseState.
+        Returns
+        -------
+        CompiledState object, the payload sent by the serial writer.
+    """
+    with metrics.span('compile'):
+        frame = cache.get(('frame', arena), lambda: compileArena(arena))
+        shardFrames(arena, frame, controllers)
+    return CompiledState(arena, frame)
 
-    arena : Object
-        The arena object which contains the general configuration.
 
-    aIns : Object
-        The serial connection to send the instructions to Arduino.
+def compileAnimation(animation):
+    """
+        Compiles the arena of every keyframe of an animation, an arena the
+        controllers cannot drive is reported as ValueError before anything
+        is played.
+        ----------
+        animation : Object
+            Animation to compile, see parseAnimation.
+        Returns
+        -------
+        Tuple with the frame buffer of each keyframe.
+    """
+    return tuple(
+        compileState(keyframe.arena).frame
+        for keyframe in animation.keyframes
+    )
 
-    Returns
-    -------
 
+def shardFrames(arena, frame, drivers):
     """
-    ledsOutOfRange = []
-    blockIndex = block.index[0]
-    # Converting from negative to equivalent positive
-    blockIndex = \
-        fromNegToPosEq(arena.blocks * arena.edges, blockIndex)\
-        if (blockIndex < 0) else blockIndex
-    #
-    logger.info("Block: %s, %d" % (block.color, blockIndex))
-    bIns = BlockInstruction()
-    bIns.brightness = arena.brightness
-    bIns.block = \
-        str(blockIndex - 1) + "," \
-        + str(arena.leds) + "," \
-        + Color[block.color.upper()].value
-    # If there are some leds, add them to the block instruction.
-    if hasattr(block, 'led'):
-        for jsonLed in block.led:
-            led = Led(json.dumps(jsonLed))
-            led.index = rangeToList(led.index)
-            if len(led.index) > 1:
-                lRange = led.index
-                for index in lRange:
-                    if index != 0:
-                        tmpLed = copy.copy(led)
-                        tmpLed.index = [index]
-                        if not (tmpLed.index[0] < 0 or tmpLed.index[0] > arena.leds):
-                            bIns.led.append(
-                                str(tmpLed.index[0] - 1) + "," +
-                                Color[led.color.upper()].value
-                            )
-                        else:  # This is for the leds out of range
-                            space = arena.edges * arena.blocks * arena.leds
-                            orIndex = fromRelPosToAbsPos(  # outOfRangIndex
-                                blockIndex, arena.leds, tmpLed.index[0], space
-                            )
-                            ledsOutOfRange.append(
-                                {'index': [orIndex], 'color': led.color}
-                            )
-            else:
-                if not (led.index[0] < 0 or led.index[0] > arena.leds):
-                    bIns.led.append(
-                        str(led.index[0] - 1) + "," +
-                        Color[led.color.upper()].value
-                    )
-                else:  # This is for the leds out of range
-                    space = arena.edges * arena.blocks * arena.leds
-                    orIndex = fromRelPosToAbsPos(  # outOfRangIndex
-                        blockIndex, arena.leds, led.index[0], space
-                    )
-                    ledsOutOfRange.append(
-                        {'index': [orIndex], 'color': led.color}
-                    )
-    logger.info(bIns.toJSON())
-    aIns.send_instrunction(str(bIns.toJSON()))
-    rangeOrSingleLed(ledsOutOfRange, arena, aIns, False)
-
-
-def generateArdInsForLed(led, arena, aIns):
-    """
-    This function executes the LEDs configuration.
-    ----------
-    Led : Object
-        The Led object which contains the color configuration.
+        The frame of each controller, the splits already done are taken
+        from the cache.
+        ----------
+        arena : Object
+            Arena of the frame, the key of the cache, None to not cache.
+        frame : Object
+            Frame buffer of the arena.
+        drivers : list
+            Tuples (shard, session) of the controllers.
+        Returns
+        -------
+        Tuple with the frame of each controller.
+    """
+    shards = tuple(shard for shard, aIns in drivers)
+    if arena is None:
+        return split(frame, shards)
+    return cache.get(
+        ('shards', arena, shards), lambda: split(frame, shards)
+    )
 
-    arena : Object
-        The arena object which contains the general configuration.
 
-    aIns : Object
-        The serial connection to send the instructions to Arduino.
+def compileExperiment(exp, drivers=None):
+    """
+        Compiles every arena of an experiment before it starts and predicts
+        its transmission, following the timeline with the deltas sent to
+        each controller. The first state is predicted in full and the
+        controllers transmit in parallel.
+        ----------
+        exp : Object
+            Experiment to compile, see parseExperiment.
+        drivers : list
+            Tuples (shard, session) the experiment is predicted for, the
+            controllers of the configuration by default.
+        Returns
+        -------
+        CompiledExperiment object.
+    """
+    drivers = drivers or controllers
+    frames = {}
+    arenas = [state.arena for state in exp.states]
+    if exp.clean:
+        arenas.append(exp.cleanArena())
+    with metrics.span('compile'):
+        for arena in arenas:
+            frames[arena] = cache.get(
+                ('frame', arena), lambda: compileArena(arena)
+            )
+    parts = {
+        arena: shardFrames(arena, frame, drivers)
+        for arena, frame in frames.items()
+    }
+    costs = {}
+    shown = [[] for driver in drivers]
+    brightness = [None] * len(drivers)
+    totals = [[0, 0] for driver in drivers]
+
+    def walk(sequence, previous, times=1):
+        """ Adds `times` the cost of a sequence of arenas to the totals. """
+        for arena in sequence:
+            # The transitions repeat with the states, each one is packed once
+            if (previous, arena) not in costs:
+                cost = []
+                for i, ((shard, aIns), frame) in enumerate(
+                        zip(drivers, parts[arena])):
+                    limit = aIns.buffer_limit()
+                    if frame.brightness == brightness[i]:
+                        stream = frameToInstructions(
+                            frame.delta(shown[i]), limit
+                        )
+                    else:
+                        stream = cache.get(
+                            ('instructions', (arena, shard), limit),
+                            lambda: frameToInstructions(frame, limit)
+                        )
+                    cost.append((
+                        len(stream),
+                        sum(aIns.encoded_size(b) for b in stream) +
+                        aIns.commit_size(stream)
+                    ))
+                    frame.paint(shown[i])
+                    brightness[i] = frame.brightness
+                costs[(previous, arena)] = tuple(cost)
+            for total, (instructions, nbytes) in zip(
+                    totals, costs[(previous, arena)]):
+                total[0] += instructions * times
+                total[1] += nbytes * times
+            previous = arena
+        return previous
+
+    # Only the first cycles are walked: from the second one on every cycle
+    # has the same transitions, so the same cost, whatever totalTime is
+    full, tail = exp.cycles()
+    cycle = [state.arena for state in exp.states]
+    previous = walk(cycle, None) if full else None
+    if full > 1:
+        previous = walk(cycle, previous, full - 1)
+    previous = walk(cycle[:tail], previous)
+    if exp.clean:
+        walk([exp.cleanArena()], previous)
+    events = exp.events()
+    return CompiledExperiment(
+        uuid.uuid4().hex, exp, frames, events,
+        sum(nbytes for instructions, nbytes in totals),
+        sum(instructions for instructions, nbytes in totals),
+        max(
+            aIns.transmit_time(total[1])
+            for (shard, aIns), total in zip(drivers, totals)
+        ),
+        costs,
+        exp.duration()
+    )
 
-    Returns
-    -------
 
+def preview(request):
     """
-    ledBlockRelPos = None
-    ledIndex = led.index[0]
-    if ledIndex < 0:
-        ledIndex = fromNegToPosEq(
-            arena.edges * arena.blocks * arena.leds, ledIndex
-        )
-    # convert the absolut led position to block relative
-    # In which edge is the led
-    for edgeIndex in range(1, arena.edges + 1):
-        lastLedInEdge = arena.blocks * arena.leds * edgeIndex
-        logger.info(
-            "last led in edge %d, edge index %d" % (lastLedInEdge, edgeIndex)
-        )
-        if ledIndex <= lastLedInEdge:
-            logger.info("led in Edge: %d" % (edgeIndex))
-            # In which block is the led
-            for blockIndex in range(-1, (arena.blocks - 1)):
-                blockAbsPos = arena.blocks * edgeIndex + blockIndex
-                logger.info("Block index: %d" % (blockAbsPos))
-                if ledIndex <= (blockAbsPos * arena.leds):
-                    # In which block position is the led
-                    ledBlockRelPos = ledIndex % arena.leds
-                    if ledBlockRelPos == 0:
-                        ledBlockRelPos = arena.leds
-                        break
-                    break
-            break
-    logger.info("LED: %s, %d" % (led.color, ledIndex))
-    bIns = BlockInstruction()
-    bIns.brightness = arena.brightness
-    ardIdx = str((ledIndex - 1) %
-                 arena.leds) if ledBlockRelPos is None else str(ledBlockRelPos - 1)
-    ardBlIdx = str(blockAbsPos - 1) if arena.blocks > 1 else str(blockAbsPos)
-    bIns.block = \
-        ardBlIdx + "," \
-        + str(arena.leds) + "," \
-        + Color['OMIT'].value
-    bIns.led.append(
-        ardIdx + "," + Color[led.color.upper()].value
+        Compiles a state or an experiment without sending anything and
+        predicts the transmission of each state through the controllers,
+        with the protocol they negotiated. The previews are cached by the
+        digest of the request, only the transmit times are predicted again
+        from the throughput measured on the links.
+        ----------
+        request : Dict
+            Dictionary with an `arena`, as a state, or an `experiment`.
+        Returns
+        -------
+        Dictionary with the distinct `frames` of the request, their
+        geometry, brightness and `rgb`, the base64 of three bytes per LED,
+        and the first PREVIEW_EVENTS `events` in time order, each with its
+        offset, the index of its frame and its predicted instructions,
+        bytes and transmit time. The totals are predicted for the whole
+        request.
+    """
+    protocols = tuple(
+        (aIns.binary, aIns.staged, aIns.buffer_limit())
+        for shard, aIns in controllers
+    )
+    response, events = cache.get(
+        ('preview', digest(request), protocols),
+        lambda: compilePreview(request)
     )
-    logger.info(bIns.toJSON())
-    aIns.send_instrunction(str(bIns.toJSON()))
+    return dict(response, events=[
+        dict(event, transmitTime=leadTime(CompiledState(None, None, nbytes)))
+        for event, nbytes in events
+    ])
 
 
-def fromRelPosToAbsPos(edIdx, bckPerEd, bckIdx, space):  # edgeBlock->Block
+def compilePreview(request):
     """
-    This function transform the relative position of an index using the
-    relative index, the number of blocks per edge, the index block and the space
-    in which this index should be. The function accepts negative indexes.
-    ----------
-    edIdx : Object
-        Index of edge in which the idnex to transform is.
-
-    bckPerEd : Object
-        Number of blocks that form an edge.
+        Compiles the preview of a request, see preview. Only the first
+        PREVIEW_EVENTS events of an experiment are generated.
+        ----------
+        request : Dict
+            Dictionary with an `arena`, as a state, or an `experiment`.
+        Returns
+        -------
+        Tuple (response, events), the events without their transmit time
+        as tuples (event, bytes per controller).
+    """
+    if isinstance(request, dict) and 'experiment' in request:
+        compiled = compileExperiment(parseExperiment(request))
+        frames = {arena: i for i, arena in enumerate(compiled.frames)}
+        events = []
+        previous = None
+        for offset, arena in itertools.islice(
+                compiled.experiment.timeline(), PREVIEW_EVENTS):
+            events.append(previewEvent(
+                offset, frames[arena], compiled.costs[(previous, arena)]
+            ))
+            previous = arena
+        response = compiled.toDict()
+        del response['id']
+    else:
+        state = compileState(parseState(request))
+        frames = {state.arena: 0}
+        cost = stateCost(state)
+        events = [previewEvent(0, 0, cost)]
+        response = {
+            'states': 1,
+            'bytes': sum(nbytes for instructions, nbytes in cost),
+            'instructions': sum(
+                instructions for instructions, nbytes in cost
+            ),
+            'transmitTime': max(
+                aIns.transmit_time(nbytes)
+                for (shard, aIns), (instructions, nbytes) in zip(
+                    controllers, cost)
+            )
+        }
+    response['frames'] = [
+        cache.get(('preview', arena), lambda: previewFrame(arena))
+        for arena in frames
+    ]
+    return response, tuple(events)
+
+
+def previewFrame(arena):
+    """ The compiled frame of an arena with its colors in base64. """
+    frame = cache.get(('frame', arena), lambda: compileArena(arena))
+    return {
+        'edges': frame.edges,
+        'blocks': frame.blocks,
+        'leds': frame.leds,
+        'brightness': frame.brightness,
+        'rgb': base64.b64encode(frame.toRGB()).decode()
+    }
+
+
+def previewEvent(offset, index, cost):
+    """ An event of a preview from the cost of its transition. """
+    nbytes = tuple(b for i, b in cost)
+    return {
+        'offset': offset,
+        'frame': index,
+        'instructions': sum(i for i, b in cost),
+        'bytes': sum(nbytes)
+    }, nbytes
+
+
+def stateCost(state, drivers=None):
+    """
+        Predicts the instructions and bytes sent to each controller to
+        show a state in full.
+        ----------
+        state : Object
+            Compiled state, see compileState.
+        drivers : list
+            Tuples (shard, session), the controllers of the configuration
+            by default.
+        Returns
+        -------
+        Tuple with a tuple (instructions, bytes) per controller.
+    """
+    drivers = drivers or controllers
+    cost = []
+    for (shard, aIns), frame in zip(
+            drivers, shardFrames(state.arena, state.frame, drivers)):
+        limit = aIns.buffer_limit()
+        stream = cache.get(
+            ('instructions', (state.arena, shard), limit),
+            lambda: frameToInstructions(frame, limit)
+        )
+        cost.append((
+            len(stream),
+            sum(aIns.encoded_size(b) for b in stream) +
+            aIns.commit_size(stream)
+        ))
+    return tuple(cost)
 
-    bckIdx : Object
-        Index to transform.
 
-    space : Object
-        The space within the index should be.
+def leadTime(state, drivers=None):
+    """
+        Predicts the seconds between handing a state to the writer and the
+        state being visible, from the throughput measured on each link. The
+        slowest controller sets the lead time.
+        ----------
+        state : Object
+            CompiledState with its predicted bytes.
+        drivers : list
+            Tuples (shard, session) the state is sent through, the
+            controllers of the configuration by default.
+        Returns
+        -------
+        The lead time in seconds, 0 if the bytes are not known.
+    """
+    if not state.bytes:
+        return 0.0
+    return max(
+        aIns.stats.sendTime(nbytes, aIns.transmit_time(1)) if nbytes else 0.0
+        for (shard, aIns), nbytes in zip(drivers or controllers, state.bytes)
+    )
 
-    Returns
-    -------
 
+def postState(state):
     """
-    if bckPerEd == 1:
-        return bckIdx
-    elif bckIdx < 0:
-        return (((edIdx * bckPerEd) - ((bckPerEd - bckIdx))) % space) + 1
-    else:
-        newIndex = ((edIdx * bckPerEd) - ((bckPerEd - bckIdx))) % space
-        return newIndex if (newIndex > 0) else space
+        Cancels the experiments queued or running and the animation and
+        posts a state to the serial writer, a state still waiting there is
+        replaced by this one.
+        ----------
+        state : Object
+            Compiled state, see compileState.
+        Returns
+        -------
+        Future resolved with True once the state is applied, False if it is
+        replaced or dropped.
+    """
+    jobs.clear()
+    animator.cancel()
+    return writer.post(state)
 
 
-def fromNegToPosEq(space, number):
+def postFrame(frame):
     """
-    This function transform a negative number to its positive equivalent.
-    ----------
-    numnber : Object
-        The negative number to transform.
+        Posts a frame rendered by the animator to the serial writer.
+        ----------
+        frame : Object
+            Frame buffer of the arena, sent without cache.
+        Returns
+        -------
+        Future resolved with True once the frame is applied.
+    """
+    return writer.post(CompiledState(None, frame))
 
-    space : Object
-        The space within the index should be.
-
-    Returns
-    -------
 
+async def runState(state):
     """
-    if space == 1:
-        return abs(number)
-    else:
-        return (number % space) + 1
+        runState service controller.
+        ----------
+        state : Object
+            Compiled state, see compileState.
+        Returns
+        -------
+    """
+    await postState(state)
 
 
-def rangeOrSingleEdge(edges, arena, aIns, fromArena):
+def runExperiment(compiled, priority=0, preempt=False):
     """
-    This function execute a range of Edges or a single Edge.
-    ----------
-    edges : Object
-        An array of edges which lenght can be 0, 1 or more.
+        runExperiment service controller, the experiment is queued and the
+        scheduler only pushes the frames compiled before the start, each one
+        ahead of its boundary by its lead time.
+        ----------
+        compiled : Object
+            Experiment to run, see compileExperiment.
+        priority : int
+            The experiments with a higher priority run first.
+        preempt : bool
+            Cancels the running experiment if its priority is lower.
+        Returns
+        -------
+        The Job queued.
+    """
+    animator.cancel()
+    return jobs.submit(compiled, priority, preempt)
 
-    arena : Object
-        The arena object which contains the general configuration.
 
-    aIns : Object
-        The serial connection to send the instructions to Arduino.
+async def runAnimation(animation, frames):
+    """
+        runAnimation service controller, the experiments queued or running
+        are canceled and the animator renders the frames from the keyframes
+        as fast as the link applies them, up to the frame rate of the
+        animation.
+        ----------
+        animation : Object
+            Animation to play, see parseAnimation.
+        frames : tuple
+            Frame of each keyframe, see compileAnimation.
+        Returns
+        -------
+    """
+    jobs.clear()
+    try:
+        await animator.start(animation, frames, postFrame)
+    except asyncio.CancelledError:
+        logger.info("Animation canceled")
 
-    fromArena : Boolean
-        Specify if the range or single edge comes from the arena enviroment.
+
+def sendState(state):
+    """
+    This function sends a compiled state through the shared sessions,
+    holding each session for the whole state so states are not interleaved.
+    ----------
+    state : Object
+        The arena and its compiled frame, see compileState.
 
     Returns
     -------
+    True if every controller acknowledged the state, False otherwise.
 
     """
-    for jsonEdge in edges:
-        edge = Edge(json.dumps(jsonEdge))
-        if len(edge.index) > 1:
-            eRange = rangeToList(edge.index) \
-                if(fromArena)else edge.index
-            # to-do change to reverse order reversed()
-            for index in reversed(eRange):
-                orIndex = index
-                index = fromRelPosToAbsPos(
-                    index, arena.edges, index, arena.edges
-                )
-                if index != 0:
-                    tmpEdge = copy.copy(edge)
-                    tmpEdge.index = [index]
-                    # to-do change from last to first
-                    if not(orIndex == eRange[0]):
-                        tmpEdge.block = []
-                        tmpEdge.led = []
-                        generateArdInsForEdge(tmpEdge, arena, aIns)
-                    else:
-                        generateArdInsForEdge(tmpEdge, arena, aIns)
-
-        else:
-            generateArdInsForEdge(edge, arena, aIns)
+    applied = sendShards(state, controllers)
+    if not applied:
+        logger.error("State not acknowledged by every controller")
+    # The summary sorts the latencies of every controller, only when logged
+    if logger.isEnabledFor(logging.INFO):
+        logger.info("Transport: %s", transportStats())
+    return applied
 
 
-def rangeOrSingleBlock(blocks, arena, aIns, fromArena):
+def sendShards(state, drivers):
     """
-    This function execute a range of Blocks or a single one.
+    This function sends the part of a compiled state of each controller,
+    the controllers are sent their part in parallel.
     ----------
-    blocks : Object
-        An array of blocks which lenght can be 0, 1 or more.
-
-    arena : Object
-        The arena object which contains the general configuration.
-
-    aIns : Object
-        The serial connection to send the instructions to Arduino.
+    state : Object
+        The arena and its compiled frame, see compileState.
 
-    fromArena : Boolean
-        Specify if the range or single edge comes from the arena enviroment.
+    drivers : list
+        Tuples (shard, session) of the controllers.
 
     Returns
     -------
+    True if every controller acknowledged all of its instructions.
 
     """
-    for jsonBlock in blocks:
-        block = Block(json.dumps(jsonBlock))
-        if len(block.index) > 1:
-            bRange = rangeToList(block.index) if (fromArena) else block.index
-            # to-do change to reverse order reversed()
-            for index in reversed(bRange):
-                if index != 0:
-                    tmpBlock = copy.copy(block)
-                    tmpBlock.index = [index]
-                    # to-do change from last to first
-                    if not(index == bRange[0]):
-                        tmpBlock.led = []
-                        generateArdInsForBlock(tmpBlock, arena, aIns)
-                    else:
-                        generateArdInsForBlock(tmpBlock, arena, aIns)
-        else:
-            generateArdInsForBlock(block, arena, aIns)
-
-
-def rangeOrSingleLed(leds, arena, aIns, fromArena):
+    def send(driver, frame):
+        shard, aIns = driver
+        with aIns.lock:
+            # A port opened by this state is not a reset in the middle of it
+            aIns.ensure_connection()
+            failures = aIns.failures()
+            connections = aIns.connections
+            key = None if state.arena is None else (state.arena, shard)
+            sendFrame(frame, aIns, key)
+            return aIns.failures() == failures \
+                and aIns.connections == connections
+
+    parts = shardFrames(state.arena, state.frame, drivers)
+    futures = [
+        pool.submit(send, driver, frame)
+        for driver, frame in zip(drivers[1:], parts[1:])
+    ]
+    applied = send(drivers[0], parts[0])
+    return all([applied] + [future.result() for future in futures])
+
+
+def sendFrame(frame, aIns, key=None):
     """
-    This function execute a range of Leds instructions or a single one.
+    This function sends a compiled frame, only the LEDs that differ from
+    what the strip already shows are sent. The bytes and instructions of
+    the state are recorded in the metrics and the time taken to send them
+    is fed to the throughput measured on the link, unless the port was
+    opened again meanwhile. When the firmware can stage the instructions a
+    state of several messages is committed with a single show, the time
+    until the whole state is visible is recorded either way.
     ----------
-    Leds : Object
-        An array of leds which lenght can be 0, 1 or more.
-
-    arena : Object
-        The arena object which contains the general configuration.
+    frame : Object
+        The frame buffer to send.
 
     aIns : Object
         The serial connection to send the instructions to Arduino.
 
-    fromArena : Boolean
-        Specify if the range or single edge comes from the arena enviroment.
+    key : Object
+        Cache key of the frame, the instructions of the whole frame are
+        cached under it. None to not cache them.
 
     Returns
     -------
+    Number of instructions sent.
 
     """
-    for jsonLed in leds:
-        led = Led(json.dumps(jsonLed))
-        if len(led.index) > 1:
-            lRange = rangeToList(led.index)\
-                if (fromArena) else led.index
-            for index in lRange:
-                if index != 0:
-                    tmpLed = copy.copy(led)
-                    tmpLed.index = [index]
-                    generateArdInsForLed(tmpLed, arena, aIns)
+    with aIns.lock, metrics.span('send'):
+        aIns.ensure_connection()
+        # Opening the port is not part of the time taken by the state
+        start = perf_counter()
+        limit = aIns.buffer_limit()
+        with metrics.span('pack'):
+            if frame.brightness == aIns.shown_brightness:
+                instructions = frameToInstructions(
+                    frame.delta(aIns.shown), limit
+                )
+            elif key is None:
+                instructions = frameToInstructions(frame, limit)
+            else:
+                instructions = cache.get(
+                    ('instructions', key, limit),
+                    lambda: frameToInstructions(frame, limit)
+                )
+        logger.info(
+            "Sending %d of %d blocks" % (len(instructions), frame.blockCount())
+        )
+        failures = aIns.failures()
+        connections = aIns.connections
+        sentBefore = aIns.stats.bytes
+        staged = aIns.needs_commit(instructions)
+        for bIns in instructions:
+            aIns.send_block(bIns, staged)
+        if staged:
+            aIns.show(frame.brightness)
+        aIns.flush()
+        consistent = perf_counter() - start
+        sent = aIns.stats.bytes - sentBefore
+        if sent:
+            if aIns.connections == connections:
+                aIns.stats.onState(sent, consistent)
+            commit = 'staged' if staged else 'progressive'
+            logger.info(
+                "State consistent after %.1f ms, %s" % (
+                    consistent * 1000, commit
+                )
+            )
+            metrics.observe(
+                'moca_state_consistent_seconds', consistent, commit=commit
+            )
+        metrics.observe('moca_state_bytes', sent)
+        metrics.observe('moca_state_instructions', len(instructions))
+        # A rejected instruction or a reset in between leaves it unknown
+        if aIns.failures() == failures \
+                and aIns.connections == connections:
+            frame.paint(aIns.shown)
+            aIns.shown_brightness = frame.brightness
         else:
-            generateArdInsForLed(led, arena, aIns)
+            aIns.forget_shown()
+    return len(instructions)
 
 
-def rangeToList(rng):
+def transportStats():
     """
-    This function transform a python range to a list of values.
-    ----------
-    range : Object
-        A python range.
+        Counters of the serial session of each controller by port: latency,
+        window occupancy and errors.
+    """
+    return {shard.port: aIns.stats.toDict() for shard, aIns in controllers}
 
-    Returns
-    -------
-    List which contains the respective range values.
-
-    """
-    list = []
-    if len(rng) == 3:
-        list = range(rng[0], rng[1] - 1, rng[2]) \
-            if (rng[0] > rng[1]) else range(rng[0], rng[1] + 1, rng[2])
-        return list
-    elif len(rng) == 2:
-        list = range(rng[0], rng[1] - 1)\
-            if (rng[0] > rng[1]) else range(rng[0], rng[1] + 1)
-        return list
-    elif len(rng) == 1:
-        return rng
+
+def transportMetrics():
+    """
+        The counters of the serial sessions, summed over the controllers,
+        and the window occupancy and latency quantiles of each port for the
+        metrics endpoint.
+    """
+    def total(counter):
+        return sum(getattr(aIns.stats, counter) for shard, aIns in controllers)
+
+    perPort = [
+        ('moca_serial_window', 'gauge',
+         'Maximum number of instructions in flight.', aIns.stats.window,
+         {'port': shard.port})
+        for shard, aIns in controllers
+    ] + [
+        ('moca_serial_window_occupancy_total', 'counter',
+         'Instructions written, labeled by the instructions in flight once '
+         'written.', count, {'port': shard.port, 'inflight': inflight})
+        for shard, aIns in controllers
+        for inflight, count in enumerate(aIns.stats.occupancy)
+    ] + [
+        ('moca_serial_latency_seconds', 'gauge',
+         'Quantiles of the time between writing an instruction and its '
+         'answer, over the last answers.', latency,
+         {'port': shard.port, 'quantile': quantile})
+        for shard, aIns in controllers
+        for quantile, latency in sorted(aIns.stats.quantiles().items())
+    ]
+    return perPort + [
+        ('moca_serial_sent_total', 'counter',
+         'Messages written to the Arduinos.', total('sent')),
+        ('moca_serial_acked_total', 'counter',
+         'Messages acknowledged by the Arduinos.', total('acked')),
+        ('moca_serial_errors_total', 'counter',
+         'Messages rejected by the Arduinos.', total('errors')),
+        ('moca_serial_timeouts_total', 'counter',
+         'Messages never answered by the Arduinos.', total('timeouts')),
+        ('moca_serial_bytes_total', 'counter',
+         'Bytes written to the Arduinos.', total('bytes')),
+        ('moca_serial_blocks_total', 'counter',
+         'Block instructions written to the Arduinos.', total('blocks')),
+        ('moca_serial_leds_total', 'counter',
+         'LEDs listed in the block instructions, per block instruction it '
+         'is the packing ratio.', total('leds')),
+        ('moca_serial_shows_total', 'counter',
+         'Messages that show a LED strip when executed.', total('shows')),
+        ('moca_serial_connections_total', 'counter',
+         'Times a serial port was opened.',
+         sum(aIns.connections for shard, aIns in controllers))
+    ]
+
+
+def cacheMetrics():
+    """
+        The counters of the compile cache for the metrics endpoint.
+    """
+    stats = cache.toDict()
+    return [
+        ('moca_cache_hits_total', 'counter',
+         'Parsed or compiled values found in the cache.', stats['hits']),
+        ('moca_cache_misses_total', 'counter',
+         'Parsed or compiled values built and cached.', stats['misses']),
+        ('moca_cache_evictions_total', 'counter',
+         'Least recently used values removed from the cache.',
+         stats['evictions']),
+        ('moca_cache_entries', 'gauge',
+         'Values in the cache.', stats['entries'])
+    ]
+
+
+writer = SerialWriter(sendState)
+jobs = JobQueue(scheduler, writer.post, leadTime)
+metrics.register(transportMetrics)
+metrics.register(cacheMetrics)
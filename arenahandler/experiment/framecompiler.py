@@ -0,0 +1,353 @@
+"""
+This module compiles the arenas into frame buffers. The edge, block and LED
+rules of an arena are resolved, in the order they are written, into one RGB
+value per LED of the strip so overlapping rules cost nothing on the serial
+link. The frame buffer is then turned into the block instructions understood
+by the Arduino: the covered blocks are filled and the remaining LEDs are packed
+into as few instructions as fit in the JSON buffer of the firmware.
+"""
+from collections import Counter
+
+from .component.BlockInstruction import BlockInstruction
+from .component.Color import Color
+from .component.Frame import Frame
+from .indexresolver import absolute, bounds, count, first, fromNegToPosEq, \
+    fromRelPosToAbsPos, relative, spans, within
+import experiment.utils.logger as my_logger
+
+logger = my_logger.get_logger('framecompiler')
+
+
+def compileArena(arena):
+    """
+    This function renders the arena configuration into a frame buffer.
+    ----------
+    arena : Object
+        The arena object which contains the color configuration.
+
+    Returns
+    -------
+    Frame which contains the color of every LED of the arena.
+
+    """
+    frame = Frame(arena.edges, arena.blocks, arena.leds, arena.brightness)
+    renderArena(arena, frame)
+    return frame
+
+
+def frameToInstructions(frame, limit=BlockInstruction.JSON_BUFFER_SIZE):
+    """
+    This function turns a frame buffer into block instructions. A block
+    completely covered by the frame is filled with its most common color and
+    lists the LEDs that differ while they fit. Every other LED is packed,
+    in strip order, into instructions that omit the block color: the
+    firmware adds the LED index to the start of the block so one instruction
+    can reach the LEDs of the following blocks. Untouched blocks are not
+    sent.
+    ----------
+    frame : Object
+        The frame buffer to emit.
+
+    limit : int
+        Bytes of the firmware JSON buffer an instruction may use, None when
+        the instructions are not sent as JSON.
+
+    Returns
+    -------
+    List of BlockInstruction, the fills first and then the packed LEDs.
+
+    """
+    instructions = []
+    loose = []
+    for blockIndex in range(frame.blockCount()):
+        pixels = frame.block(blockIndex)
+        present = [p for p in pixels if p is not None]
+        if len(present) < len(pixels):
+            loose.extend(
+                (blockIndex * frame.leds + i, pixel)
+                for i, pixel in enumerate(pixels) if pixel is not None
+            )
+            continue
+        fill = Counter(present).most_common(1)[0][0]
+        bIns = blockInstruction(frame, blockIndex, colorString(fill))
+        size = bIns.bufferSize()
+        for i, pixel in enumerate(pixels):
+            if pixel == fill:
+                continue
+            led = str(i) + "," + colorString(pixel)
+            if limit is None or size + ledBufferSize(led) <= limit:
+                bIns.led.append(led)
+                size += ledBufferSize(led)
+            else:
+                loose.append((blockIndex * frame.leds + i, pixel))
+        instructions.append(bIns)
+    bIns = None
+    for index, pixel in loose:
+        if bIns is not None:
+            led = str(index - start) + "," + colorString(pixel)
+            if limit is None or size + ledBufferSize(led) <= limit:
+                bIns.led.append(led)
+                size += ledBufferSize(led)
+                continue
+        blockIndex = index // frame.leds
+        start = blockIndex * frame.leds
+        bIns = blockInstruction(frame, blockIndex, Color['OMIT'].value)
+        bIns.led.append(str(index - start) + "," + colorString(pixel))
+        size = bIns.bufferSize()
+        instructions.append(bIns)
+    return instructions
+
+
+def blockInstruction(frame, blockIndex, color):
+    """
+    This function creates the instruction of a block of the frame.
+    ----------
+    frame : Object
+        The frame buffer the block belongs to.
+
+    blockIndex : int
+        Zero based index of the block.
+
+    color : String
+        The firmware representation of the block color.
+
+    Returns
+    -------
+    BlockInstruction without LEDs.
+
+    """
+    bIns = BlockInstruction()
+    bIns.brightness = frame.brightness
+    bIns.block = str(blockIndex) + "," + str(frame.leds) + "," + color
+    return bIns
+
+
+def ledBufferSize(led):
+    """
+    This function gives the bytes of the firmware JSON buffer used by one
+    more LED of an instruction.
+    ----------
+    led : String
+        The firmware representation of the LED.
+
+    Returns
+    -------
+    Number of bytes.
+
+    """
+    return BlockInstruction.ARRAY_NODE_SIZE + \
+        BlockInstruction.jsonBufferSize(led)
+
+
+def colorString(rgb):
+    """
+    This function gives the firmware representation of a color.
+    ----------
+    rgb : Tuple
+        The red, green and blue values.
+
+    Returns
+    -------
+    String with the comma separated values.
+
+    """
+    return "%d,%d,%d" % rgb
+
+
+def renderArena(arena, frame):
+    """
+    This function renders the arena configuration and its Edge, Block and
+    LEDs configurations.
+    ----------
+    arena : Object
+        The arena object which contains the color configuration.
+
+    frame : Object
+        The frame buffer where the arena is rendered.
+
+    Returns
+    -------
+
+    """
+    logger.info(
+        "Arena: %d, %d, %d, %s"
+        % (arena.edges, arena.blocks, arena.leds, arena.color)
+    )
+    frame.fill(range(len(frame.pixels)), arena.color)
+    # Edges in arena Individually
+    for edge in arena.edge:
+        renderEdge(edge, arena, frame)
+    # Blocks in arena Indvidually
+    for block in arena.block:
+        renderBlock(block, [block.index], block.ranged, arena, frame)
+    # Leds in arena Indvidually
+    for led in arena.led:
+        renderLed([led.index], led.color, arena, frame)
+
+
+def renderEdge(edge, arena, frame):
+    """
+    This function renders a range of Edges or a single Edge and the Block
+    and LEDs configurations of the first one.
+    ----------
+    edge : Object
+        The edge object which contains the color configuration.
+
+    arena : Object
+        The arena object which contains the general configuration.
+
+    frame : Object
+        The frame buffer where the edges are rendered.
+
+    Returns
+    -------
+
+    """
+    if not edge.index:
+        return
+    my_logger.trace(logger, "Edge: %s, %s", edge.color, edge.index)
+    if edge.ranged:
+        # Every index of a range wraps around the edges
+        edges = relative(edge.index, arena.edges, 1, arena.edges)
+        anchor = fromRelPosToAbsPos(
+            1, arena.edges, edge.index[0], arena.edges
+        )
+        children = anchor != 0
+    else:
+        anchor = edge.index[0]
+        edges = [range(anchor, anchor + 1)]
+        children = True
+    # Converting from negative to equivalent positive
+    edges = [e for index in edges for e in absolute(index, arena.edges)]
+    anchor = fromNegToPosEq(arena.edges, anchor) if anchor < 0 else anchor
+    for positions in spans(edges, arena.blocks * arena.leds):
+        frame.fill(positions, edge.color)
+    if not children:
+        return
+    # The blocks and the LEDs inside the edge are relative to it.
+    space = arena.edges * arena.blocks
+    for block in edge.block:
+        index = relative(block.index, arena.blocks, anchor, space)
+        renderBlock(block, index, count(index) > 1, arena, frame)
+    space = arena.edges * arena.blocks * arena.leds
+    for led in edge.led:
+        index = relative(led.index, arena.blocks * arena.leds, anchor, space)
+        renderLed(index, led.color, arena, frame)
+
+
+def renderBlock(block, index, ranged, arena, frame):
+    """
+    This function renders a range of Blocks or a single one and the LEDs
+    configuration of the first one.
+    ----------
+    block : Object
+        The block object which contains the color configuration.
+
+    index : list
+        Ranges of the indexes of the blocks.
+
+    ranged : Boolean
+        Specify if the index is a range.
+
+    arena : Object
+        The arena object which contains the general configuration.
+
+    frame : Object
+        The frame buffer where the blocks are rendered.
+
+    Returns
+    -------
+
+    """
+    anchor = first(index)
+    if anchor is None:
+        return
+    my_logger.trace(logger, "Block: %s, %s", block.color, index)
+    if not ranged:
+        index = [range(anchor, anchor + 1)]
+    # Converting from negative to equivalent positive
+    space = arena.edges * arena.blocks
+    blocks = [b for bIndex in index for b in absolute(bIndex, space)]
+    for positions in spans(blocks, arena.leds):
+        frame.fill(positions, block.color)
+    if ranged and anchor == 0:
+        return
+    anchor = fromNegToPosEq(space, anchor) if anchor < 0 else anchor
+    renderBlockLeds(block, anchor, arena, frame)
+
+
+def renderBlockLeds(block, blockIndex, arena, frame):
+    """
+    This function renders the LEDs of a Block, the LEDs out of the block are
+    rendered after the ones inside it.
+    ----------
+    block : Object
+        The block object which contains the LEDs configuration.
+
+    blockIndex : int
+        The index of the block.
+
+    arena : Object
+        The arena object which contains the general configuration.
+
+    frame : Object
+        The frame buffer where the LEDs are rendered.
+
+    Returns
+    -------
+
+    """
+    ledsOutOfRange = []
+    start = (blockIndex - 1) * arena.leds - 1
+    space = arena.edges * arena.blocks * arena.leds
+    for led in block.led:
+        if not led.index:
+            continue
+        low, high = bounds(led.index)
+        # The index 0 is only taken when it is alone
+        inside = within(led.index, 0 if len(led.index) == 1 else 1,
+                        arena.leds + 1)
+        frame.fill(
+            range(start + inside.start, start + inside.stop, inside.step),
+            led.color
+        )
+        # This is for the leds out of range
+        outside = [within(led.index, low, 0),
+                   within(led.index, arena.leds + 1, high + 1)]
+        orIndex = [
+            r for index in outside
+            for r in relative(index, arena.leds, blockIndex, space)
+        ]
+        ledsOutOfRange.append((orIndex, led.color))
+    for orIndex, color in ledsOutOfRange:
+        renderLed(orIndex, color, arena, frame)
+
+
+def renderLed(index, color, arena, frame):
+    """
+    This function renders LEDs from their absolute index, the first LED of
+    the strip is 1.
+    ----------
+    index : list
+        Ranges of the absolute indexes of the LEDs.
+
+    color : Tuple
+        The color of the LEDs, None if omitted.
+
+    arena : Object
+        The arena object which contains the general configuration.
+
+    frame : Object
+        The frame buffer where the LEDs are rendered.
+
+    Returns
+    -------
+
+    """
+    my_logger.trace(logger, "LED: %s, %s", color, index)
+    space = arena.edges * arena.blocks * arena.leds
+    for lIndex in index:
+        for lRange in absolute(lIndex, space):
+            frame.fill(
+                range(lRange.start - 1, lRange.stop - 1, lRange.step), color
+            )
@@ -0,0 +1,228 @@
+"""
+This module resolves the indexes of the edges, blocks and LEDs into absolute
+positions. An index is a python range and the result is a list of ranges:
+the negative and relative indexes wrap around modulo the size of the arena,
+so each period of the index is shifted as a whole with a few integer
+operations instead of one function call per element. The scalar functions
+are kept as the reference of the range versions.
+"""
+
+
+def within(index, low, high):
+    """
+    This function returns the part of a range between two bounds.
+    ----------
+    index : range
+        The range to cut.
+
+    low : int
+        The lower bound, included.
+
+    high : int
+        The upper bound, excluded.
+
+    Returns
+    -------
+    Ascending range with the values of index between low and high.
+
+    """
+    if index.step < 0:
+        index = index[::-1]
+    start = index.start
+    if start < low:
+        start -= ((start - low) // index.step) * index.step
+    return range(start, min(index.stop, high), index.step)
+
+
+def bounds(index):
+    """ The lowest and the highest values of a non empty range. """
+    return min(index[0], index[-1]), max(index[0], index[-1])
+
+
+def periodic(index, shift, space):
+    """
+    This function computes ((i + shift) % space) + 1 for every i of a range.
+    ----------
+    index : range
+        The values to transform.
+
+    shift : int
+        The value added before the modulo.
+
+    space : int
+        The modulo.
+
+    Returns
+    -------
+    List of ranges, one per period of space covered by the index.
+
+    """
+    ranges = []
+    if not index:
+        return ranges
+    low, high = bounds(index)
+    first = low + shift - (low + shift) % space
+    for period in range(first, high + shift + 1, space):
+        part = within(index, period - shift, period - shift + space)
+        offset = shift - period + 1
+        if part:
+            ranges.append(range(
+                part.start + offset, part.stop + offset, part.step
+            ))
+    return ranges
+
+
+def absolute(index, space):
+    """
+    This function is the range version of fromNegToPosEq: the negative
+    values are counted from the end of the space, the others are kept.
+    ----------
+    index : range
+        The indexes to transform.
+
+    space : int
+        The space within the index should be.
+
+    Returns
+    -------
+    List of ranges with the positive equivalents.
+
+    """
+    if not index:
+        return []
+    low, high = bounds(index)
+    negative = within(index, low, 0)
+    if space == 1:
+        ranges = [range(-negative.start, -negative.stop, -negative.step)]
+    else:
+        ranges = periodic(negative, 0, space)
+    ranges.append(within(index, 0, high + 1))
+    return [r for r in ranges if r]
+
+
+def relative(index, unit, anchor, space):
+    """
+    This function is the range version of fromRelPosToAbsPos: the indexes
+    relative to the anchor are turned into absolute indexes.
+    ----------
+    index : range
+        The indexes relative to the anchor.
+
+    unit : int
+        Number of indexes inside the anchor.
+
+    anchor : int
+        Index of the anchor, an edge or a block.
+
+    space : int
+        The space within the index should be.
+
+    Returns
+    -------
+    List of ranges with the absolute indexes.
+
+    """
+    if unit == 1:
+        return [index] if index else []
+    if not index:
+        return []
+    low, high = bounds(index)
+    base = anchor * unit - unit
+    return periodic(within(index, low, 0), base, space) + \
+        periodic(within(index, 0, high + 1), base - 1, space)
+
+
+def spans(units, size):
+    """
+    This function turns ranges of edges or blocks, counted from 1, into the
+    ranges of the LEDs inside them.
+    ----------
+    units : list
+        Ranges of the edges or the blocks.
+
+    size : int
+        Number of LEDs of an edge or a block.
+
+    Returns
+    -------
+    List of ranges of the zero based absolute LED positions.
+
+    """
+    ranges = []
+    for index in units:
+        if not index:
+            continue
+        low, high = bounds(index)
+        index = within(index, low, high + 1)
+        if index.step == 1:
+            ranges.append(range((index.start - 1) * size,
+                                (index.stop - 1) * size))
+        else:
+            ranges.extend(
+                range((unit - 1) * size, unit * size) for unit in index
+            )
+    return ranges
+
+
+def count(ranges):
+    """ Number of values of a list of ranges. """
+    return sum(len(index) for index in ranges)
+
+
+def first(ranges):
+    """ The first value of a list of ranges, None if it is empty. """
+    for index in ranges:
+        if index:
+            return index[0]
+    return None
+
+
+def fromRelPosToAbsPos(edIdx, bckPerEd, bckIdx, space):  # edgeBlock->Block
+    """
+    This function transform the relative position of an index using the
+    relative index, the number of blocks per edge, the index block and the space
+    in which this index should be. The function accepts negative indexes.
+    ----------
+    edIdx : Object
+        Index of edge in which the idnex to transform is.
+
+    bckPerEd : Object
+        Number of blocks that form an edge.
+
+    bckIdx : Object
+        Index to transform.
+
+    space : Object
+        The space within the index should be.
+
+    Returns
+    -------
+
+    """
+    if bckPerEd == 1:
+        return bckIdx
+    elif bckIdx < 0:
+        return (((edIdx * bckPerEd) - ((bckPerEd - bckIdx))) % space) + 1
+    else:
+        newIndex = ((edIdx * bckPerEd) - ((bckPerEd - bckIdx))) % space
+        return newIndex if (newIndex > 0) else space
+
+
+def fromNegToPosEq(space, number):
+    """
+    This function transform a negative number to its positive equivalent.
+    ----------
+    numnber : Object
+        The negative number to transform.
+
+    space : Object
+        The space within the index should be.
+
+    Returns
+    -------
+
+    """
+    if space == 1:
+        return abs(number)
+    else:
+        return (number % space) + 1
@@ -0,0 +1,227 @@
+"""
+This module runs the experiments one after the other instead of canceling
+the running one. The experiments are compiled when they are submitted, so
+the next one is ready when the running one ends: the scheduler is given the
+moment it ends and hands the first state of the next one over ahead of it by
+its lead time, the experiments follow each other without a gap. The queue is
+ordered by priority, then by submission, and a job submitted with `preempt`
+and a higher priority than the running one cancels it, the job preempted is
+discarded and not queued again.
+"""
+import asyncio
+import heapq
+from collections import deque
+from itertools import count
+
+import experiment.utils.logger as my_logger
+
+logger = my_logger.get_logger('jobqueue')
+
+
+class Job(object):
+    """
+    An experiment submitted to the queue. `status` is one of STATUSES and
+    `start` the loop time of its first boundary once it started and
+    `preempted` the id of the job it preempted, if any.
+    """
+    STATUSES = ('queued', 'running', 'done', 'canceled', 'preempted')
+
+    def __init__(self, compiled, priority, preempt, seq):
+        """
+        Returns
+        -------
+        new Job Object
+        """
+        self.compiled = compiled
+        self.priority = priority
+        self.preempt = preempt
+        self.seq = seq
+        self.status = 'queued'
+        self.start = None
+        self.preempted = None
+
+    def toDict(self, start, now):
+        """
+        Summary of the job, `startsIn` is the seconds until its first
+        boundary, negative once it started and None if it never did.
+        """
+        return dict(
+            self.compiled.toDict(),
+            priority=self.priority,
+            preempt=self.preempt,
+            status=self.status,
+            startsIn=None if start is None else start - now,
+            preempted=self.preempted
+        )
+
+
+class JobQueue(object):
+    """
+    Runs the experiments submitted through a scheduler one at a time. The
+    jobs queued, the running one and the last HISTORY finished are kept by
+    id so they can be inspected.
+    """
+    HISTORY = 64
+
+    def __init__(self, scheduler, action, lead=None):
+        """
+        ----------
+        scheduler : Object
+            The Scheduler running the timeline of each experiment.
+        action : function
+            Called with each state, see Scheduler.start.
+        lead : function
+            Lead time of each state, see Scheduler.start.
+        Returns
+        -------
+        new JobQueue Object
+        """
+        self.scheduler = scheduler
+        self.action = action
+        self.lead = lead
+        self.task = None
+        self.running = None
+        # Loop time the last experiment handed over ends
+        self.end = None
+        self.jobs = {}
+        self.pending = []
+        self.finished = deque()
+        self.seq = count()
+
+    def submit(self, compiled, priority=0, preempt=False):
+        """
+        Queues a compiled experiment.
+        ----------
+        compiled : Object
+            The CompiledExperiment to run.
+        priority : int
+            The jobs with a higher priority run first.
+        preempt : bool
+            Cancels the running job if its priority is lower.
+        Returns
+        -------
+        The Job queued.
+        """
+        job = Job(compiled, priority, preempt, next(self.seq))
+        self.jobs[compiled.id] = job
+        heapq.heappush(self.pending, (-priority, job.seq, job))
+        running = self.running
+        if preempt and running is not None and priority > running.priority:
+            logger.info(
+                "Job %s preempted by %s" % (running.compiled.id,
+                                            compiled.id)
+            )
+            job.preempted = running.compiled.id
+            self._stop(running, 'preempted')
+        if self.task is None or self.task.done():
+            self.task = asyncio.ensure_future(self._run())
+        return job
+
+    def cancel(self, ident):
+        """
+        Cancels a job queued or running, the next one starts at once.
+        ----------
+        ident : string
+            Id of the experiment.
+        Returns
+        -------
+        The Job canceled, a job unknown or finished is reported as
+        ValueError.
+        """
+        job = self.jobs.get(ident)
+        if job is None or job.status not in ('queued', 'running'):
+            raise ValueError("No job %s queued or running" % (ident))
+        if job is self.running:
+            self._stop(job, 'canceled')
+        else:
+            self.pending.remove((-job.priority, job.seq, job))
+            heapq.heapify(self.pending)
+            job.status = 'canceled'
+            self._finish(job)
+        return job
+
+    def clear(self):
+        """ Cancels every job queued or running. """
+        for priority, seq, job in self.pending:
+            job.status = 'canceled'
+            self._finish(job)
+        self.pending = []
+        if self.running is not None:
+            self._stop(self.running, 'canceled')
+
+    def inspect(self, ident):
+        """ Summary of a job, a job unknown is reported as ValueError. """
+        job = self.jobs.get(ident)
+        if job is None:
+            raise ValueError("No job %s" % (ident))
+        for queued, start in self.schedule():
+            if queued is job:
+                return job.toDict(start, self._now())
+        return job.toDict(job.start, self._now())
+
+    def summary(self):
+        """ Summary of the running job and of the queued ones in order. """
+        now = self._now()
+        return [job.toDict(start, now) for job, start in self.schedule()]
+
+    def schedule(self):
+        """
+        The running job and the queued ones in the order they run.
+        Returns
+        -------
+        List of tuples (job, start), the loop time each one is expected to
+        start at, every job starting when the previous one ends.
+        """
+        now = self._now()
+        cursor = now if self.end is None else max(self.end, now)
+        entries = []
+        if self.running is not None:
+            start = self.scheduler.origin
+            if start is None:
+                start = cursor
+            entries.append((self.running, start))
+            cursor = max(start + self.running.compiled.duration, now)
+        for priority, seq, job in sorted(self.pending):
+            entries.append((job, cursor))
+            cursor += job.compiled.duration
+        return entries
+
+    async def _run(self):
+        while self.pending:
+            priority, seq, job = heapq.heappop(self.pending)
+            self.running = job
+            job.status = 'running'
+            logger.info(
+                "Job %s started, %d queued" % (job.compiled.id,
+                                               len(self.pending))
+            )
+            task = self.scheduler.start(
+                job.compiled.timeline(), self.action, self.lead, self.end
+            )
+            await asyncio.wait((task,))
+            job.start = self.scheduler.origin
+            if task.cancelled() and job.status == 'running':
+                job.status = 'canceled'
+            if job.status == 'running':
+                job.status = 'done'
+                self.end = job.start + job.compiled.duration
+            else:
+                self.end = None
+            self.running = None
+            self._finish(job)
+
+    def _stop(self, job, status):
+        job.status = status
+        # The job is over for the schedule even if its task still unwinds
+        self.running = None
+        self.end = None
+        self.scheduler.cancel()
+
+    def _finish(self, job):
+        logger.info("Job %s %s" % (job.compiled.id, job.status))
+        self.finished.append(job.compiled.id)
+        if len(self.finished) > self.HISTORY:
+            self.jobs.pop(self.finished.popleft(), None)
+
+    def _now(self):
+        return asyncio.get_event_loop().time()
@@ -0,0 +1,125 @@
+"""
+This module schedules the states of an experiment on the asyncio event loop.
+The loop clock is monotonic so the timeline is not affected when the wall
+clock is adjusted, and every state is due at the start time plus its offset
+so the transmit delays do not accumulate. The delay of every start is
+recorded in the metrics. The events are handed over without waiting for
+the serial link, a state that is late is coalesced by the serial writer.
+The LEDs only change when the last byte of a state arrives, so with a lead
+time the state is handed over that much earlier and its boundary is where
+it becomes visible. The error between the boundary and the moment the state
+was acknowledged is reported for every state. A timeline may be given the
+moment it starts, so it follows the previous one without a gap.
+"""
+import asyncio
+from collections import deque
+from functools import partial
+
+import experiment.utils.logger as my_logger
+import experiment.utils.metrics as metrics
+
+logger = my_logger.get_logger('scheduler')
+
+
+class Scheduler(object):
+    """
+    Runs one timeline of events at a time, starting a new one cancels the
+    previous one. The boundary errors of the last BOUNDARIES states are
+    kept as tuples (offset, error) in seconds. `origin` is the loop time of
+    the start of the running timeline, None until its first event.
+    """
+    BOUNDARIES = 1024
+
+    def __init__(self):
+        """
+        Returns
+        -------
+        new Scheduler Object
+        """
+        self.task = None
+        self.origin = None
+        self.boundaries = deque(maxlen=self.BOUNDARIES)
+
+    def empty(self):
+        """ True if there is no timeline running. """
+        return self.task is None or self.task.done()
+
+    def cancel(self):
+        """ Cancels the running timeline, if any. """
+        if not self.empty():
+            self.task.cancel()
+
+    def start(self, events, action, lead=None, at=None):
+        """
+        Cancels the running timeline and starts a new one.
+        ----------
+        events : iterable
+            Tuples (offset, payload) in order, the offset is in seconds from
+            the start of the timeline.
+        action : function
+            Non-blocking function called on the event loop with the payload
+            of each event. It may return a Future resolved with True once
+            the payload is visible, the boundary error is then recorded.
+        lead : function
+            Called with the payload of each event, it returns the seconds
+            the payload takes to become visible. None to start every event
+            at its offset.
+        at : float
+            Loop time of the start of the timeline, its first event is
+            handed over ahead of it by its lead time. None, or a time
+            already past, to start as soon as the first event is visible.
+        Returns
+        -------
+        The asyncio Task running the timeline.
+        """
+        self.cancel()
+        self.boundaries.clear()
+        self.origin = None
+        self.task = asyncio.ensure_future(
+            self._run(events, action, lead, at)
+        )
+        return self.task
+
+    async def _run(self, events, action, lead, at):
+        loop = asyncio.get_event_loop()
+        t0 = None
+        for offset, payload in events:
+            advance = lead(payload) if lead is not None else 0
+            if t0 is None:
+                # The first state cannot start early, the timeline starts
+                # once it is visible
+                t0 = loop.time() + advance - offset
+                if at is not None:
+                    t0 = max(t0, at)
+                self.origin = t0
+            due = offset - advance
+            delay = t0 + due - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            started = loop.time() - t0
+            logger.debug(
+                "Event at %.3f s started %.3f s late with %.3f s of lead"
+                % (offset, started - due, advance)
+            )
+            metrics.set_gauge('moca_state_scheduled_seconds', offset)
+            metrics.set_gauge('moca_state_started_seconds', started)
+            metrics.observe(
+                'moca_state_start_delay_seconds', max(started - due, 0)
+            )
+            result = action(payload)
+            if isinstance(result, asyncio.Future):
+                result.add_done_callback(
+                    partial(self._visible, t0 + offset, offset)
+                )
+
+    def _visible(self, boundary, offset, future):
+        if future.cancelled() or not future.result():
+            return
+        error = asyncio.get_event_loop().time() - boundary
+        self.boundaries.append((offset, error))
+        logger.info(
+            "State at %.3f s visible %+.1f ms from its boundary"
+            % (offset, error * 1000)
+        )
+        metrics.set_gauge('moca_state_boundary_error_seconds', error)
+        metrics.observe('moca_state_boundary_abs_error_seconds', abs(error))
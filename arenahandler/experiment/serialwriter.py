@@ -0,0 +1,103 @@
+"""
+This module owns the serial session on the event loop: a single writer task
+takes the states from a queue and sends them one at a time in the executor.
+The states that have not started transmitting when the writer is free are
+coalesced and only the newest one is rendered, so a burst of requests does
+not fill the link with states that are already out of date.
+"""
+import asyncio
+from time import perf_counter
+
+import experiment.utils.logger as my_logger
+import experiment.utils.metrics as metrics
+
+logger = my_logger.get_logger('serialwriter')
+
+
+class SerialWriter(object):
+    """
+    Single writer of the serial session fed by a queue where the last state
+    wins. A state is sent, coalesced with a newer one or dropped when the
+    writer stops or the send fails.
+    """
+
+    def __init__(self, send):
+        """
+        ----------
+        send : function
+            Blocking function that sends one state, it runs in the executor.
+            It returns False when the state was not applied.
+        Returns
+        -------
+        new SerialWriter Object
+        """
+        self.send = send
+        self.queue = None
+        self.task = None
+        self.sent = 0
+        self.coalesced = 0
+        self.dropped = 0
+
+    def post(self, payload):
+        """
+        Queues a state for the writer, it never blocks.
+        ----------
+        payload : Object
+            The state passed to the send function.
+        Returns
+        -------
+        Future resolved with True once the state is sent, False if it is
+        coalesced or dropped.
+        """
+        if self.task is None or self.task.done():
+            self.queue = asyncio.Queue()
+            self.task = asyncio.ensure_future(self._run())
+        future = asyncio.get_event_loop().create_future()
+        self.queue.put_nowait((payload, future, perf_counter()))
+        return future
+
+    def stop(self):
+        """ Stops the writer, the states still queued are dropped. """
+        if self.task is not None:
+            self.task.cancel()
+        while self.queue is not None and not self.queue.empty():
+            payload, future, posted = self.queue.get_nowait()
+            self._settle(future, 'dropped')
+
+    def counts(self):
+        """ Number of states sent, coalesced and dropped. """
+        return {
+            'sent': self.sent,
+            'coalesced': self.coalesced,
+            'dropped': self.dropped
+        }
+
+    async def _run(self):
+        loop = asyncio.get_event_loop()
+        while True:
+            payload, future, posted = await self.queue.get()
+            # Only the newest of the states waiting is worth sending
+            while not self.queue.empty():
+                self._settle(future, 'coalesced')
+                payload, future, posted = self.queue.get_nowait()
+            metrics.observe(
+                'moca_stage_seconds', perf_counter() - posted, stage='queue'
+            )
+            try:
+                applied = await loop.run_in_executor(None, self.send, payload)
+            except asyncio.CancelledError:
+                self._settle(future, 'dropped')
+                raise
+            except Exception as e:
+                logger.error(e)
+                self._settle(future, 'dropped')
+            else:
+                self._settle(future, 'dropped' if applied is False else 'sent')
+
+    def _settle(self, future, outcome):
+        setattr(self, outcome, getattr(self, outcome) + 1)
+        metrics.inc('moca_states_total', outcome=outcome)
+        if outcome != 'sent':
+            logger.info("State %s, %s" % (outcome, self.counts()))
+        if not future.done():
+            future.set_result(outcome == 'sent')
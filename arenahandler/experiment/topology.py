@@ -0,0 +1,143 @@
+"""
+This module maps one logical arena to the controllers that drive it. Each
+controller is an Arduino on its own serial port driving a contiguous range
+of edges or blocks of the arena, its strip starts with the first LED of the
+range. The frame buffer of a state is split into one frame per controller
+so the controllers can be sent their part in parallel.
+"""
+from typing import NamedTuple, Optional
+
+from .component.Frame import Frame
+from .component.parsing import parseInt, require
+
+
+class Shard(NamedTuple):
+    """
+    A controller and the range of the arena it drives, `first` and `last`
+    are one based and inclusive, `last` is None up to the end of the arena.
+    `leds` is the size of the LED array of its firmware.
+    """
+    port: str
+    baud: int
+    unit: str
+    first: int
+    last: Optional[int]
+    leds: int
+
+    UNITS = ('edges', 'blocks')
+    LEDS = 960
+
+    @classmethod
+    def fromDict(cls, data, where, baud):
+        """
+        Parses and validates a controller of the topology.
+        """
+        units = [unit for unit in cls.UNITS if unit in data]
+        if len(units) > 1:
+            raise ValueError(
+                "%s: either 'edges' or 'blocks', not both" % (where)
+            )
+        unit = units[0] if units else 'blocks'
+        bounds = data.get(unit, [1])
+        if not isinstance(bounds, list) or not 1 <= len(bounds) <= 2 or any(
+                isinstance(b, bool) or not isinstance(b, int) or b < 1
+                for b in bounds) or bounds[-1] < bounds[0]:
+            raise ValueError(
+                "%s: '%s' must be [first] or [first, last], one based"
+                % (where, unit)
+            )
+        if not isinstance(require(data, 'serialport', where), str):
+            raise ValueError("%s: 'serialport' must be a string" % (where))
+        return cls(
+            data['serialport'],
+            parseInt(data, 'baudrate', where, 1, baud),
+            unit,
+            bounds[0],
+            bounds[1] if len(bounds) == 2 else None,
+            parseInt(data, 'leds', where, 1, cls.LEDS)
+        )
+
+    def blocks(self, frame):
+        """ The zero based blocks of the frame driven by the controller. """
+        size = frame.blocks if self.unit == 'edges' else 1
+        count = frame.blockCount()
+        stop = count if self.last is None else min(self.last * size, count)
+        return range(min((self.first - 1) * size, stop), stop)
+
+
+def parseTopology(config):
+    """
+    This function reads the controllers of the configuration, a single
+    controller on `serialport` drives the whole arena when there is no
+    `controllers` list.
+    ----------
+    config : Dict
+        The configuration, see config.json.
+
+    Returns
+    -------
+    Tuple of Shard objects.
+
+    """
+    baud = config['baudrate']
+    controllers = config.get('controllers')
+    if controllers is None:
+        return (Shard(config['serialport'], baud, 'blocks', 1, None,
+                      Shard.LEDS),)
+    if not isinstance(controllers, list) or not controllers:
+        raise ValueError("'controllers' must be a non empty list")
+    return tuple(
+        Shard.fromDict(data, 'controllers[%d]' % (i), baud)
+        for i, data in enumerate(controllers)
+    )
+
+
+def capacity(shards):
+    """ Number of LEDs the controllers hold together. """
+    return sum(shard.leds for shard in shards)
+
+
+def split(frame, shards):
+    """
+    This function splits a frame buffer into the frame of each controller,
+    a controller driving the whole arena gets the frame itself.
+    ----------
+    frame : Object
+        The frame buffer of the arena.
+
+    shards : tuple
+        The controllers, see parseTopology.
+
+    Returns
+    -------
+    Tuple with the frame of each controller, a controller outside the arena
+    gets an empty frame. A LED colored by the state but driven by no
+    controller, or a controller given more LEDs than its firmware holds, is
+    reported as a ValueError.
+
+    """
+    frames = []
+    covered = [False] * frame.blockCount()
+    for shard in shards:
+        blocks = shard.blocks(frame)
+        if len(blocks) * frame.leds > shard.leds:
+            raise ValueError(
+                "%s drives %d LEDs of the arena, its firmware holds %d"
+                % (shard.port, len(blocks) * frame.leds, shard.leds)
+            )
+        covered[blocks.start:blocks.stop] = [True] * len(blocks)
+        if len(blocks) == frame.blockCount():
+            frames.append(frame)
+            continue
+        part = Frame(1, len(blocks), frame.leds, frame.brightness)
+        part.pixels = frame.pixels[
+            blocks.start * frame.leds:blocks.stop * frame.leds
+        ]
+        frames.append(part)
+    for index, driven in enumerate(covered):
+        if not driven and any(p is not None for p in frame.block(index)):
+            raise ValueError(
+                "Block %d of the arena is not driven by any controller"
+                % (index + 1)
+            )
+    return tuple(frames)
@@ -1,25 +1,113 @@
 """
-This module is used to manage the logging for the applicaiton.
+This module is used to manage the logging for the applicaiton. The loggers
+only put their records in a queue, a background thread writes them to the
+files and the console so the serial path never waits for the disk. The per
+element messages go through trace(), which is sampled and can be switched
+at runtime.
 """
+import atexit
+import itertools
 import logging
+import logging.handlers
 import os
+import queue
+import threading
 
 from .readconfig import config
 
+records = queue.Queue(-1)
+tracing = {'every': config.get('traceevery', 0), 'count': itertools.count(1)}
+_listener = None
+_router = None
+_lock = threading.Lock()
+
+
+class LoggerRouter(logging.Handler):
+    """
+    Writes the records from the queue to the file of their logger.
+    """
+
+    def __init__(self, formatter):
+        logging.Handler.__init__(self)
+        self.formatter = formatter
+        self.files = {}
+
+    def add(self, logger_name):
+        """ Opens the log file of a logger. """
+        log_file = os.path.join("logs/", '{}.log'.format(logger_name))
+        file_handler = logging.FileHandler(log_file)
+        file_handler.setFormatter(self.formatter)
+        self.files[logger_name] = file_handler
+
+    def emit(self, record):
+        file_handler = self.files.get(record.name)
+        if file_handler is not None:
+            file_handler.handle(record)
+
+    def close(self):
+        for file_handler in self.files.values():
+            file_handler.close()
+        logging.Handler.close(self)
+
+
+def start_listener():
+    """ Starts the background writer, once per process. """
+    global _listener, _router
+    with _lock:
+        if _listener is not None:
+            return _router
+        if not os.path.exists("logs/"):
+            os.makedirs("logs/")
+        formatter = logging.Formatter(config['logformat'])
+        console_handler = logging.StreamHandler()
+        console_handler.setFormatter(formatter)
+        _router = LoggerRouter(formatter)
+        _listener = logging.handlers.QueueListener(
+            records, _router, console_handler
+        )
+        _listener.start()
+        atexit.register(stop_listener)
+        return _router
+
+
+def stop_listener():
+    """ Writes the records still in the queue and stops the writer. """
+    global _listener
+    with _lock:
+        if _listener is not None:
+            _listener.stop()
+            _router.close()
+            _listener = None
+
 
 def get_logger(logger_name='main'):
     logger = logging.getLogger(logger_name)
     if logger.handlers:
         return logger
-    log_file = os.path.join("logs/", '{}.log'.format(logger_name))
-    if not os.path.exists("logs/"):
-        os.makedirs("logs/")
-    formatter = logging.Formatter(config['logformat'])
-    file_handler = logging.FileHandler(log_file)
-    file_handler.setFormatter(formatter)
-    console_handler = logging.StreamHandler()
-    console_handler.setFormatter(formatter)
+    start_listener().add(logger_name)
     logger.setLevel(config['loglevel'])
-    logger.addHandler(file_handler)
-    logger.addHandler(console_handler)
+    logger.addHandler(logging.handlers.QueueHandler(records))
+    logger.propagate = False
     return logger
+
+
+def set_trace(every):
+    """
+    Switches the per element messages at runtime.
+    ----------
+    every : int
+        0 to disable them, otherwise one message of every `every` is logged.
+    """
+    if isinstance(every, bool) or not isinstance(every, int) or every < 0:
+        raise ValueError("'every' must be a non negative integer")
+    tracing['every'] = every
+
+
+def trace(logger, message, *args):
+    """
+    Logs a per element message at DEBUG level, sampled by set_trace(). The
+    message is only formatted when it is logged.
+    """
+    every = tracing['every']
+    if every and next(tracing['count']) % every == 0:
+        logger.debug(message, *args)
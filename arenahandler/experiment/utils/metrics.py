@@ -0,0 +1,215 @@
+"""
+This module keeps the metrics of the application and renders them in the
+Prometheus text format: the latency of every stage between the request and
+the LEDs, the bytes and instructions sent per state and the delay and the
+boundary error of the scheduled states. Every function is thread safe, the
+metrics are updated from the event loop and from the executor.
+"""
+import threading
+from contextlib import contextmanager
+from time import perf_counter
+
+TIME_BUCKETS = (
+    0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+    0.25, 0.5, 1.0, 2.5, 5.0
+)
+SIZE_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000)
+METRICS = {
+    'moca_stage_seconds': (
+        'histogram', TIME_BUCKETS,
+        'Time spent in each stage between the request and the LEDs.'
+    ),
+    'moca_state_bytes': (
+        'histogram', SIZE_BUCKETS, 'Bytes sent to the Arduino per state.'
+    ),
+    'moca_state_instructions': (
+        'histogram', SIZE_BUCKETS,
+        'Instructions sent to the Arduino per state.'
+    ),
+    'moca_state_consistent_seconds': (
+        'histogram', TIME_BUCKETS,
+        'Time from the start of a state until all of it is visible, labeled '
+        'by how it is committed.'
+    ),
+    'moca_state_start_delay_seconds': (
+        'histogram', TIME_BUCKETS,
+        'Actual minus scheduled start of the states of an experiment.'
+    ),
+    'moca_state_scheduled_seconds': (
+        'gauge', None,
+        'Scheduled start of the last state from the start of its experiment.'
+    ),
+    'moca_state_started_seconds': (
+        'gauge', None,
+        'Actual start of the last state from the start of its experiment.'
+    ),
+    'moca_state_boundary_abs_error_seconds': (
+        'histogram', TIME_BUCKETS,
+        'Distance between the scheduled boundary of the states of an '
+        'experiment and the moment they were visible.'
+    ),
+    'moca_state_boundary_error_seconds': (
+        'gauge', None,
+        'Visible minus scheduled boundary of the last state, negative when '
+        'it was early.'
+    ),
+    'moca_animation_fps': (
+        'gauge', None, 'Frames applied per second by the last animation.'
+    ),
+    'moca_animation_frames_total': (
+        'counter', None,
+        'Frames of the animations, applied or dropped to keep their duration.'
+    ),
+    'moca_requests_total': ('counter', None, 'Requests received.'),
+    'moca_states_total': (
+        'counter', None,
+        'States posted to the serial writer: sent, coalesced or dropped.'
+    )
+}
+
+_lock = threading.Lock()
+_values = {}
+_collectors = []
+
+
+class Histogram(object):
+    """
+    Cumulative histogram with fixed upper bounds.
+    """
+
+    def __init__(self, buckets):
+        """
+        ----------
+        buckets : tuple
+            Upper bounds of the buckets in increasing order.
+        Returns
+        -------
+        new Histogram Object
+        """
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0
+
+    def observe(self, value):
+        """ Records one value. """
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.count += 1
+        self.sum += value
+
+    def lines(self, name, labels):
+        """ The lines of the histogram in the text format. """
+        cumulative = 0
+        lines = []
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            lines.append('%s_bucket%s %d' % (
+                name, format_labels(labels, le='%g' % (bound)), cumulative
+            ))
+        lines.append('%s_bucket%s %d' % (
+            name, format_labels(labels, le='+Inf'), self.count
+        ))
+        lines.append('%s_sum%s %r' % (name, format_labels(labels), self.sum))
+        lines.append('%s_count%s %d' % (
+            name, format_labels(labels), self.count
+        ))
+        return lines
+
+
+def format_labels(labels, **extra):
+    """ The labels between braces, empty without labels. """
+    pairs = list(labels) + sorted(extra.items())
+    if not pairs:
+        return ''
+    return '{%s}' % ','.join(
+        '%s="%s"' % (key, _escape(value)) for key, value in pairs
+    )
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"')
+
+
+def _key(name, labels):
+    if name not in METRICS:
+        raise KeyError("Unknown metric %s" % (name))
+    return name, tuple(sorted(labels.items()))
+
+
+def observe(name, value, **labels):
+    """ Records a value in a histogram. """
+    key = _key(name, labels)
+    with _lock:
+        if key not in _values:
+            _values[key] = Histogram(METRICS[name][1])
+        _values[key].observe(value)
+
+
+def inc(name, value=1, **labels):
+    """ Increases a counter. """
+    key = _key(name, labels)
+    with _lock:
+        _values[key] = _values.get(key, 0) + value
+
+
+def set_gauge(name, value, **labels):
+    """ Sets a gauge. """
+    key = _key(name, labels)
+    with _lock:
+        _values[key] = value
+
+
+@contextmanager
+def span(stage):
+    """ Measures the block as the given stage of moca_stage_seconds. """
+    start = perf_counter()
+    try:
+        yield
+    finally:
+        observe('moca_stage_seconds', perf_counter() - start, stage=stage)
+
+
+def register(collector):
+    """
+    Adds a function called at every render, it returns a list of tuples
+    (name, type, help, value) with the current value of other metrics, or
+    (name, type, help, value, labels) with a dictionary of labels. The
+    samples of a metric follow each other.
+    """
+    _collectors.append(collector)
+
+
+def render():
+    """ All the metrics in the Prometheus text format. """
+    lines = []
+    with _lock:
+        for name, (kind, buckets, description) in sorted(METRICS.items()):
+            keys = sorted(k for k in _values if k[0] == name)
+            if not keys:
+                continue
+            lines.append('# HELP %s %s' % (name, description))
+            lines.append('# TYPE %s %s' % (name, kind))
+            for key in keys:
+                value = _values[key]
+                if kind == 'histogram':
+                    lines.extend(value.lines(name, key[1]))
+                else:
+                    lines.append('%s%s %r' % (
+                        name, format_labels(key[1]), value
+                    ))
+    previous = None
+    for collector in _collectors:
+        for sample in collector():
+            name, kind, description, value = sample[:4]
+            labels = sample[4] if len(sample) > 4 else {}
+            if name != previous:
+                lines.append('# HELP %s %s' % (name, description))
+                lines.append('# TYPE %s %s' % (name, kind))
+                previous = name
+            lines.append('%s%s %r' % (
+                name, format_labels(sorted(labels.items())), value
+            ))
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,111 @@
+"""
+Tests of the binary wire protocol and of its negotiation, run from
+arenahandler with python -m pytest tests.
+"""
+import pytest
+
+from experiment.arduinointf.ArduinoInstruction import ArduinoInstruction
+from experiment.arduinointf.BinaryCodec import BinaryCodec
+from experiment.arduinointf.VirtualArduino import PtyEmulator, \
+    VirtualArduino
+from experiment.component.BlockInstruction import BlockInstruction
+
+
+def instruction(block, leds=(), brightness=5):
+    bIns = BlockInstruction()
+    bIns.brightness = brightness
+    bIns.block = block
+    bIns.led = ['%d,%d,%d,%d' % led for led in leds]
+    return bIns
+
+
+def test_round_trip():
+    codec = BinaryCodec()
+    fill = instruction('3,12,255,0,0', [(1, 0, 0, 255)])
+    loose = instruction('4,12,-1,-1,-1', [(0, 1, 2, 3), (13, 4, 5, 6)])
+    stream = codec.encode(fill) + codec.encode(loose, staged=True) + \
+        [codec.show(30), codec.hello()]
+    decoded = []
+    # The frames may arrive in any number of chunks
+    for byte in b''.join(stream):
+        decoded.extend(codec.feed(bytes([byte])))
+    assert decoded == [
+        {'opcode': BinaryCodec.OP_FILL, 'staged': False, 'brightness': 5,
+         'block': 3, 'size': 12, 'fill': (255, 0, 0),
+         'leds': [(1, (0, 0, 255))]},
+        {'opcode': BinaryCodec.OP_LEDS, 'staged': True, 'brightness': 5,
+         'block': 4, 'size': 12, 'fill': None,
+         'leds': [(0, (1, 2, 3)), (13, (4, 5, 6))]},
+        {'opcode': BinaryCodec.OP_SHOW, 'staged': False, 'brightness': 30,
+         'block': 0, 'size': 0, 'fill': None, 'leds': []},
+        {'opcode': BinaryCodec.OP_HELLO, 'staged': False, 'brightness': 0,
+         'block': 0, 'size': 0, 'fill': None, 'leds': []}
+    ]
+
+
+def test_leds_are_split_by_max_leds():
+    codec = BinaryCodec()
+    leds = [(i, i, 0, 0) for i in range(2 * BinaryCodec.MAX_LEDS + 4)]
+    frames = codec.encode(instruction('0,200,0,0,255', leds), staged=True)
+    assert all(len(frame) < 256 for frame in frames)
+    decoded = codec.feed(b''.join(frames))
+    assert [(d['opcode'], d['staged'], len(d['leds'])) for d in decoded] == [
+        (BinaryCodec.OP_FILL, True, BinaryCodec.MAX_LEDS),
+        (BinaryCodec.OP_LEDS, True, BinaryCodec.MAX_LEDS),
+        (BinaryCodec.OP_LEDS, True, 4)
+    ]
+    assert [led for d in decoded for led in d['leds']] == \
+        [(i, (i, 0, 0)) for i, r, g, b in leds]
+
+
+def test_bad_sync_version_and_checksum_are_rejected():
+    codec = BinaryCodec()
+    frame = codec.encode(instruction('1,12,0,255,0'))[0]
+    badVersion = frame[:1] + bytes([BinaryCodec.VERSION + 1]) + frame[2:]
+    badChecksum = frame[:-1] + bytes([(frame[-1] + 1) & 0xFF])
+    assert codec.feed(b'\x5a' + frame[1:]) == []
+    assert codec.feed(badVersion)[0] == {
+        'error': 'version %d' % (BinaryCodec.VERSION + 1)
+    }
+    codec = BinaryCodec()
+    assert codec.feed(badChecksum)[0] == {'error': 'checksum'}
+
+    # The firmware drops the bad frame, the rest of it is not executed
+    arduino = VirtualArduino()
+    for bad in (badVersion, badChecksum):
+        lines = arduino.receive(bad)
+        assert lines[0] == VirtualArduino.BINARY_ERROR_MESSAGE
+        assert VirtualArduino.ACK_MESSAGE not in lines
+    assert arduino.visible[12] == (0, 0, 0)
+    assert arduino.receive(frame) == [VirtualArduino.ACK_MESSAGE]
+    assert arduino.visible[12] == (0, 255, 0)
+
+
+class JsonArduino(VirtualArduino):
+    """ A firmware older than the binary protocol, JSON only. """
+
+    def _readFrame(self):
+        return self._readJSON()
+
+
+@pytest.mark.parametrize('arduino, binary', [
+    (VirtualArduino, True), (JsonArduino, False)
+])
+def test_negotiation(arduino, binary):
+    emulator = PtyEmulator(link=False)
+    emulator.arduino = arduino()
+    emulator.start()
+    aIns = ArduinoInstruction(emulator.port, emulator.baud, protocol='auto')
+    aIns.START_WAIT_TIME = 0
+    aIns.HELLO_WAIT_TIME = 0.05
+    try:
+        assert aIns.ensure_connection()
+        assert aIns.binary == binary
+        assert aIns.staged == binary
+        aIns.send_block(instruction('2,12,255,255,0'))
+        aIns.flush()
+        assert aIns.failures() == 0
+        assert emulator.arduino.visible[24] == (255, 255, 0)
+    finally:
+        aIns.close_connection()
+        emulator.stop()
@@ -0,0 +1,53 @@
+"""
+Tests of the compile cache, run from arenahandler with
+python -m pytest tests.
+"""
+from experiment.compilecache import CompileCache, digest
+
+
+def test_least_recently_used_is_evicted():
+    cache = CompileCache(2)
+    built = []
+
+    def build(key):
+        return lambda: built.append(key) or key.upper()
+
+    assert cache.get('a', build('a')) == 'A'
+    assert cache.get('b', build('b')) == 'B'
+    # 'a' is used again, 'b' is now the least recently used
+    assert cache.get('a', build('a')) == 'A'
+    assert cache.get('c', build('c')) == 'C'
+    assert list(cache.entries) == ['a', 'c']
+    assert cache.get('b', build('b')) == 'B'
+    assert list(cache.entries) == ['c', 'b']
+    assert built == ['a', 'b', 'c', 'b']
+    assert cache.toDict() == {
+        'size': 2, 'entries': 2, 'hits': 1, 'misses': 4, 'evictions': 2
+    }
+
+
+def test_exceptions_are_not_cached():
+    cache = CompileCache()
+
+    def fail():
+        raise ValueError('invalid')
+
+    for i in range(2):
+        try:
+            cache.get('key', fail)
+        except ValueError:
+            pass
+    assert cache.get('key', lambda: 1) == 1
+    assert cache.toDict()['misses'] == 3
+
+
+def test_disabled_cache_builds_every_time():
+    cache = CompileCache(0)
+    assert cache.get('key', lambda: 1) == 1
+    assert cache.get('key', lambda: 2) == 2
+    assert cache.toDict()['entries'] == 0
+
+
+def test_digest_ignores_key_order_and_spacing():
+    assert digest({'a': 1, 'b': [1, 2]}) == digest({'b': [1, 2], 'a': 1})
+    assert digest({'a': 1}) != digest({'a': 2})
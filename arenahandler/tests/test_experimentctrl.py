@@ -0,0 +1,57 @@
+"""
+Tests of the states sent through a serial session to the emulated
+firmware, run from arenahandler with python -m pytest tests.
+"""
+import pytest
+
+import experiment.experimentctrl as ec
+from experiment.arduinointf.ArduinoInstruction import ArduinoInstruction
+from experiment.arduinointf.VirtualArduino import PtyEmulator
+from experiment.component.Arena import Arena
+from experiment.framecompiler import compileArena, frameToInstructions
+
+
+@pytest.fixture
+def session():
+    emulator = PtyEmulator(link=False).start()
+    aIns = ArduinoInstruction(
+        emulator.port, emulator.baud, protocol='json', commit=False
+    )
+    aIns.START_WAIT_TIME = 0
+    yield emulator, aIns
+    aIns.close_connection()
+    emulator.stop()
+
+
+def frame(**rules):
+    data = {
+        'edges': 8, 'blocks': 10, 'leds': 12, 'brightness': 5,
+        'color': 'green'
+    }
+    data.update(rules)
+    return compileArena(Arena.fromDict(data))
+
+
+def test_delta_after_the_first_state(session):
+    emulator, aIns = session
+    first = frame()
+    second = frame(led=[{'color': 'red', 'index': [5, 7]}])
+    assert ec.sendFrame(first, aIns) == len(frameToInstructions(first))
+    sent = aIns.stats.leds
+    assert ec.sendFrame(second, aIns) == 1
+    assert aIns.stats.leds - sent == 3
+    assert emulator.arduino.visible == second.pixels
+
+
+def test_whole_frame_after_forget_shown_or_reconnect(session):
+    emulator, aIns = session
+    first = frame()
+    second = frame(led=[{'color': 'red', 'index': [5, 7]}])
+    whole = len(frameToInstructions(second))
+    ec.sendFrame(first, aIns)
+    aIns.forget_shown()
+    assert ec.sendFrame(second, aIns) == whole
+    assert ec.sendFrame(second, aIns) == 0
+    aIns.reconnect()
+    assert ec.sendFrame(second, aIns) == whole
+    assert emulator.arduino.visible == second.pixels
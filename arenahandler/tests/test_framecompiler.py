@@ -0,0 +1,83 @@
+"""
+Tests of the frame compiler and of the block instructions it packs, applied
+to the emulated firmware. Run from arenahandler with python -m pytest tests.
+"""
+import json
+
+from experiment.arduinointf.VirtualArduino import VirtualArduino
+from experiment.component.Arena import Arena
+from experiment.component.BlockInstruction import BlockInstruction
+from experiment.framecompiler import compileArena, frameToInstructions, \
+    ledBufferSize
+
+
+def arena(**rules):
+    data = {
+        'edges': 8, 'blocks': 10, 'leds': 12, 'brightness': 5,
+        'color': 'omit'
+    }
+    data.update(rules)
+    return Arena.fromDict(data)
+
+
+def apply(instructions, arduino=None):
+    """ The emulated firmware after receiving the instructions as JSON. """
+    arduino = arduino or VirtualArduino()
+    for bIns in instructions:
+        lines = arduino.receive(json.dumps(bIns.__dict__).encode())
+        assert lines == [VirtualArduino.ACK_MESSAGE]
+    return arduino
+
+
+def test_led_range_is_packed_under_the_json_buffer():
+    # Every other LED, no block is covered so none of them is filled
+    frame = compileArena(arena(led=[{'color': 'red', 'index': [1, 79, 2]}]))
+    instructions = frameToInstructions(frame)
+    limit = BlockInstruction.JSON_BUFFER_SIZE
+    assert len(instructions) > 1
+    assert all(bIns.bufferSize() <= limit for bIns in instructions)
+    assert all(bIns.block.endswith(',-1,-1,-1') for bIns in instructions)
+    # Every instruction but the last is full, the next LED did not fit
+    for bIns in instructions[:-1]:
+        assert bIns.bufferSize() + ledBufferSize('99,255,0,0') > limit
+    assert sum(len(bIns.led) for bIns in instructions) == 40
+    visible = apply(instructions).visible
+    assert [i for i, rgb in enumerate(visible) if rgb == (255, 0, 0)] == \
+        list(range(0, 80, 2))
+    assert visible.count((0, 0, 0)) == 960 - 40
+
+
+def test_known_arena():
+    frame = compileArena(arena(
+        edges=2, blocks=2, leds=3, color='green',
+        edge=[{'color': 'blue', 'index': [2]}],
+        led=[{'color': 'red', 'index': [1]}]
+    ))
+    red, green, blue = (255, 0, 0), (0, 255, 0), (0, 0, 255)
+    assert frame.pixels == [red] + [green] * 5 + [blue] * 6
+    visible = apply(frameToInstructions(frame)).visible
+    assert visible[:12] == frame.pixels
+
+
+def test_omitted_leds_are_left_alone():
+    frame = compileArena(arena(
+        edges=2, blocks=2, leds=3, block=[{'color': 'white', 'index': [-1]}]
+    ))
+    assert frame.pixels == [None] * 9 + [(255, 255, 255)] * 3
+    assert [bIns.block for bIns in frameToInstructions(frame)] == \
+        ['3,3,255,255,255']
+
+
+def test_second_state_sends_only_the_changed_leds():
+    first = compileArena(arena(color='green'))
+    second = compileArena(arena(
+        color='green', led=[{'color': 'red', 'index': [5, 7]}]
+    ))
+    arduino = apply(frameToInstructions(first))
+    shown = []
+    first.paint(shown)
+    instructions = frameToInstructions(second.delta(shown))
+    assert [bIns.led for bIns in instructions] == \
+        [['4,255,0,0', '5,255,0,0', '6,255,0,0']]
+    assert instructions[0].block.endswith(',-1,-1,-1')
+    assert apply(instructions, arduino).visible == second.pixels
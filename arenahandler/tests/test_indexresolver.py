@@ -0,0 +1,58 @@
+"""
+Tests of the range index resolver against the scalar functions on random
+indexes, negative, wrapping around and with any step. Run from arenahandler
+with python -m pytest tests.
+"""
+import random
+
+from experiment.component.parsing import rangeToList
+from experiment.indexresolver import absolute, fromNegToPosEq, \
+    fromRelPosToAbsPos, relative, spans, within
+
+CHECKS = 2000
+
+
+def flatten(ranges):
+    """ The sorted values of a list of ranges. """
+    return sorted(i for index in ranges for i in index)
+
+
+def cases(seed):
+    """ Random spaces and indexes, the same ones on every run. """
+    rng = random.Random(seed)
+    for i in range(CHECKS):
+        space = rng.randint(1, 960)
+        index = rangeToList([
+            rng.randint(-3 * space, 3 * space),
+            rng.randint(-3 * space, 3 * space),
+            rng.choice([1, 2, 3, -1, -2, -7])
+        ])
+        yield rng, space, index
+
+
+def test_absolute():
+    for rng, space, index in cases(0):
+        expected = sorted(
+            fromNegToPosEq(space, i) if i < 0 else i for i in index
+        )
+        assert flatten(absolute(index, space)) == expected, (space, index)
+
+
+def test_relative():
+    for rng, space, index in cases(1):
+        unit = rng.choice([1, rng.randint(1, space)])
+        anchor = rng.randint(-3, 12)
+        expected = sorted(
+            fromRelPosToAbsPos(anchor, unit, i, space) for i in index
+        )
+        assert flatten(relative(index, unit, anchor, space)) == expected, \
+            (space, index, unit, anchor)
+
+
+def test_spans():
+    for rng, space, index in cases(2):
+        units = [within(index, 1, 3 * space + 1)]
+        expected = sorted(
+            led for u in index if u > 0 for led in range((u - 1) * 12, u * 12)
+        )
+        assert flatten(spans(units, 12)) == expected, (space, index)
@@ -0,0 +1,28 @@
+"""
+Tests of the instruction log, run from arenahandler with
+python -m pytest tests.
+"""
+from experiment.arduinointf.InstructionLog import InstructionLog, LogReader
+
+
+def test_handshake_is_recorded_apart_from_the_writes(tmp_path):
+    log = InstructionLog.forPort(str(tmp_path), '/dev/ttyACM0')
+    log.handshake(b'\xa5\x01\x10')
+    log.answer('MoCA binary 1')
+    log.opened('/dev/ttyACM0', 'binary', True)
+    log.write(b'{"block": "0,12,255,0,0"}')
+    log.ack()
+    log.close()
+
+    reader = LogReader(log.path)
+    try:
+        kinds = [record.kind for record in reader.records()]
+        assert kinds == [
+            InstructionLog.HANDSHAKE, InstructionLog.ANSWER,
+            InstructionLog.OPEN, InstructionLog.WRITE, InstructionLog.ACK
+        ]
+        assert len(reader) == 1
+        assert reader[0].payload == b'{"block": "0,12,255,0,0"}'
+        assert reader.connection() == '/dev/ttyACM0 binary staged'
+    finally:
+        reader.close()
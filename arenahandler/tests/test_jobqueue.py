@@ -0,0 +1,68 @@
+"""
+Tests of the experiment queue, run from arenahandler with
+python -m pytest tests.
+"""
+import asyncio
+
+from experiment.jobqueue import JobQueue
+from experiment.scheduler import Scheduler
+
+
+class Compiled(object):
+    """ Stands for a CompiledExperiment of two states. """
+
+    def __init__(self, ident, duration):
+        self.id = ident
+        self.duration = duration
+
+    def timeline(self):
+        return [(0, 'first'), (self.duration, 'last')]
+
+    def toDict(self):
+        return {'id': self.id, 'duration': self.duration}
+
+
+def run(coroutine):
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+
+def test_preempt_response():
+    async def scenario():
+        jobs = JobQueue(Scheduler(), lambda payload: None)
+        jobs.submit(Compiled('low', 30))
+        await asyncio.sleep(0.05)
+        jobs.submit(Compiled('high', 10), priority=1, preempt=True)
+        response = jobs.inspect('high')
+        summary = jobs.summary()
+        preempted = jobs.inspect('low')
+        jobs.clear()
+        await asyncio.wait((jobs.task,))
+        return response, summary, preempted
+
+    response, summary, preempted = run(scenario())
+    assert response['preempted'] == 'low'
+    assert response['status'] == 'queued'
+    assert abs(response['startsIn']) < 0.01
+    assert [job['id'] for job in summary] == ['high']
+    assert preempted['status'] == 'preempted'
+
+
+def test_queued_after_running():
+    async def scenario():
+        jobs = JobQueue(Scheduler(), lambda payload: None)
+        jobs.submit(Compiled('first', 30))
+        await asyncio.sleep(0.05)
+        jobs.submit(Compiled('second', 10), priority=1)
+        response = jobs.inspect('second')
+        jobs.clear()
+        await asyncio.wait((jobs.task,))
+        return response
+
+    response = run(scenario())
+    assert response['preempted'] is None
+    assert 29 < response['startsIn'] <= 30
@@ -0,0 +1,34 @@
+"""
+Tests of the metrics endpoint, run from arenahandler with
+python -m pytest tests.
+"""
+import experiment.experimentctrl as ec
+import experiment.utils.metrics as metrics
+from experiment.arduinointf.TransportStats import TransportStats
+
+
+def test_latency_quantiles():
+    stats = TransportStats(1)
+    assert stats.quantiles() == {}
+    for i in range(101):
+        stats.onAck(i / 1000)
+    assert stats.quantiles() == {0.5: 0.05, 0.95: 0.095, 0.99: 0.099}
+
+
+def test_window_and_latency_per_port():
+    shard, aIns = ec.controllers[0]
+    aIns.stats = TransportStats(2)
+    for inflight in (1, 1, 2):
+        aIns.stats.onSent(10, inflight)
+        aIns.stats.onAck(0.02)
+    lines = metrics.render().split('\n')
+    port = 'port="%s"' % (shard.port)
+    assert 'moca_serial_window{%s} 2' % (port) in lines
+    assert 'moca_serial_window_occupancy_total{inflight="1",%s} 2' % (port) \
+        in lines
+    assert 'moca_serial_window_occupancy_total{inflight="2",%s} 1' % (port) \
+        in lines
+    assert 'moca_serial_latency_seconds{%s,quantile="0.95"} 0.02' % (port) \
+        in lines
+    assert lines.count('# TYPE moca_serial_window_occupancy_total counter') \
+        == 1
@@ -0,0 +1,56 @@
+"""
+Tests of the single serial writer, run from arenahandler with
+python -m pytest tests.
+"""
+import asyncio
+import threading
+
+from experiment.serialwriter import SerialWriter
+
+
+def run(coroutine):
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+
+def test_only_the_last_state_is_sent_after_the_one_in_flight():
+    sending = threading.Event()
+    release = threading.Event()
+    sent = []
+
+    def send(state):
+        sending.set()
+        release.wait(5)
+        sent.append(state)
+        return True
+
+    async def scenario():
+        loop = asyncio.get_event_loop()
+        writer = SerialWriter(send)
+        futures = [writer.post('first')]
+        await loop.run_in_executor(None, sending.wait, 5)
+        futures += [writer.post(state) for state in ('a', 'b', 'last')]
+        release.set()
+        results = await asyncio.gather(*futures)
+        writer.stop()
+        return results, writer.counts()
+
+    results, counts = run(scenario())
+    assert sent == ['first', 'last']
+    assert results == [True, False, False, True]
+    assert counts == {'sent': 2, 'coalesced': 2, 'dropped': 0}
+
+
+def test_failed_state_is_dropped():
+    async def scenario():
+        writer = SerialWriter(lambda state: False)
+        result = await writer.post('state')
+        writer.stop()
+        return result, writer.counts()
+
+    assert run(scenario()) == (False, {'sent': 0, 'coalesced': 0,
+                                       'dropped': 1})
@@ -0,0 +1,51 @@
+"""
+Tests of the split of the arena between the controllers, run from
+arenahandler with python -m pytest tests.
+"""
+import pytest
+
+from experiment.component.Frame import Frame
+from experiment.topology import Shard, parseTopology, split
+
+
+def frame():
+    """ 8 edges of 10 blocks of 12 LEDs, each LED colored by its index. """
+    frame = Frame(8, 10, 12, 5)
+    frame.pixels = [(i % 256, i // 256, 0) for i in range(960)]
+    return frame
+
+
+def shards(unit, *ranges):
+    return parseTopology({'baudrate': 57600, 'controllers': [
+        {'serialport': '/dev/ttyACM%d' % (i), unit: bounds, 'leds': 480}
+        for i, bounds in enumerate(ranges)
+    ]})
+
+
+@pytest.mark.parametrize('controllers', [
+    shards('edges', [1, 3], [4, 6], [7]),
+    shards('blocks', [1, 25], [26, 50], [51, 80])
+])
+def test_every_edge_is_driven_exactly_once(controllers):
+    whole = frame()
+    driven = [b for shard in controllers for b in shard.blocks(whole)]
+    assert sorted(driven) == list(range(whole.blockCount()))
+    parts = split(whole, controllers)
+    assert [p for part in parts for p in part.pixels] == whole.pixels
+
+
+def test_single_controller_gets_the_frame_itself():
+    whole = frame()
+    assert split(whole, parseTopology({
+        'baudrate': 57600, 'serialport': '/dev/ttyACM0'
+    })) == (whole,)
+
+
+def test_led_driven_by_no_controller():
+    with pytest.raises(ValueError, match='Block 61 '):
+        split(frame(), shards('edges', [1, 3], [4, 6]))
+
+
+def test_controller_given_more_leds_than_it_holds():
+    with pytest.raises(ValueError, match='firmware holds 480'):
+        split(frame(), shards('edges', [1, 5], [6]))
@@ -0,0 +1,48 @@
+"""
+Tests of the emulated firmware, run from arenahandler with
+python -m pytest tests.
+"""
+import json
+
+from experiment.arduinointf.VirtualArduino import VirtualArduino
+
+
+def instruction(block, color, leds=()):
+    return json.dumps({
+        'block': '%d,12,%d,%d,%d' % ((block,) + color),
+        'brightness': 5,
+        'led': ['%d,%d,%d,%d' % led for led in leds]
+    }).encode()
+
+
+def test_slow_link_keeps_the_bytes_sent_during_a_show():
+    arduino = VirtualArduino()
+    data = instruction(0, (255, 0, 0)) + instruction(1, (0, 0, 255))
+    lines = arduino.transmit(data, 0, VirtualArduino.SHOW_TIME / 10)
+    assert [line for line, shown, at in lines] == \
+        [VirtualArduino.ACK_MESSAGE] * 2
+    assert arduino.dropped == 0
+    assert arduino.visible[12] == (0, 0, 255)
+    assert lines[1][2] > lines[0][2] + VirtualArduino.SHOW_TIME
+
+
+def test_bytes_beyond_the_receive_buffer_are_lost_during_a_show():
+    arduino = VirtualArduino()
+    first = instruction(0, (255, 0, 0))
+    second = instruction(1, (0, 0, 255), [(i, 0, 255, 0) for i in range(4)])
+    lines = arduino.transmit(
+        first + second, 0, VirtualArduino.SHOW_TIME / 1000
+    )
+    lines += arduino.transmit(b'', 1, VirtualArduino.SHOW_TIME / 1000)
+    assert arduino.dropped == len(second) - VirtualArduino.RX_BUFFER
+    assert [line for line, shown, at in lines] == [VirtualArduino.ACK_MESSAGE]
+    assert arduino.visible[12] == (0, 0, 0)
+
+
+def test_json_buffer_overflow():
+    arduino = VirtualArduino()
+    leds = [(i, 255, 255, 255) for i in range(12)]
+    assert arduino.receive(instruction(0, (0, 0, 0), leds[:4])) == \
+        [VirtualArduino.ACK_MESSAGE]
+    assert arduino.receive(instruction(0, (0, 0, 0), leds)) == \
+        [VirtualArduino.ERROR_MESSAGE]
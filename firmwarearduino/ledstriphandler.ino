@@ -6,7 +6,11 @@
     which the instruction is encoded, via its serial port. Each instruction 
     received represents a block that consits in a fixed amount of LEDs. Using an
     Arduino MEGA is possible to manage up to 960 LED strip where Each LED uses 
-    3 bytes of memory.
+    3 bytes of memory. The same instruction can also be received as a compact
+    binary frame, its layout is described in BinaryCodec.py of the arena
+    handler. A binary frame with the STAGED flag only writes the LED array,
+    the strip keeps showing the previous state until a SHOW frame, so a
+    whole state appears at once.
 
 	The circuit:
     The LED strip APA102 is connected to the Arduino in the follwoing inputs:
@@ -29,8 +33,19 @@
 #define CLOCK_PIN 53
 #define DEFAULT_BRIGHTNESS 25
 #define SRATE 57600
+#define SYNC 0xA5
+#define PROTOCOL_VERSION 1
+#define OP_FILL 0x01
+#define OP_LEDS 0x02
+#define OP_SHOW 0x03
+#define OP_STAGED 0x40
+#define OP_HELLO 0x10
+#define HEADER_SIZE 9
+#define LED_SIZE 5
+#define FRAME_SIZE 256
 
 CRGB leds[NUM_LEDS];
+byte frame[FRAME_SIZE];
 
 /*
     Setting up the baud rate for the serial communication, the input pins,
@@ -55,6 +70,11 @@ void serialEvent()
 {
     while (Serial.available() > 0)
     {
+        if (Serial.peek() == SYNC)
+        {
+            readFrame();
+            continue;
+        }
         StaticJsonBuffer<300> jsonBuffer;
         JsonObject &root = jsonBuffer.parseObject(Serial);
 
@@ -166,4 +186,86 @@ void serialEvent()
         FastLED.show();
         Serial.println("Instruction executed successfully!");
     }
-}
\ No newline at end of file
+}
+
+/*
+    This method reads one binary frame. The frame is applied only once the
+    whole frame is received and its checksum verified, the same aknowledge
+    as for the JSON instructions is printed. The HELLO frame is answered
+    with the protocol version so the host knows it can use binary frames.
+    A STAGED frame is not shown, the SHOW frame sets the brightness and
+    shows every LED written since the last show.
+*/
+void readFrame()
+{
+    if (Serial.readBytes(frame, HEADER_SIZE) != HEADER_SIZE ||
+        frame[1] != PROTOCOL_VERSION)
+    {
+        Serial.println("Binary frame failed");
+        return;
+    }
+    byte opcode = frame[2] & ~OP_STAGED;
+    boolean staged = frame[2] & OP_STAGED;
+    int length = HEADER_SIZE + frame[8] * LED_SIZE + 1;
+    if (opcode == OP_FILL)
+    {
+        length += 3;
+    }
+    if (length > FRAME_SIZE ||
+        Serial.readBytes(frame + HEADER_SIZE, length - HEADER_SIZE) != length - HEADER_SIZE)
+    {
+        Serial.println("Binary frame failed");
+        return;
+    }
+    byte checksum = 0;
+    for (int i = 1; i < length - 1; i++)
+    {
+        checksum += frame[i];
+    }
+    if (checksum != frame[length - 1] ||
+        (opcode != OP_FILL && opcode != OP_LEDS && opcode != OP_SHOW &&
+         opcode != OP_HELLO))
+    {
+        Serial.println("Binary frame failed");
+        return;
+    }
+    if (opcode == OP_HELLO)
+    {
+        Serial.println("MoCA binary 1");
+        return;
+    }
+    if (opcode == OP_SHOW)
+    {
+        LEDS.setBrightness(frame[3]);
+        FastLED.show();
+        Serial.println("Instruction executed successfully!");
+        return;
+    }
+
+    long blockIndex = word(frame[4], frame[5]);
+    long blockSize = word(frame[6], frame[7]);
+    long start = blockIndex * blockSize;
+    int offset = HEADER_SIZE;
+    if (opcode == OP_FILL)
+    {
+        for (long i = start; i < start + blockSize && i < NUM_LEDS; i++)
+        {
+            leds[i].setRGB(frame[offset], frame[offset + 1], frame[offset + 2]);
+        }
+        offset += 3;
+    }
+    for (int n = 0; n < frame[8]; n++, offset += LED_SIZE)
+    {
+        long i = start + word(frame[offset], frame[offset + 1]);
+        if (i < NUM_LEDS)
+        {
+            leds[i].setRGB(frame[offset + 2], frame[offset + 3], frame[offset + 4]);
+        }
+    }
+    if (!staged)
+    {
+        LEDS.setBrightness(frame[3]);
+        FastLED.show();
+    }
+    Serial.println("Instruction executed successfully!");
+}